@@ -0,0 +1,881 @@
+########################################################################################################
+# benchmarks.py
+# Timing harness for the performance-sensitive parts of Forcastia Tales: The Marked.
+#    python benchmarks.py               runs every benchmark
+#    python benchmarks.py renderMap     runs only the named benchmarks
+# Each benchmark times the current code against the approach it replaced, on a freshly generated level,
+# and checks that both produce the same result.
+########################################################################################################
+
+import ctypes
+import os
+import random
+import shelve
+import shutil
+import sys
+import tempfile
+import timeit
+
+import libtcodpy as libtcod
+import themarked as game
+
+#Each timing is repeated this many times, and the best run is reported, since it is the one least
+#disturbed by whatever else the machine was doing.
+REPEAT = 5
+
+#This function times a function, returning the best time of a single call in milliseconds.
+def timeCall(function, number, repeat = REPEAT):
+	times = timeit.repeat(function, repeat = repeat, number = number)
+	return min(times) / number * 1000.0
+
+#This function prints one line comparing the old and new timings.
+def report(name, oldTime, newTime):
+	print("%-36s old %9.3f ms   new %9.3f ms   %7.1fx" % (name, oldTime, newTime, oldTime / newTime))
+
+#This function prints a warning when the old and new code disagree.
+def check(name, same):
+	if not same:
+		print("%-36s WARNING: old and new results differ" % name)
+
+#This function starts a new game, so that the benchmarks have a level, a player and an FOV map.
+def setUpGame():
+	game.startNewGame()
+	libtcod.map_compute_fov(game.fovMap, game.player.x, game.player.y, game.TORCH_RADIUS,
+		game.FOV_LIGHT_WALLS, game.FOV_ALGO)
+
+#This function returns the background color of every cell of a console, for comparing results.
+def consoleBackgrounds(console, width, height):
+	return [tuple(libtcod.console_get_char_background(console, x, y))
+		for y in range(height) for x in range(width)]
+
+#########################################################################################################
+#renderMap: the map background pass in renderAll.
+
+#This function is the per-tile loop renderAll used before renderMap: one FOV query and one
+#console_set_char_background call for every tile on the map.
+def legacyRenderMap():
+	map = game.map
+	for y in range(game.MAP_HEIGHT):
+		for x in range(game.MAP_WIDTH):
+			i = map.index(x, y)
+			visible = libtcod.map_is_in_fov(game.fovMap, x, y)
+			wall = map.blockSight[i]
+			if not visible:
+				if map.explored[i]:
+					if wall:
+						libtcod.console_set_char_background(game.con, x, y, game.cDarkWall, libtcod.BKGND_SET)
+					else:
+						libtcod.console_set_char_background(game.con, x, y, game.cDarkGround, libtcod.BKGND_SET)
+			else:
+				if wall:
+					libtcod.console_set_char_background(game.con, x, y, game.cLitWall, libtcod.BKGND_SET)
+				else:
+					libtcod.console_set_char_background(game.con, x, y, game.cLitGround, libtcod.BKGND_SET)
+				map.explored[i] = True
+
+def batchedRenderMap():
+	game.renderMap(game.visibleTiles())
+
+def benchRenderMap():
+	setUpGame()
+
+	#Both versions must paint the same colors and explore the same tiles.
+	explored = game.toFlagArray(game.map.explored)
+	libtcod.console_clear(game.con)
+	legacyRenderMap()
+	oldResult = (consoleBackgrounds(game.con, game.MAP_WIDTH, game.MAP_HEIGHT), list(game.map.explored))
+	game.map.explored = game.toFlagArray(explored)
+	libtcod.console_clear(game.con)
+	batchedRenderMap()
+	newResult = (consoleBackgrounds(game.con, game.MAP_WIDTH, game.MAP_HEIGHT), list(game.map.explored))
+	check("renderMap", oldResult == newResult)
+
+	report("renderMap", timeCall(legacyRenderMap, 20), timeCall(batchedRenderMap, 20))
+
+#########################################################################################################
+#buildFOVMap: filling the FOV map from the tile arrays, on every new game, load and level change.
+
+#This function is the loop initializeFOV used before buildFOVMap: one map_set_properties call for every
+#tile on the map.
+def legacyBuildFOVMap():
+	map = game.map
+	for y in range(game.MAP_HEIGHT):
+		for x in range(game.MAP_WIDTH):
+			i = map.index(x, y)
+			libtcod.map_set_properties(game.fovMap, x, y, not map.blockSight[i], not map.blocked[i])
+
+def bulkBuildFOVMap():
+	game.buildFOVMap(game.fovMap, game.map)
+
+#This function returns the transparent and walkable flags of every cell of the FOV map.
+def fovMapCells():
+	return [(libtcod.map_is_transparent(game.fovMap, x, y), libtcod.map_is_walkable(game.fovMap, x, y))
+		for y in range(game.MAP_HEIGHT) for x in range(game.MAP_WIDTH)]
+
+def benchBuildFOVMap():
+	setUpGame()
+	
+	libtcod.map_clear(game.fovMap, True, True)
+	legacyBuildFOVMap()
+	oldResult = fovMapCells()
+	libtcod.map_clear(game.fovMap, True, True)
+	bulkBuildFOVMap()
+	check("buildFOVMap", oldResult == fovMapCells())
+	
+	report("buildFOVMap", timeCall(legacyBuildFOVMap, 20), timeCall(bulkBuildFOVMap, 20))
+
+#########################################################################################################
+#fov: the FOV engines, across radii and map sizes.
+
+FOV_MAP_SIZES = [(80, 43), (160, 86), (320, 172)]
+FOV_RADII = [5, 10, 20, 0]
+FOV_LIBTCOD_ALGORITHMS = [("basic", libtcod.FOV_BASIC), ("diamond", libtcod.FOV_DIAMOND),
+	("shadow", libtcod.FOV_SHADOW), ("permissive4", libtcod.FOV_PERMISSIVE_4),
+	("restrictive", libtcod.FOV_RESTRICTIVE)]
+
+#This function makes a cave-like grid of the given size: open ground scattered with single walls, with a
+#solid wall all around the edge and a clear spot in the middle for the viewer.
+def caveGrid(width, height, seed = 1):
+	rng = random.Random(seed)
+	grid = game.TileGrid(width, height, False)
+	for y in range(height):
+		for x in range(width):
+			if x in (0, width - 1) or y in (0, height - 1) or rng.random() < 0.25:
+				grid.blocked[grid.index(x, y)] = True
+				grid.blockSight[grid.index(x, y)] = True
+	grid.blocked[grid.index(width / 2, height / 2)] = False
+	grid.blockSight[grid.index(width / 2, height / 2)] = False
+	return grid
+
+def benchFOV():
+	names = [name for (name, algorithm) in FOV_LIBTCOD_ALGORITHMS] + sorted(game.FOV_ENGINES)
+	if libtcod.HEADLESS:
+		print("(libtcod is running on the headless backend, so its algorithms are timed in Python too)")
+	print("%-16s" % "fov (ms)" + "".join("%12s" % name for name in names))
+	for (width, height) in FOV_MAP_SIZES:
+		grid = caveGrid(width, height)
+		(x, y) = (width / 2, height / 2)
+		with libtcod.NativeHandle(libtcod.map_new(width, height), libtcod.map_delete) as fovMap:
+			game.buildFOVMap(fovMap, grid)
+			for radius in FOV_RADII:
+				times = []
+				for (name, algorithm) in FOV_LIBTCOD_ALGORITHMS:
+					times.append(timeCall(lambda: libtcod.map_compute_fov(fovMap, x, y, radius, True, algorithm), 2))
+				for name in sorted(game.FOV_ENGINES):
+					engine = game.FOV_ENGINES[name]
+					times.append(timeCall(lambda: engine(grid, x, y, radius, True), 2))
+				label = "%dx%d r=%s" % (width, height, radius or "all")
+				print("%-16s" % label + "".join("%12.3f" % time for time in times))
+
+#########################################################################################################
+#generateLevel: building a level, from small maps up to maps with thousands of rooms.
+
+GENERATION_SIZES = [(80, 43, 30), (400, 200, 1000), (1000, 500, 6000)]
+
+#These functions are the carving functions generateLevel used before TileGrid.carve, which open up the
+#tiles one at a time.
+def legacyCarveRoom(map, room):
+	for x in range(room.x1 + 1, room.x2):
+		for y in range(room.y1 + 1, room.y2):
+			i = map.index(x, y)
+			map.blocked[i] = False
+			map.blockSight[i] = False
+
+def legacyCarveHorizontalTunnel(map, x1, x2, y):
+	for x in range(min(x1, x2), max(x1, x2) + 1):
+		i = map.index(x, y)
+		map.blocked[i] = False
+		map.blockSight[i] = False
+
+def legacyCarveVerticalTunnel(map, y1, y2, x):
+	for y in range(min(y1, y2), max(y1, y2) + 1):
+		i = map.index(x, y)
+		map.blocked[i] = False
+		map.blockSight[i] = False
+
+#This function builds a level the way generateLevel used to: every new room is tested against all the
+#rooms before it, and carved one tile at a time.
+def legacyGenerateLevel(width, height, maxRooms):
+	carvers = (game.carveRoom, game.carveHorizontalTunnel, game.carveVerticalTunnel, game.ROOM_OVERLAP_TEST)
+	(game.carveRoom, game.carveHorizontalTunnel, game.carveVerticalTunnel, game.ROOM_OVERLAP_TEST) = (
+		legacyCarveRoom, legacyCarveHorizontalTunnel, legacyCarveVerticalTunnel, "rectangles")
+	try:
+		return game.generateLevel(1, 1, width, height, maxRooms)
+	finally:
+		(game.carveRoom, game.carveHorizontalTunnel, game.carveVerticalTunnel, game.ROOM_OVERLAP_TEST) = carvers
+
+def gridGenerateLevel(width, height, maxRooms):
+	return game.generateLevel(1, 1, width, height, maxRooms)
+
+#This function returns what a level is made of, for comparing levels.
+def levelContents(level):
+	return (list(level.map.blocked), list(level.map.blockSight), [(obj.name, obj.x, obj.y) for obj in level.objects])
+
+def benchGenerateLevel():
+	for (width, height, maxRooms) in GENERATION_SIZES:
+		name = "generateLevel %dx%d, %d rooms" % (width, height, maxRooms)
+		check(name, levelContents(legacyGenerateLevel(width, height, maxRooms)) ==
+			levelContents(gridGenerateLevel(width, height, maxRooms)))
+		report(name, timeCall(lambda: legacyGenerateLevel(width, height, maxRooms), 1, 3),
+			timeCall(lambda: gridGenerateLevel(width, height, maxRooms), 1, 3))
+
+#########################################################################################################
+#saveGame: saving and loading a game, in the binary format and in the shelve it replaced.
+
+#This function is saveGame as it was before the binary format: the whole game pickled into a shelve.
+def legacySaveGame():
+	file = shelve.open(game.LEGACY_SAVE_FILE, "n")
+	file["map"] = game.map
+	file["objects"] = game.objects
+	file["playerIndex"] = game.objects.index(game.player)
+	file["inventory"] = game.inventory
+	file["messageLog"] = list(game.messageLog)
+	file["gameState"] = game.gameState
+	file["stairsIndex"] = game.objects.index(game.stairsDown)
+	file["dungeonLevel"] = game.dungeonLevel
+	file["gameSeed"] = game.gameSeed
+	file.close()
+
+#This function returns the total size of the files in the current directory.
+def directorySize():
+	return sum(os.path.getsize(name) for name in os.listdir("."))
+
+def benchSaveGame():
+	setUpGame()
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	try:
+		#The shelve is written and read back on its own first, to measure its size.
+		legacySaveGame()
+		legacySize = directorySize()
+		report("saveGame", timeCall(legacySaveGame, 10), timeCall(game.saveGame, 10))
+		report("loadGame (decoding only)", timeCall(game.loadLegacyGame, 10),
+			timeCall(lambda: game.decodeGame(open(game.saveFilePath(0), "rb").read()), 10))
+		newSize = os.path.getsize(game.saveFilePath(0))
+		print("%-36s old %9d B    new %9d B    %7.1fx" % ("save file size", legacySize, newSize,
+			float(legacySize) / newSize))
+	finally:
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#saveGameAsync: how long saving holds up the game thread, when the save is written there or in the background.
+
+#This function times the calls to a save function, returning the best time in milliseconds. The background
+#save is waited for after each call, outside the timing, so that every call really saves.
+def timeSave(save, number = 20):
+	times = []
+	for i in range(number):
+		start = timeit.default_timer()
+		save()
+		times.append(timeit.default_timer() - start)
+		game.saver.wait()
+	return min(times) * 1000.0
+
+def benchSaveGameAsync():
+	setUpGame()
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	try:
+		report("save, time on the game thread", timeSave(game.saveGame), timeSave(game.saveGameAsync))
+	finally:
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#levelArchive: entering a level, and looking at a level that isn't loaded, with hundreds of levels stored.
+
+ARCHIVE_LEVELS = 300
+
+def benchLevelArchive():
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	try:
+		setUpGame()
+		archive = game.archive
+		for depth in range(1, ARCHIVE_LEVELS + 1):
+			archive.store(game.generateLevel(depth, game.levelSeed(depth)))
+		archive.open(archive.path)
+		depth = ARCHIVE_LEVELS / 2
+		
+		#Before the archive, a level could only be had by generating it again, and a level was only kept
+		#whole, in memory.
+		check("levelArchive", levelContents(archive.load(depth)) ==
+			levelContents(game.generateLevel(depth, game.levelSeed(depth))))
+		report("enter level %d of %d" % (depth, ARCHIVE_LEVELS),
+			timeCall(lambda: game.generateLevel(depth, game.levelSeed(depth)), 10),
+			timeCall(lambda: archive.load(depth), 10))
+		report("read a stored level's explored tiles", timeCall(lambda: archive.load(depth).map.explored, 10),
+			timeCall(lambda: archive.layer(depth, "explored"), 10))
+		print("%-36s %d levels in %d B" % ("level archive size", ARCHIVE_LEVELS, os.path.getsize(archive.path)))
+		archive.close()
+	finally:
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#levelCache: going back and forth between two levels, through the level archive or the level cache.
+
+#This function takes the player down the stairs, or up them, as the player does, saving the game on the new
+#level. Without the cache, the level left is stored in the archive and freed at once, as every level left
+#used to be, so the level entered is loaded from the archive and has its FOV map built again.
+def changeLevel(down, cached):
+	cacheSize = game.LEVEL_CACHE_SIZE
+	if not cached:
+		game.currentLevel.dirty = True
+		game.LEVEL_CACHE_SIZE = 0
+	try:
+		if down:
+			game.nextLevel()
+		else:
+			game.previousLevel()
+	finally:
+		game.LEVEL_CACHE_SIZE = cacheSize
+
+def benchLevelCache():
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	try:
+		setUpGame()
+		game.journal.start()
+		changeLevel(True, True)
+		before = levelContents(game.currentLevel)
+		changeLevel(False, False)
+		changeLevel(True, False)
+		check("levelCache", before == levelContents(game.currentLevel))
+		report("go up or down a level and back", timeCall(lambda: (changeLevel(False, False), changeLevel(True, False)), 10),
+			timeCall(lambda: (changeLevel(False, True), changeLevel(True, True)), 10))
+		
+		#Levels that haven't changed since they were stored are not stored again.
+		size = game.archive.end
+		for i in range(10):
+			changeLevel(False, True)
+			changeLevel(True, True)
+		check("levelCache archive size", game.archive.end == size)
+		game.journal.stop()
+		game.archive.close()
+	finally:
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#journal: autosaving every turn, by saving the whole game or by appending the turn's changes to the journal.
+
+#This function takes one turn: the player steps back and forth, and the monsters act, and the turn is
+#marked as a change to journal, as playGame does.
+def takeTurn(turn):
+	for (dx, dy) in game.DIRECTIONS:
+		if not game.isBlocked(game.player.x + dx, game.player.y + dy):
+			break
+	if turn % 2:
+		(dx, dy) = (-dx, -dy)
+	game.playerMoveOrAttack(dx, dy)
+	game.scheduler.advance(game.actionDelay(game.player))
+	game.journal.changed = True
+
+def benchJournal():
+	setUpGame()
+	game.player.fighter.hits = game.player.fighter.cond = 30000
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	turns = iter(range(1000000))
+	try:
+		def saveEveryTurn():
+			takeTurn(next(turns))
+			game.saveGame()
+		def journalEveryTurn():
+			takeTurn(next(turns))
+			game.journal.endTurn()
+		
+		oldTime = timeCall(saveEveryTurn, 50)
+		game.journal.start()
+		newTime = timeCall(journalEveryTurn, 50)
+		
+		#Input that changes nothing, such as the mouse moving, used to be diffed against the last turn too.
+		idleTimes = (timeCall(game.journal.writeChanges, 50), timeCall(game.journal.endTurn, 50))
+		game.journal.stop()
+		
+		#Loading replays the journal, which must bring back the game as it was.
+		before = [(obj.uid, obj.x, obj.y, obj.fighter and obj.fighter.cond) for obj in game.objects]
+		game.loadGame()
+		check("journal", before == [(obj.uid, obj.x, obj.y, obj.fighter and obj.fighter.cond) for obj in game.objects])
+		report("turn with autosave", oldTime, newTime)
+		report("idle event with autosave", *idleTimes)
+	finally:
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#entityLayer: drawing the objects on the map, each frame, with more and more objects in view.
+
+ENTITY_COUNTS = [20, 200, 1000]
+
+#These functions are how renderAll and playGame drew and erased the objects before the EntityLayer: a call
+#into libtcod to draw each object, and another to erase it, every frame.
+def legacyDrawObjects():
+	for obj in game.objects:
+		if obj != game.player:
+			obj.draw()
+	game.player.draw()
+
+def legacyClearObjects():
+	for obj in game.objects:
+		obj.clear()
+
+#This function returns the character and, where there is one, its color, in every cell of con.
+def entityCells():
+	cells = []
+	for y in range(game.MAP_HEIGHT):
+		for x in range(game.MAP_WIDTH):
+			char = libtcod.console_get_char(game.con, x, y)
+			color = tuple(libtcod.console_get_char_foreground(game.con, x, y)) if char != ord(" ") else None
+			cells.append((char, color))
+	return cells
+
+def benchEntityLayer():
+	setUpGame()
+	random.seed(1)
+	(objects, visibility) = (game.objects, game.visibility)
+	game.visibility = game.toFlagArray([True] * (game.MAP_WIDTH * game.MAP_HEIGHT))
+	try:
+		for count in ENTITY_COUNTS:
+			game.objects = list(objects)
+			while len(game.objects) < count:
+				game.objects.append(game.Object(random.randrange(game.MAP_WIDTH), random.randrange(game.MAP_HEIGHT),
+					"o", "orc", libtcod.Color(random.randrange(256), random.randrange(256), random.randrange(256))))
+			
+			libtcod.console_clear(game.con)
+			legacyDrawObjects()
+			oldCells = entityCells()
+			libtcod.console_clear(game.con)
+			game.entityLayer.reset()
+			game.entityLayer.render(game.con)
+			check("entityLayer %d objects" % count, oldCells == entityCells())
+			
+			#Every object moves each frame, back and forth, which is as much as can change.
+			def moveAll():
+				for obj in game.objects:
+					obj.x ^= 1
+			def oldFrame():
+				legacyClearObjects()
+				moveAll()
+				legacyDrawObjects()
+			def newFrame():
+				moveAll()
+				game.entityLayer.render(game.con)
+			number = 20000 / count
+			report("draw %d objects, none moving" % count,
+				timeCall(lambda: (legacyClearObjects(), legacyDrawObjects()), number),
+				timeCall(lambda: game.entityLayer.render(game.con), number))
+			report("draw %d objects, all moving" % count, timeCall(oldFrame, number), timeCall(newFrame, number))
+	finally:
+		(game.objects, game.visibility) = (objects, visibility)
+		libtcod.console_clear(game.con)
+		game.entityLayer.reset()
+
+#########################################################################################################
+#messageLog: telling the player a fight's worth of messages, and drawing the log in the panel every frame.
+
+#The messages of a big fight, many of them the same as the one before.
+FIGHT_MESSAGES = (["The orc attacks you for 3 hit points.", "You attack the orc for 5 hit points."] * 10 +
+	["The fireball explodes, burning everything within 3 tiles!"] + ["The troll gets burned for 12 hit points."] * 20)
+
+#This function is message as it was before the MessageLog: every message is wrapped, and the oldest lines
+#are deleted from the front of a list.
+def legacyMessage(log, text, color):
+	for line in game.textwrap.wrap(text, game.MESSAGE_WIDTH):
+		if len(log) == game.MESSAGE_HEIGHT:
+			del log[0]
+		log.append((line, color))
+
+def benchMessageLog():
+	setUpGame()
+	
+	#Without repeats, the new log shows the same lines as the old one.
+	(oldLog, newLog) = ([], game.MessageLog())
+	for (i, text) in enumerate(FIGHT_MESSAGES):
+		legacyMessage(oldLog, text + " " + str(i), libtcod.white)
+		newLog.add(text + " " + str(i), libtcod.white)
+	check("messageLog", oldLog == list(newLog))
+	
+	def oldFight():
+		log = []
+		for text in FIGHT_MESSAGES:
+			legacyMessage(log, text, libtcod.white)
+	def newFight():
+		log = game.MessageLog()
+		for text in FIGHT_MESSAGES:
+			log.add(text, libtcod.white)
+	report("%d messages in a fight" % len(FIGHT_MESSAGES), timeCall(oldFight, 100), timeCall(newFight, 100))
+
+#########################################################################################################
+#statusPanel: drawing the status panel every frame, as it was, or only the widgets whose inputs changed.
+
+#This function is how renderAll drew the whole status panel, every frame.
+def legacyRenderPanel():
+	panel = game.panel
+	libtcod.console_set_default_background(panel, libtcod.black)
+	libtcod.console_clear(panel)
+	y = 1
+	for (line, color) in game.messageLog:
+		libtcod.console_set_default_foreground(panel, color)
+		libtcod.console_print_ex(panel, game.MESSAGE_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+		y += 1
+	game.renderStatusBar(panel, 1, 1, game.BAR_WIDTH, "Health", game.player.fighter.cond, game.player.fighter.hits,
+		libtcod.red, libtcod.darkest_red)
+	libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT, "Dungeon Level: " + str(game.dungeonLevel))
+	libtcod.console_set_default_foreground(panel, libtcod.light_gray)
+	libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, game.getNamesUnderMouse())
+	libtcod.console_blit(panel, 0, 0, game.SCREEN_WIDTH, game.PANEL_HEIGHT, 0, 0, game.PANEL_Y)
+
+#This function returns the character, foreground and background of every cell of the panel on the screen.
+def panelCells():
+	return [(libtcod.console_get_char(0, x, y), tuple(libtcod.console_get_char_foreground(0, x, y)),
+		tuple(libtcod.console_get_char_background(0, x, y)))
+		for y in range(game.PANEL_Y, game.SCREEN_HEIGHT) for x in range(game.SCREEN_WIDTH)]
+
+def benchStatusPanel():
+	setUpGame()
+	game.mouse = libtcod.Mouse()
+	for text in FIGHT_MESSAGES[:8]:
+		game.message(text, libtcod.light_red)
+	fighter = game.player.fighter
+	
+	#After the player takes a hit and a message is told, the panel on the screen is the same either way.
+	def takeHit():
+		fighter.cond = fighter.cond - 1 if fighter.cond > 1 else fighter.hits
+		game.message("The orc attacks you for 1 hit point.", libtcod.light_red)
+	game.statusPanel.render()
+	takeHit()
+	legacyRenderPanel()
+	oldCells = panelCells()
+	game.statusPanel.render()
+	check("statusPanel", oldCells == panelCells())
+	
+	report("draw the panel, unchanged", timeCall(legacyRenderPanel, 100), timeCall(game.statusPanel.render, 100))
+	report("draw the panel after a hit", timeCall(lambda: (takeHit(), legacyRenderPanel()), 100),
+		timeCall(lambda: (takeHit(), game.statusPanel.render()), 100))
+
+#########################################################################################################
+#menuCache: laying out a menu's window and showing it. The window of every menu used to be a new console,
+#which was never deleted.
+
+#The menus shown, in turn: the inventory, the level up menu, and the character screen.
+MENUS = [
+	("Press the key next to an item to use it, or any other to cancel.\n",
+		["Healing Potion", "Scroll of Lightning Bolt", "Sword(Equipped)", "Scroll of Confusion"], game.INVENTORY_WIDTH),
+	("Your skills are admirable, Marked. Tell me, how do you feel?\n",
+		["Constitution (+20 HP, from 100)", "Strength (+1 attack, from 4)", "Agility (+1 defense, from 1)"],
+		game.ADVANCE_MENU_WIDTH),
+	("Character Information\n\nLevel: 2\nExperience: 250\nExperience to level up: 350\n\nMaximum HP: 100\n"
+		"Attack: 4\nDefense: 1", [], game.MIRROR_SCREEN_WIDTH),
+]
+
+#This function is the way menu laid out its window before the menu cache: on a new console every time.
+def legacyMenuWindow(header, options, width):
+	headerHeight = libtcod.console_get_height_rect(game.con, 0, 0, width, game.SCREEN_HEIGHT, header)
+	if header == "":
+		headerHeight = 0
+	height = len(options) + headerHeight
+	window = libtcod.console_new(width, height)
+	libtcod.console_set_default_foreground(window, libtcod.white)
+	libtcod.console_print_rect_ex(window, 0, 0, width, height, libtcod.BKGND_NONE, libtcod.LEFT, header)
+	y = headerHeight
+	letterIndex = ord("a")
+	for optionText in options:
+		libtcod.console_print_ex(window, 0, y, libtcod.BKGND_NONE, libtcod.LEFT,
+			"(" + chr(letterIndex) + ") " + optionText)
+		y += 1
+		letterIndex += 1
+	return (window, height)
+
+#This function shows every menu in MENUS, with its window from the given function, the way menu does.
+def showMenus(menuWindow):
+	for (header, options, width) in MENUS:
+		(window, height) = menuWindow(header, options, width)
+		libtcod.console_blit(window, 0, 0, width, height, 0, game.SCREEN_WIDTH / 2 - width / 2,
+			game.SCREEN_HEIGHT / 2 - height / 2, 1.0, 0.7)
+
+#This function returns the number of consoles and other objects libtcod has made and not yet freed, with
+#the headless backend.
+def liveHandles():
+	return len(libtcod.headless._handles)
+
+def benchMenuCache():
+	#Both ways, the menus leave the same cells on the screen, drawn over the same cleared screen, since they
+	#are blended with whatever is under them.
+	libtcod.console_clear(0)
+	showMenus(legacyMenuWindow)
+	oldCells = consoleCells(0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+	libtcod.console_clear(0)
+	showMenus(game.menuCache.window)
+	check("menuCache", oldCells == consoleCells(0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT))
+	
+	layOut = lambda menuWindow: [menuWindow(header, options, width) for (header, options, width) in MENUS]
+	report("lay out %d menus" % len(MENUS), timeCall(lambda: layOut(legacyMenuWindow), 100),
+		timeCall(lambda: layOut(game.menuCache.window), 100))
+	report("show %d menus" % len(MENUS), timeCall(lambda: showMenus(legacyMenuWindow), 100),
+		timeCall(lambda: showMenus(game.menuCache.window), 100))
+	if libtcod.headless is not None:
+		before = liveHandles()
+		showMenus(legacyMenuWindow)
+		leaked = liveHandles() - before
+		before = liveHandles()
+		showMenus(game.menuCache.window)
+		print("%-36s old %9d      new %9d" % ("consoles left behind", leaked, liveHandles() - before))
+
+#########################################################################################################
+#titleScreen: showing the title screen and the main menu. The title screen used to be drawn straight on the
+#screen on every pass of the main menu, and the game waited for its picture to load before showing anything.
+
+TITLE_IMAGE = "menu_background1.png"
+MAIN_MENU = ('', ["Start a New Adventure", "Continue a Previous Adventure", "Quit"], 40)
+
+#This function draws the title screen on the screen the way mainMenu used to, with the given picture.
+def legacyDrawTitle(image):
+	libtcod.image_blit_2x(image, 0, 0, 0)
+	libtcod.console_set_default_foreground(0, libtcod.light_yellow)
+	libtcod.console_print_ex(0, game.SCREEN_WIDTH / 2, game.SCREEN_HEIGHT / 2 - 6, libtcod.BKGND_NONE,
+		libtcod.CENTER, "FORCASTIA TALES: THE MARKED")
+	libtcod.console_print_ex(0, game.SCREEN_WIDTH / 2, game.SCREEN_HEIGHT / 2 - 4, libtcod.BKGND_NONE,
+		libtcod.CENTER, "2014 Studio Draconis")
+
+#This function shows the first frame of the main menu the way the game used to: once the picture was loaded.
+def legacyFirstFrame():
+	image = libtcod.image_load(TITLE_IMAGE)
+	legacyDrawTitle(image)
+	showMenu(legacyMenuWindow)
+	libtcod.image_delete(image)
+
+#This function shows the main menu over the title screen, with its window from the given function.
+def showMenu(menuWindow):
+	(header, options, width) = MAIN_MENU
+	(window, height) = menuWindow(header, options, width)
+	libtcod.console_blit(window, 0, 0, width, height, 0, game.SCREEN_WIDTH / 2 - width / 2,
+		game.SCREEN_HEIGHT / 2 - height / 2, 1.0, 0.7)
+
+#This function times the first frame of the main menu with a new title screen, whose picture is still
+#being loaded, in milliseconds. The loading is waited for after the time is taken.
+def timeFirstFrame():
+	times = []
+	for i in range(REPEAT):
+		titleScreen = game.TitleScreen(TITLE_IMAGE)
+		start = timeit.default_timer()
+		titleScreen.load()
+		titleScreen.render()
+		showMenu(game.menuCache.window)
+		times.append(timeit.default_timer() - start)
+		titleScreen.loader.join()
+		titleScreen.image.delete()
+		game.consolePool.release(titleScreen.console)
+	return min(times) * 1000.0
+
+def benchTitleScreen():
+	#Once the picture has arrived, the title screen is the same either way.
+	titleScreen = game.TitleScreen(TITLE_IMAGE)
+	titleScreen.load()
+	titleScreen.loader.join()
+	image = libtcod.image_load(TITLE_IMAGE)
+	#The headless image_blit_2x only paints the backgrounds, so whatever was on the screen is cleared first.
+	libtcod.console_set_default_foreground(0, libtcod.white)
+	libtcod.console_clear(0)
+	legacyDrawTitle(image)
+	oldCells = consoleCells(0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+	libtcod.console_clear(0)
+	titleScreen.render()
+	check("titleScreen", oldCells == consoleCells(0, game.SCREEN_WIDTH, game.SCREEN_HEIGHT))
+	
+	report("first frame of the main menu", timeCall(legacyFirstFrame, 1), timeFirstFrame())
+	report("show the title screen again", timeCall(lambda: legacyDrawTitle(image), 10),
+		timeCall(titleScreen.render, 10))
+	libtcod.image_delete(image)
+
+#########################################################################################################
+#liveHandles: native handles left alive by a long session. Each round starts a new game, goes down
+#SOAK_DEPTH levels and half way back up, with the monsters' flow field in use, and lays out new menus on
+#every level. Once the first round has filled the caches, later rounds must not leave any more handles.
+
+SOAK_ROUNDS = 5
+SOAK_DEPTH = 8
+
+#This function plays one round of the soak.
+def soakRound():
+	game.startNewGame()
+	for depth in range(2, SOAK_DEPTH + 1) + range(SOAK_DEPTH - 1, SOAK_DEPTH / 2 - 1, -1):
+		changeLevel(depth, True)
+		game.flowField.update()
+		for (header, options, width) in MENUS:
+			game.menuCache.window(header + "Depth %d" % depth, options, width)
+
+#This function returns whether handles owned by a NativeHandle are deleted at the end of a with block, by
+#delete(), and when the owner is collected, and counted until then.
+def ownedHandlesDeleted():
+	before = libtcod.live_handles()
+	counted = lambda kind, extra: libtcod.live_handles().get(kind, 0) == before.get(kind, 0) + extra
+	deleted = []
+	#Each owner is still referenced when the count is taken, so only the step being checked can have
+	#deleted its handle.
+	owner = libtcod.NativeHandle(libtcod.map_new(10, 10), libtcod.map_delete)
+	with owner as fovMap:
+		deleted.append(counted("map", 1))
+	deleted.append(counted("map", 0))
+	owner = libtcod.NativeHandle(libtcod.console_new(10, 10), libtcod.console_delete)
+	deleted.append(counted("console", 1))
+	owner.delete()
+	deleted.append(counted("console", 0))
+	owner.delete()
+	owner = libtcod.NativeHandle(libtcod.random_new_from_seed(1), libtcod.random_delete)
+	deleted.append(counted("random", 1))
+	del owner
+	deleted.append(counted("random", 0))
+	return all(deleted) and libtcod.live_handles() == before
+
+#This function formats the live handles by type.
+def handleCounts(counts):
+	return ", ".join("%s %d" % (kind, counts[kind]) for kind in sorted(counts))
+
+def benchLiveHandles():
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	#A level built in the background holds a random generator until it is finished, so levels are built
+	#in the foreground here, to keep the counts steady.
+	pregenerate = game.PREGENERATE_LEVELS
+	game.PREGENERATE_LEVELS = False
+	try:
+		check("liveHandles owned", ownedHandlesDeleted())
+		soakRound()
+		first = libtcod.live_handles()
+		for i in range(SOAK_ROUNDS - 1):
+			soakRound()
+		last = libtcod.live_handles()
+		print("%-36s %s" % ("live handles after round 1", handleCounts(first)))
+		print("%-36s %s" % ("live handles after round %d" % SOAK_ROUNDS, handleCounts(last)))
+		check("liveHandles", first == last)
+		game.archive.close()
+	finally:
+		game.PREGENERATE_LEVELS = pregenerate
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+#consoleBuffer: writing a ConsoleBuffer to a console, and filling a region of it.
+
+#The sizes of the buffers blitted: the map console, the whole screen, and a large console.
+BUFFER_SIZES = [(game.MAP_WIDTH, game.MAP_HEIGHT), (game.SCREEN_WIDTH, game.SCREEN_HEIGHT), (200, 120)]
+
+#This function returns the channels of a buffer as lists, the way ConsoleBuffer used to keep them.
+def channelLists(buffer):
+	return [list(getattr(buffer, name)) for name in buffer.channels]
+
+#This function is the blit ConsoleBuffer used when it kept each channel in a list: every channel is
+#copied into a new ctypes array, one Python value at a time.
+def legacyBlit(lists, dest):
+	(backR, backG, backB, foreR, foreG, foreB, char) = lists
+	n = len(backR)
+	libtcod._lib.TCOD_console_fill_background(dest, (ctypes.c_int * n)(*backR), (ctypes.c_int * n)(*backG),
+		(ctypes.c_int * n)(*backB))
+	libtcod._lib.TCOD_console_fill_foreground(dest, (ctypes.c_int * n)(*foreR), (ctypes.c_int * n)(*foreG),
+		(ctypes.c_int * n)(*foreB))
+	libtcod._lib.TCOD_console_fill_char(dest, (ctypes.c_int * n)(*char))
+
+#This function returns the background, foreground and character of every cell of a console.
+def consoleCells(console, width, height):
+	return [(tuple(libtcod.console_get_char_background(console, x, y)),
+		tuple(libtcod.console_get_char_foreground(console, x, y)), libtcod.console_get_char(console, x, y))
+		for y in range(height) for x in range(width)]
+
+#This function fills a region of a buffer one cell at a time, as was done before ConsoleBuffer.fill.
+def legacyFill(buffer, x, y, w, h):
+	for cellY in range(y, y + h):
+		for cellX in range(x, x + w):
+			buffer.set(cellX, cellY, 10, 20, 30, 200, 150, 100, "#")
+
+def benchConsoleBuffer():
+	random.seed(1)
+	for (width, height) in BUFFER_SIZES:
+		buffer = libtcod.ConsoleBuffer(width, height)
+		for i in range(width * height / 4):
+			buffer.set(random.randrange(width), random.randrange(height), random.randrange(256),
+				random.randrange(256), random.randrange(256), random.randrange(256), random.randrange(256),
+				random.randrange(256), chr(random.randrange(32, 127)))
+		console = libtcod.console_new(width, height)
+		lists = channelLists(buffer)
+		legacyBlit(lists, console)
+		oldCells = consoleCells(console, width, height)
+		libtcod.console_clear(console)
+		buffer.blit(console)
+		check("consoleBuffer blit %dx%d" % (width, height), oldCells == consoleCells(console, width, height))
+		report("blit %dx%d" % (width, height), timeCall(lambda: legacyBlit(lists, console), 10),
+			timeCall(lambda: buffer.blit(console), 10))
+		libtcod.console_delete(console)
+		
+		(x, y, w, h) = (width / 4, height / 4, width / 2, height / 2)
+		other = buffer.copy()
+		legacyFill(other, x, y, w, h)
+		buffer.fill(x, y, w, h, 10, 20, 30, 200, 150, 100, "#")
+		check("consoleBuffer fill %dx%d" % (w, h), channelLists(buffer) == channelLists(other))
+		report("fill %dx%d of %dx%d" % (w, h, width, height), timeCall(lambda: legacyFill(buffer, x, y, w, h), 10),
+			timeCall(lambda: buffer.fill(x, y, w, h, 10, 20, 30, 200, 150, 100, "#"), 10))
+
+#########################################################################################################
+#idleLoop: input that changes nothing on the screen, as when the mouse moves about within one cell. The game
+#loop used to draw a frame for every event, and FPS_LIMIT frames a second with no input at all.
+
+IDLE_EVENTS = 200
+
+#This function plays the game through IDLE_EVENTS mouse moves that stay in one cell, and then leaves it,
+#returning the number of frames drawn.
+def playIdle(eventDriven):
+	game.EVENT_DRIVEN_LOOP = eventDriven
+	for i in range(IDLE_EVENTS):
+		libtcod.headless.push_mouse(1, 1)
+	libtcod.headless.push_key(libtcod.KEY_ESCAPE)
+	frames = libtcod.headless.frame_count()
+	game.playGame()
+	return libtcod.headless.frame_count() - frames
+
+def benchIdleLoop():
+	#Input can only be made up with the headless backend.
+	if libtcod.headless is None:
+		print("%-36s needs the headless backend" % "idleLoop")
+		return
+	(oldDirectory, directory) = (os.getcwd(), tempfile.mkdtemp())
+	os.chdir(directory)
+	eventDriven = game.EVENT_DRIVEN_LOOP
+	try:
+		setUpGame()
+		(oldFrames, newFrames) = (playIdle(False), playIdle(True))
+		report("%d idle events" % IDLE_EVENTS, timeCall(lambda: playIdle(False), 1, 3),
+			timeCall(lambda: playIdle(True), 1, 3))
+		print("%-36s old %9d      new %9d" % ("frames drawn", oldFrames, newFrames))
+	finally:
+		game.EVENT_DRIVEN_LOOP = eventDriven
+		os.chdir(oldDirectory)
+		shutil.rmtree(directory)
+
+#########################################################################################################
+BENCHMARKS = [
+	("renderMap", benchRenderMap),
+	("buildFOVMap", benchBuildFOVMap),
+	("fov", benchFOV),
+	("generateLevel", benchGenerateLevel),
+	("saveGame", benchSaveGame),
+	("saveGameAsync", benchSaveGameAsync),
+	("levelArchive", benchLevelArchive),
+	("levelCache", benchLevelCache),
+	("journal", benchJournal),
+	("entityLayer", benchEntityLayer),
+	("messageLog", benchMessageLog),
+	("statusPanel", benchStatusPanel),
+	("menuCache", benchMenuCache),
+	("titleScreen", benchTitleScreen),
+	("liveHandles", benchLiveHandles),
+	("consoleBuffer", benchConsoleBuffer),
+	("idleLoop", benchIdleLoop),
+]
+
+if __name__ == "__main__":
+	names = sys.argv[1:]
+	for (name, benchmark) in BENCHMARKS:
+		if not names or name in names:
+			benchmark()
@@ -0,0 +1,1757 @@
+#
+# libtcod headless backend
+#
+# Pure-Python stand-in for the native libtcod library, used by libtcodpy when
+# libtcod.so (or the platform equivalent) cannot be loaded, or when the
+# LIBTCOD_HEADLESS environment variable is set. It implements the TCOD_* entry
+# points the wrapper calls for consoles, colors, events, random numbers, fov,
+# lines, pathfinding and images, so the wrapper functions work unchanged on
+# machines without SDL or a display.
+#
+# Nothing is ever drawn. Consoles live in memory and can be inspected with
+# console_get_char and friends, and input comes from an event queue that is
+# filled with push_key, push_char and push_mouse, or pulled from a callback set
+# with set_event_source. When the queue runs dry in a blocking call, the window
+# is reported as closed so that game loops terminate instead of hanging.
+#
+
+import collections
+import ctypes
+import heapq
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+
+############################
+# handles and argument helpers
+############################
+# Native libtcod hands out raw pointers, and the wrapper sometimes passes them
+# through c_void_p. Handles are therefore plain integers that index a table of
+# Python objects. Handle 0 is the root console (or the default random stream).
+# Handles are made and freed from more than one thread (a level built in the
+# background, an image loaded in the background), so the table is locked.
+_handles = {}
+_next_handle = [1]
+_handles_lock = threading.Lock()
+
+def _new_handle(obj):
+    with _handles_lock:
+        handle = _next_handle[0]
+        _next_handle[0] += 1
+        _handles[handle] = obj
+    return handle
+
+def _free_handle(handle):
+    handle = _value(handle)
+    with _handles_lock:
+        _handles.pop(handle, None)
+
+def _value(v):
+    # unwraps c_int, c_float, c_void_p, c_char_p and friends into Python values.
+    # c_void_p(0).value is None, which stands for the root console.
+    if isinstance(v, ctypes._SimpleCData):
+        v = v.value
+    if v is None:
+        return 0
+    return v
+
+def _deref(ref):
+    # returns the ctypes object behind a byref() argument.
+    return getattr(ref, '_obj', ref)
+
+def _text(s):
+    s = _value(s)
+    if s == 0:
+        return ''
+    if isinstance(s, bytes) and not isinstance(s, str):
+        s = s.decode('latin-1')
+    return s
+
+def _rgb(col):
+    return (col[0], col[1], col[2])
+
+def _color(rgb):
+    from libtcodpy import Color
+    return Color(*rgb)
+
+def _clamp(v):
+    return max(0, min(255, int(v)))
+
+class UnsupportedError(Exception):
+    # raised when a libtcod function this backend does not provide is called.
+    pass
+
+def _unsupported(name):
+    def func(*args):
+        raise UnsupportedError('%s is not available in the headless libtcod backend' % name)
+    func.__name__ = name
+    return func
+
+############################
+# color module
+############################
+def TCOD_color_equals(c1, c2):
+    return _rgb(c1) == _rgb(c2)
+
+def TCOD_color_multiply(c1, c2):
+    return _color([a * b // 255 for a, b in zip(_rgb(c1), _rgb(c2))])
+
+def TCOD_color_multiply_scalar(c, v):
+    v = _value(v)
+    return _color([_clamp(a * v) for a in _rgb(c)])
+
+def TCOD_color_add(c1, c2):
+    return _color([_clamp(a + b) for a, b in zip(_rgb(c1), _rgb(c2))])
+
+def TCOD_color_subtract(c1, c2):
+    return _color([_clamp(a - b) for a, b in zip(_rgb(c1), _rgb(c2))])
+
+def _lerp(c1, c2, a):
+    return tuple(int(x + (y - x) * a) for x, y in zip(c1, c2))
+
+def TCOD_color_lerp(c1, c2, a):
+    return _color(_lerp(_rgb(c1), _rgb(c2), _value(a)))
+
+def _hsv(rgb):
+    r, g, b = [x / 255.0 for x in rgb]
+    mx = max(r, g, b)
+    mn = min(r, g, b)
+    v = mx
+    if mx == 0:
+        return 0.0, 0.0, v
+    s = (mx - mn) / mx
+    if mx == mn:
+        return 0.0, s, v
+    if mx == r:
+        h = (g - b) / (mx - mn)
+    elif mx == g:
+        h = 2 + (b - r) / (mx - mn)
+    else:
+        h = 4 + (r - g) / (mx - mn)
+    h *= 60
+    if h < 0:
+        h += 360
+    return h, s, v
+
+def _from_hsv(h, s, v):
+    if s == 0:
+        return (_clamp(v * 255),) * 3
+    h = (h % 360) / 60.0
+    i = int(h)
+    f = h - i
+    p = v * (1 - s)
+    q = v * (1 - s * f)
+    t = v * (1 - s * (1 - f))
+    r, g, b = [(v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)][i % 6]
+    return _clamp(r * 255), _clamp(g * 255), _clamp(b * 255)
+
+def TCOD_color_set_HSV(c, h, s, v):
+    c = _deref(c)
+    c.r, c.g, c.b = _from_hsv(_value(h), _value(s), _value(v))
+
+def TCOD_color_get_HSV(c, h, s, v):
+    hsv = _hsv(_rgb(c))
+    _deref(h).value, _deref(s).value, _deref(v).value = hsv
+
+def TCOD_color_scale_HSV(c, scoef, vcoef):
+    c = _deref(c)
+    h, s, v = _hsv(_rgb(c))
+    s = max(0.0, min(1.0, s * _value(scoef)))
+    v = max(0.0, min(1.0, v * _value(vcoef)))
+    c.r, c.g, c.b = _from_hsv(h, s, v)
+
+def TCOD_color_gen_map(cres, nb, ccolors, cindexes):
+    for seg in range(nb - 1):
+        start = cindexes[seg]
+        end = cindexes[seg + 1]
+        c1 = _rgb(ccolors[seg])
+        c2 = _rgb(ccolors[seg + 1])
+        for i in range(start, end + 1):
+            a = float(i - start) / (end - start) if end != start else 0.0
+            cres[i].r, cres[i].g, cres[i].b = _lerp(c1, c2, a)
+
+############################
+# console module
+############################
+BKGND_NONE = 0
+BKGND_SET = 1
+BKGND_MULTIPLY = 2
+BKGND_LIGHTEN = 3
+BKGND_DARKEN = 4
+BKGND_SCREEN = 5
+BKGND_COLOR_DODGE = 6
+BKGND_COLOR_BURN = 7
+BKGND_ADD = 8
+BKGND_ADDA = 9
+BKGND_BURN = 10
+BKGND_OVERLAY = 11
+BKGND_ALPH = 12
+BKGND_DEFAULT = 13
+
+LEFT = 0
+RIGHT = 1
+CENTER = 2
+
+COLCTRL_NUMBER = 5
+COLCTRL_FORE_RGB = 6
+COLCTRL_BACK_RGB = 7
+COLCTRL_STOP = 8
+
+def _blend_channel(b, c, mode, alpha):
+    if mode == BKGND_SET:
+        return c
+    if mode == BKGND_MULTIPLY:
+        return b * c // 255
+    if mode == BKGND_LIGHTEN:
+        return max(b, c)
+    if mode == BKGND_DARKEN:
+        return min(b, c)
+    if mode == BKGND_SCREEN:
+        return 255 - (255 - b) * (255 - c) // 255
+    if mode == BKGND_COLOR_DODGE:
+        return 255 if b == 255 else _clamp(255 * c // (255 - b))
+    if mode == BKGND_COLOR_BURN:
+        return 0 if c == 0 else _clamp(255 - 255 * (255 - b) // c)
+    if mode == BKGND_ADD:
+        return _clamp(b + c)
+    if mode == BKGND_ADDA:
+        return _clamp(b + alpha * c)
+    if mode == BKGND_BURN:
+        return _clamp(b + c - 255)
+    if mode == BKGND_OVERLAY:
+        if c <= 128:
+            return _clamp(2 * c * b // 255)
+        return _clamp(255 - 2 * (255 - c) * (255 - b) // 255)
+    if mode == BKGND_ALPH:
+        return _clamp(b + (c - b) * alpha)
+    return b
+
+def _blend(back, col, flag):
+    mode = flag & 0xff
+    if mode == BKGND_NONE:
+        return back
+    if mode == BKGND_SET:
+        return col
+    alpha = (flag >> 8) / 255.0
+    return tuple(_blend_channel(b, c, mode, alpha) for b, c in zip(back, col))
+
+class _Console(object):
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.fore_default = (255, 255, 255)
+        self.back_default = (0, 0, 0)
+        self.flag = BKGND_NONE
+        self.alignment = LEFT
+        self.key_color = None
+        self.clear()
+
+    def clear(self):
+        n = self.w * self.h
+        self.ch = [32] * n
+        self.fore = [self.fore_default] * n
+        self.back = [self.back_default] * n
+
+    def inside(self, x, y):
+        return 0 <= x < self.w and 0 <= y < self.h
+
+    def put(self, x, y, c, flag):
+        if not self.inside(x, y):
+            return
+        i = y * self.w + x
+        self.ch[i] = c
+        self.fore[i] = self.fore_default
+        if flag == BKGND_DEFAULT:
+            flag = self.flag
+        self.back[i] = _blend(self.back[i], self.back_default, flag)
+
+    def set_back(self, x, y, col, flag):
+        if not self.inside(x, y):
+            return
+        i = y * self.w + x
+        if flag == BKGND_DEFAULT:
+            flag = self.flag
+        self.back[i] = _blend(self.back[i], col, flag)
+
+class _State(object):
+    def __init__(self):
+        self.root = None
+        self.title = ''
+        self.fullscreen = False
+        self.closed = False
+        self.fps = 0
+        self.frames = 0
+        self.last_frame = 0.0
+        self.start = time.time()
+        self.last_time = self.start
+        self.fade = 255
+        self.fading_color = (0, 0, 0)
+        self.renderer = 2
+        self.frame_hook = None
+
+_state = _State()
+
+def _console(con):
+    con = _value(con)
+    if con == 0:
+        if _state.root is None:
+            raise RuntimeError('the root console has not been initialized')
+        return _state.root
+    return _handles[con]
+
+def TCOD_console_init_root(w, h, title, fullscreen, renderer):
+    _state.root = _Console(w, h)
+    _state.title = _text(title)
+    _state.fullscreen = bool(_value(fullscreen))
+    _state.renderer = _value(renderer)
+    _state.closed = False
+
+def TCOD_console_get_width(con):
+    return _console(con).w
+
+def TCOD_console_get_height(con):
+    return _console(con).h
+
+def TCOD_console_set_custom_font(fontFile, flags, nb_char_horiz, nb_char_vertic):
+    pass
+
+def TCOD_console_map_ascii_code_to_font(asciiCode, fontCharX, fontCharY):
+    pass
+
+def TCOD_console_map_ascii_codes_to_font(firstAsciiCode, nbCodes, fontCharX, fontCharY):
+    pass
+
+def TCOD_console_map_string_to_font(s, fontCharX, fontCharY):
+    pass
+
+TCOD_console_map_string_to_font_utf = TCOD_console_map_string_to_font
+
+def TCOD_console_is_fullscreen():
+    return _state.fullscreen
+
+def TCOD_console_set_fullscreen(fullscreen):
+    _state.fullscreen = bool(_value(fullscreen))
+
+def TCOD_console_is_window_closed():
+    return _state.closed
+
+def TCOD_console_set_window_title(title):
+    _state.title = _text(title)
+
+def TCOD_console_credits():
+    pass
+
+def TCOD_console_credits_reset():
+    pass
+
+def TCOD_console_credits_render(x, y, alpha):
+    return True
+
+def TCOD_console_flush():
+    now = time.time()
+    _state.last_frame = now - _state.last_time
+    _state.last_time = now
+    _state.frames += 1
+    if _state.frame_hook is not None:
+        _state.frame_hook(_state.root)
+
+def TCOD_console_set_default_background(con, col):
+    _console(con).back_default = _rgb(col)
+
+def TCOD_console_set_default_foreground(con, col):
+    _console(con).fore_default = _rgb(col)
+
+def TCOD_console_clear(con):
+    _console(con).clear()
+
+def TCOD_console_put_char(con, x, y, c, flag):
+    _console(con).put(_value(x), _value(y), _value(c), _value(flag))
+
+def TCOD_console_put_char_ex(con, x, y, c, fore, back):
+    con = _console(con)
+    x = _value(x)
+    y = _value(y)
+    if con.inside(x, y):
+        i = y * con.w + x
+        con.ch[i] = _value(c)
+        con.fore[i] = _rgb(fore)
+        con.back[i] = _rgb(back)
+
+def TCOD_console_set_char_background(con, x, y, col, flag):
+    _console(con).set_back(_value(x), _value(y), _rgb(col), _value(flag))
+
+def TCOD_console_set_char_foreground(con, x, y, col):
+    con = _console(con)
+    x = _value(x)
+    y = _value(y)
+    if con.inside(x, y):
+        con.fore[y * con.w + x] = _rgb(col)
+
+def TCOD_console_set_char(con, x, y, c):
+    con = _console(con)
+    x = _value(x)
+    y = _value(y)
+    if con.inside(x, y):
+        con.ch[y * con.w + x] = _value(c)
+
+def TCOD_console_set_background_flag(con, flag):
+    _console(con).flag = _value(flag)
+
+def TCOD_console_get_background_flag(con):
+    return _console(con).flag
+
+def TCOD_console_set_alignment(con, alignment):
+    _console(con).alignment = _value(alignment)
+
+def TCOD_console_get_alignment(con):
+    return _console(con).alignment
+
+def _split_controls(s):
+    # strips the color control codes, which have no meaning without a display.
+    out = []
+    i = 0
+    while i < len(s):
+        o = ord(s[i])
+        if o in (COLCTRL_FORE_RGB, COLCTRL_BACK_RGB):
+            i += 4
+            continue
+        if 1 <= o <= COLCTRL_NUMBER or o == COLCTRL_STOP:
+            i += 1
+            continue
+        out.append(s[i])
+        i += 1
+    return ''.join(out)
+
+def _wrap(s, w):
+    # word wraps s into lines at most w characters long, the way libtcod's
+    # print_rect functions do. w <= 0 disables wrapping.
+    lines = []
+    for para in s.split('\n'):
+        if w <= 0 or len(para) <= w:
+            lines.append(para)
+            continue
+        line = ''
+        for word in para.split(' '):
+            while len(word) > w:
+                if line:
+                    lines.append(line)
+                    line = ''
+                lines.append(word[:w])
+                word = word[w:]
+            if not line:
+                line = word
+            elif len(line) + 1 + len(word) <= w:
+                line += ' ' + word
+            else:
+                lines.append(line)
+                line = word
+        lines.append(line)
+    return lines
+
+def _print(con, x, y, w, h, flag, alignment, s, wrap):
+    con = _console(con)
+    x = _value(x)
+    y = _value(y)
+    w = _value(w)
+    h = _value(h)
+    flag = _value(flag)
+    alignment = _value(alignment)
+    s = _split_controls(_text(s))
+    if flag == BKGND_DEFAULT:
+        flag = con.flag
+    if wrap:
+        if w == 0:
+            w = con.w - x if alignment == LEFT else con.w
+        if h == 0:
+            h = con.h - y
+        lines = _wrap(s, w)[:h]
+    else:
+        lines = s.split('\n')
+    for n, line in enumerate(lines):
+        if alignment == LEFT:
+            start = x
+        elif alignment == RIGHT:
+            start = x - len(line) + 1
+        else:
+            start = x - len(line) // 2
+        for k, c in enumerate(line):
+            con.put(start + k, y + n, ord(c), flag)
+    return len(lines)
+
+def TCOD_console_print(con, x, y, fmt):
+    c = _console(con)
+    _print(con, x, y, 0, 0, c.flag, c.alignment, fmt, False)
+
+TCOD_console_print_utf = TCOD_console_print
+
+def TCOD_console_print_ex(con, x, y, flag, alignment, fmt):
+    _print(con, x, y, 0, 0, flag, alignment, fmt, False)
+
+TCOD_console_print_ex_utf = TCOD_console_print_ex
+
+def TCOD_console_print_rect(con, x, y, w, h, fmt):
+    c = _console(con)
+    return _print(con, x, y, w, h, c.flag, c.alignment, fmt, True)
+
+TCOD_console_print_rect_utf = TCOD_console_print_rect
+
+def TCOD_console_print_rect_ex(con, x, y, w, h, flag, alignment, fmt):
+    return _print(con, x, y, w, h, flag, alignment, fmt, True)
+
+TCOD_console_print_rect_ex_utf = TCOD_console_print_rect_ex
+
+def TCOD_console_get_height_rect(con, x, y, w, h, fmt):
+    c = _console(con)
+    w = _value(w) or c.w - _value(x)
+    h = _value(h) or c.h - _value(y)
+    return len(_wrap(_split_controls(_text(fmt)), w)[:h])
+
+TCOD_console_get_height_rect_utf = TCOD_console_get_height_rect
+
+def TCOD_console_rect(con, x, y, w, h, clr, flag):
+    c = _console(con)
+    x = _value(x)
+    y = _value(y)
+    clr = _value(clr)
+    flag = _value(flag)
+    if flag == BKGND_DEFAULT:
+        flag = c.flag
+    # setting the background, or leaving it, needs no blending, so whole rows
+    # are filled at once.
+    mode = flag & 0xff
+    x0 = max(0, x)
+    x1 = max(x0, min(c.w, x + _value(w)))
+    for cy in range(max(0, y), min(c.h, y + _value(h))):
+        row = cy * c.w
+        if mode == BKGND_SET:
+            c.back[row + x0:row + x1] = [c.back_default] * (x1 - x0)
+        elif mode != BKGND_NONE:
+            for cx in range(x0, x1):
+                c.set_back(cx, cy, c.back_default, flag)
+        if clr:
+            c.ch[row + x0:row + x1] = [32] * (x1 - x0)
+
+def TCOD_console_hline(con, x, y, l, flag):
+    for i in range(_value(l)):
+        TCOD_console_put_char(con, _value(x) + i, y, 196, flag)
+
+def TCOD_console_vline(con, x, y, l, flag):
+    for i in range(_value(l)):
+        TCOD_console_put_char(con, x, _value(y) + i, 179, flag)
+
+def TCOD_console_print_frame(con, x, y, w, h, clear, flag, fmt):
+    x = _value(x)
+    y = _value(y)
+    w = _value(w)
+    h = _value(h)
+    TCOD_console_rect(con, x, y, w, h, clear, flag)
+    TCOD_console_hline(con, x + 1, y, w - 2, flag)
+    TCOD_console_hline(con, x + 1, y + h - 1, w - 2, flag)
+    TCOD_console_vline(con, x, y + 1, h - 2, flag)
+    TCOD_console_vline(con, x + w - 1, y + 1, h - 2, flag)
+    TCOD_console_put_char(con, x, y, 218, flag)
+    TCOD_console_put_char(con, x + w - 1, y, 191, flag)
+    TCOD_console_put_char(con, x, y + h - 1, 192, flag)
+    TCOD_console_put_char(con, x + w - 1, y + h - 1, 217, flag)
+    title = _text(fmt)
+    if title:
+        _print(con, x + w // 2, y, 0, 0, BKGND_SET, CENTER, ' %s ' % title, False)
+
+def TCOD_console_set_color_control(con, fore, back):
+    pass
+
+def TCOD_console_get_default_background(con):
+    return _color(_console(con).back_default)
+
+def TCOD_console_get_default_foreground(con):
+    return _color(_console(con).fore_default)
+
+def TCOD_console_get_char_background(con, x, y):
+    c = _console(con)
+    return _color(c.back[_value(y) * c.w + _value(x)])
+
+def TCOD_console_get_char_foreground(con, x, y):
+    c = _console(con)
+    return _color(c.fore[_value(y) * c.w + _value(x)])
+
+def TCOD_console_get_char(con, x, y):
+    c = _console(con)
+    return c.ch[_value(y) * c.w + _value(x)]
+
+def TCOD_console_set_fade(fade, fadingColor):
+    _state.fade = _value(fade)
+    _state.fading_color = _rgb(fadingColor)
+
+def TCOD_console_get_fade():
+    return ctypes.c_uint8(_state.fade)
+
+def TCOD_console_get_fading_color():
+    return _color(_state.fading_color)
+
+def TCOD_console_new(w, h):
+    return _new_handle(_Console(_value(w), _value(h)))
+
+# ASCII Paint (.asc) files: a "ASCII-Paint v<version>" line, the width and
+# height, a '#', then the cells column by column. Each cell is the character,
+# the foreground and background as r, g, b bytes and, from version 0.3 on, two
+# bytes of solid/walkable flags that libtcod ignores.
+ASC_VERSION = 0.3
+
+def _read_asc(filename):
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+    header_end = data.find(b'#')
+    header = bytes(data[:header_end]).split()
+    if header_end < 0 or len(header) != 4 or header[0] != b'ASCII-Paint' or not header[1].startswith(b'v'):
+        raise ValueError('%s is not an ASCII Paint file' % filename)
+    version = float(header[1][1:])
+    w = int(header[2])
+    h = int(header[3])
+    size = 9 if version >= 0.3 else 7
+    cells = data[header_end + 1:]
+    if w <= 0 or h <= 0 or len(cells) < w * h * size:
+        raise ValueError('%s is not an ASCII Paint file' % filename)
+    c = _Console(w, h)
+    pos = 0
+    for x in range(w):
+        for y in range(h):
+            i = y * w + x
+            c.ch[i] = cells[pos]
+            c.fore[i] = tuple(cells[pos + 1:pos + 4])
+            c.back[i] = tuple(cells[pos + 4:pos + 7])
+            pos += size
+    return c
+
+def TCOD_console_from_file(filename):
+    return _new_handle(_read_asc(_text(filename)))
+
+def TCOD_console_load_asc(con, filename):
+    c = _console(con)
+    loaded = _read_asc(_text(filename))
+    c.w = loaded.w
+    c.h = loaded.h
+    c.ch = loaded.ch
+    c.fore = loaded.fore
+    c.back = loaded.back
+    return True
+
+def TCOD_console_save_asc(con, filename):
+    c = _console(con)
+    data = bytearray(('ASCII-Paint v%g\n%d %d\n#' % (ASC_VERSION, c.w, c.h)).encode('ascii'))
+    for x in range(c.w):
+        for y in range(c.h):
+            i = y * c.w + x
+            data.append(c.ch[i] & 0xff)
+            data.extend(c.fore[i])
+            data.extend(c.back[i])
+            data.extend((0, 1))
+    with open(_text(filename), 'wb') as f:
+        f.write(bytes(data))
+    return True
+
+def TCOD_console_delete(con):
+    con = _value(con)
+    if con == 0:
+        _state.root = None
+        _state.closed = True
+    else:
+        _free_handle(con)
+
+def TCOD_console_set_key_color(con, col):
+    _console(con).key_color = _rgb(col)
+
+def TCOD_console_blit(src, x, y, w, h, dst, xdst, ydst, ffade, bfade):
+    s = _console(src)
+    d = _console(dst)
+    x = _value(x)
+    y = _value(y)
+    w = _value(w) or s.w
+    h = _value(h) or s.h
+    xdst = _value(xdst)
+    ydst = _value(ydst)
+    ffade = _value(ffade)
+    bfade = _value(bfade)
+    # clip the rectangle to both consoles
+    if x < 0:
+        w += x
+        xdst -= x
+        x = 0
+    if y < 0:
+        h += y
+        ydst -= y
+        y = 0
+    if xdst < 0:
+        w += xdst
+        x -= xdst
+        xdst = 0
+    if ydst < 0:
+        h += ydst
+        y -= ydst
+        ydst = 0
+    w = min(w, s.w - x, d.w - xdst)
+    h = min(h, s.h - y, d.h - ydst)
+    if w <= 0 or h <= 0:
+        return
+    opaque = ffade >= 1.0 and bfade >= 1.0
+    for cy in range(h):
+        si = (y + cy) * s.w + x
+        di = (ydst + cy) * d.w + xdst
+        if opaque and s.key_color is None:
+            # plain copy, one row slice at a time
+            d.ch[di:di + w] = s.ch[si:si + w]
+            d.fore[di:di + w] = s.fore[si:si + w]
+            d.back[di:di + w] = s.back[si:si + w]
+            continue
+        for cx in range(w):
+            back = s.back[si + cx]
+            if s.key_color is not None and back == s.key_color:
+                continue
+            if opaque:
+                d.ch[di + cx] = s.ch[si + cx]
+                d.fore[di + cx] = s.fore[si + cx]
+                d.back[di + cx] = back
+                continue
+            d.back[di + cx] = _lerp(d.back[di + cx], back, bfade)
+            if s.ch[si + cx] == 32:
+                d.fore[di + cx] = _lerp(d.fore[di + cx], back, bfade)
+            else:
+                d.ch[di + cx] = s.ch[si + cx]
+                d.fore[di + cx] = _lerp(d.back[di + cx], s.fore[si + cx], ffade)
+
+def _ints(arr, n):
+    # reads n ints from a ctypes array, a POINTER(c_int) or a struct-packed string.
+    if isinstance(arr, (bytes, bytearray)):
+        return struct.unpack('%di' % n, bytes(arr[:n * 4]))
+    return arr[:n]
+
+def TCOD_console_fill_background(con, r, g, b):
+    c = _console(con)
+    n = c.w * c.h
+    c.back = list(zip(_ints(r, n), _ints(g, n), _ints(b, n)))
+
+def TCOD_console_fill_foreground(con, r, g, b):
+    c = _console(con)
+    n = c.w * c.h
+    c.fore = list(zip(_ints(r, n), _ints(g, n), _ints(b, n)))
+
+def TCOD_console_fill_char(con, arr):
+    c = _console(con)
+    c.ch = list(_ints(arr, c.w * c.h))
+
+############################
+# events
+############################
+KEY_NONE = 0
+KEY_CHAR = 65
+KEY_PRESSED = 1
+KEY_RELEASED = 2
+
+EVENT_NONE = 0
+EVENT_KEY_PRESS = 1
+EVENT_KEY_RELEASE = 2
+EVENT_MOUSE_MOVE = 4
+EVENT_MOUSE_PRESS = 8
+EVENT_MOUSE_RELEASE = 16
+
+CHAR_WIDTH = 8
+CHAR_HEIGHT = 8
+
+_KEY_FIELDS = ('vk', 'c', 'pressed', 'lalt', 'lctrl', 'ralt', 'rctrl', 'shift')
+_MOUSE_FIELDS = ('x', 'y', 'dx', 'dy', 'cx', 'cy', 'dcx', 'dcy',
+                 'lbutton', 'rbutton', 'mbutton', 'lbutton_pressed',
+                 'rbutton_pressed', 'mbutton_pressed', 'wheel_up', 'wheel_down')
+
+_events = collections.deque()
+_event_source = [None]
+_mouse = dict((f, 0) for f in _MOUSE_FIELDS)
+_keys_down = set()
+_cursor_visible = [True]
+
+def push_key(vk, c=0, pressed=True, lalt=False, lctrl=False, ralt=False,
+             rctrl=False, shift=False):
+    # queues a keyboard event. Printable characters use vk=KEY_CHAR and c.
+    key = dict(vk=vk, c=c, pressed=pressed, lalt=lalt, lctrl=lctrl,
+               ralt=ralt, rctrl=rctrl, shift=shift)
+    _events.append((EVENT_KEY_PRESS if pressed else EVENT_KEY_RELEASE, key))
+
+def push_char(ch, **modifiers):
+    # queues a key press for the printable character ch.
+    push_key(KEY_CHAR, ord(ch), **modifiers)
+
+def push_mouse(cx, cy, lbutton_pressed=False, rbutton_pressed=False,
+               mbutton_pressed=False, wheel_up=False, wheel_down=False):
+    # queues a mouse event at console cell (cx, cy). Button flags mark a click
+    # (press and release) of that button.
+    mouse = dict(cx=cx, cy=cy, lbutton_pressed=lbutton_pressed,
+                 rbutton_pressed=rbutton_pressed, mbutton_pressed=mbutton_pressed,
+                 wheel_up=wheel_up, wheel_down=wheel_down)
+    clicked = lbutton_pressed or rbutton_pressed or mbutton_pressed
+    _events.append((EVENT_MOUSE_RELEASE if clicked else EVENT_MOUSE_MOVE, mouse))
+
+def push_event(event):
+    # queues a raw (type, fields) event tuple, as produced by the push functions.
+    _events.append(event)
+
+def clear_events():
+    _events.clear()
+
+def pending_events():
+    return len(_events)
+
+def set_event_source(source):
+    # source is called with no arguments whenever the queue is empty and an
+    # event is requested. It may push events and/or return one (type, fields)
+    # tuple; returning None means no input is available right now.
+    _event_source[0] = source
+
+def close_window(closed=True):
+    _state.closed = closed
+
+def set_frame_hook(hook):
+    # hook(root) is called on every console_flush, for tests and recorders.
+    _state.frame_hook = hook
+
+def frame_count():
+    return _state.frames
+
+def _next_event(mask):
+    while True:
+        if not _events and _event_source[0] is not None:
+            event = _event_source[0]()
+            if event is not None:
+                _events.append(event)
+        if not _events:
+            return None
+        event = _events.popleft()
+        if event[0] & (EVENT_MOUSE_MOVE | EVENT_MOUSE_PRESS | EVENT_MOUSE_RELEASE):
+            _apply_mouse(event[1])
+        elif event[1].get('pressed'):
+            _keys_down.add(event[1]['vk'])
+        else:
+            _keys_down.discard(event[1]['vk'])
+        if event[0] & mask:
+            return event
+
+def _apply_mouse(fields):
+    cx = fields.get('cx', _mouse['cx'])
+    cy = fields.get('cy', _mouse['cy'])
+    x = cx * CHAR_WIDTH
+    y = cy * CHAR_HEIGHT
+    _mouse['dx'] = x - _mouse['x']
+    _mouse['dy'] = y - _mouse['y']
+    _mouse['dcx'] = cx - _mouse['cx']
+    _mouse['dcy'] = cy - _mouse['cy']
+    _mouse['x'] = x
+    _mouse['y'] = y
+    _mouse['cx'] = cx
+    _mouse['cy'] = cy
+    for f in ('lbutton_pressed', 'rbutton_pressed', 'mbutton_pressed', 'wheel_up', 'wheel_down'):
+        _mouse[f] = fields.get(f, False)
+
+def _fill_key(k, fields):
+    k = _deref(k)
+    for f in _KEY_FIELDS:
+        setattr(k, f, fields.get(f, 0) if fields else 0)
+
+def _fill_mouse(m, event):
+    m = _deref(m)
+    for f in _MOUSE_FIELDS:
+        setattr(m, f, _mouse[f])
+    if event is None or not event[0] & (EVENT_MOUSE_MOVE | EVENT_MOUSE_PRESS | EVENT_MOUSE_RELEASE):
+        for f in ('dx', 'dy', 'dcx', 'dcy', 'lbutton_pressed', 'rbutton_pressed',
+                  'mbutton_pressed', 'wheel_up', 'wheel_down'):
+            setattr(m, f, 0)
+
+def TCOD_sys_check_for_event(mask, k, m):
+    event = _next_event(_value(mask))
+    _fill_key(k, event[1] if event is not None and event[0] & 3 else None)
+    _fill_mouse(m, event)
+    return event[0] if event is not None else EVENT_NONE
+
+def TCOD_sys_wait_for_event(mask, k, m, flush):
+    # queued events stand for input that arrives after the call, so flush
+    # has nothing to discard.
+    event = _next_event(_value(mask))
+    if event is None:
+        # Nothing will ever arrive, so behave as if the window was closed.
+        _state.closed = True
+    _fill_key(k, event[1] if event is not None and event[0] & 3 else None)
+    _fill_mouse(m, event)
+    return event[0] if event is not None else EVENT_NONE
+
+def TCOD_console_wait_for_keypress_wrapper(k, flush):
+    event = _next_event(EVENT_KEY_PRESS)
+    if event is None:
+        _state.closed = True
+    _fill_key(k, event[1] if event is not None else None)
+
+def TCOD_console_check_for_keypress_wrapper(k, flags):
+    mask = 0
+    flags = _value(flags)
+    if flags & KEY_PRESSED:
+        mask |= EVENT_KEY_PRESS
+    if flags & KEY_RELEASED:
+        mask |= EVENT_KEY_RELEASE
+    event = _next_event(mask)
+    _fill_key(k, event[1] if event is not None else None)
+
+def TCOD_console_is_key_pressed(key):
+    return _value(key) in _keys_down
+
+def TCOD_console_set_keyboard_repeat(initial_delay, interval):
+    pass
+
+def TCOD_console_disable_keyboard_repeat():
+    pass
+
+def TCOD_mouse_show_cursor(visible):
+    _cursor_visible[0] = bool(_value(visible))
+
+def TCOD_mouse_is_cursor_visible():
+    return _cursor_visible[0]
+
+def TCOD_mouse_move(x, y):
+    _apply_mouse(dict(cx=_value(x) // CHAR_WIDTH, cy=_value(y) // CHAR_HEIGHT))
+
+def TCOD_mouse_get_status_wrapper(m):
+    _fill_mouse(m, None)
+
+############################
+# sys module
+############################
+def TCOD_sys_set_fps(fps):
+    # frames are never throttled, so simulations run as fast as they can.
+    _state.fps = _value(fps)
+
+def TCOD_sys_get_fps():
+    return _state.fps
+
+def TCOD_sys_get_last_frame_length():
+    return _state.last_frame
+
+def TCOD_sys_sleep_milli(val):
+    pass
+
+def TCOD_sys_elapsed_milli():
+    return int((time.time() - _state.start) * 1000)
+
+def TCOD_sys_elapsed_seconds():
+    return time.time() - _state.start
+
+def TCOD_sys_set_renderer(renderer):
+    _state.renderer = _value(renderer)
+
+def TCOD_sys_get_renderer():
+    return _state.renderer
+
+def TCOD_sys_save_screenshot(name):
+    pass
+
+def TCOD_sys_force_fullscreen_resolution(width, height):
+    pass
+
+def TCOD_sys_get_current_resolution(w, h):
+    root = _state.root
+    _deref(w).value = root.w * CHAR_WIDTH if root else 0
+    _deref(h).value = root.h * CHAR_HEIGHT if root else 0
+
+def TCOD_sys_get_char_size(w, h):
+    _deref(w).value = CHAR_WIDTH
+    _deref(h).value = CHAR_HEIGHT
+
+def TCOD_sys_update_char(asciiCode, fontx, fonty, img, x, y):
+    pass
+
+def TCOD_sys_register_SDL_renderer(callback):
+    pass
+
+############################
+# line module
+############################
+_line_data = [0] * 9
+
+def TCOD_line_init_mt(xo, yo, xd, yd, data):
+    xo = _value(xo)
+    yo = _value(yo)
+    xd = _value(xd)
+    yd = _value(yd)
+    deltax = xd - xo
+    deltay = yd - yo
+    stepx = (deltax > 0) - (deltax < 0)
+    stepy = (deltay > 0) - (deltay < 0)
+    if stepx * deltax > stepy * deltay:
+        e = stepx * deltax
+    else:
+        e = stepy * deltay
+    data[0:9] = [stepx, stepy, e, deltax * 2, deltay * 2, xo, yo, xd, yd]
+
+def TCOD_line_step_mt(x, y, data):
+    stepx, stepy, e, deltax, deltay, origx, origy, destx, desty = data[0:9]
+    if stepx * deltax > stepy * deltay:
+        if origx == destx:
+            return True
+        origx += stepx
+        e -= stepy * deltay
+        if e < 0:
+            origy += stepy
+            e += stepx * deltax
+    else:
+        if origy == desty:
+            return True
+        origy += stepy
+        e -= stepx * deltax
+        if e < 0:
+            origx += stepx
+            e += stepy * deltay
+    data[2] = e
+    data[5] = origx
+    data[6] = origy
+    _deref(x).value = origx
+    _deref(y).value = origy
+    return False
+
+def TCOD_line_init(xo, yo, xd, yd):
+    TCOD_line_init_mt(xo, yo, xd, yd, _line_data)
+
+def TCOD_line_step(x, y):
+    return TCOD_line_step_mt(x, y, _line_data)
+
+def TCOD_line(xo, yo, xd, yd, listener):
+    data = [0] * 9
+    TCOD_line_init_mt(xo, yo, xd, yd, data)
+    x = ctypes.c_int(_value(xo))
+    y = ctypes.c_int(_value(yo))
+    while True:
+        if not listener(x.value, y.value):
+            return False
+        if TCOD_line_step_mt(x, y, data):
+            return True
+
+############################
+# image module
+############################
+class _Image(object):
+    def __init__(self, w, h, pixels=None):
+        self.w = w
+        self.h = h
+        self.pixels = pixels or [(0, 0, 0)] * (w * h)
+        self.key_color = None
+
+def _read_png(filename):
+    # decodes 8-bit, non-interlaced grey, RGB and RGBA PNG files, which covers
+    # the images libtcod games usually ship. Anything else raises ValueError.
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError('%s is not a PNG file' % filename)
+    pos = 8
+    idat = []
+    w = h = depth = ctype = interlace = None
+    while pos < len(data):
+        length, tag = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if tag == b'IHDR':
+            w, h, depth, ctype, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+        elif tag == b'IDAT':
+            idat.append(chunk)
+        elif tag == b'IEND':
+            break
+    channels = {0: 1, 2: 3, 6: 4}.get(ctype)
+    if depth != 8 or channels is None or interlace:
+        raise ValueError('unsupported PNG format in %s' % filename)
+    raw = bytearray(zlib.decompress(b''.join(idat)))
+    stride = w * channels
+    rows = []
+    prev = bytearray(stride)
+    i = 0
+    for _ in range(h):
+        ftype = raw[i]
+        line = raw[i + 1:i + 1 + stride]
+        i += 1 + stride
+        for n in range(stride):
+            a = line[n - channels] if n >= channels else 0
+            b = prev[n]
+            c = prev[n - channels] if n >= channels else 0
+            if ftype == 1:
+                line[n] = (line[n] + a) & 0xff
+            elif ftype == 2:
+                line[n] = (line[n] + b) & 0xff
+            elif ftype == 3:
+                line[n] = (line[n] + (a + b) // 2) & 0xff
+            elif ftype == 4:
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    pred = a
+                elif pb <= pc:
+                    pred = b
+                else:
+                    pred = c
+                line[n] = (line[n] + pred) & 0xff
+        rows.append(line)
+        prev = line
+    pixels = []
+    for line in rows:
+        if channels == 1:
+            pixels.extend((v, v, v) for v in line)
+        else:
+            pixels.extend(tuple(line[n:n + 3]) for n in range(0, stride, channels))
+    return _Image(w, h, pixels)
+
+def _image(image):
+    return _handles[_value(image)]
+
+def TCOD_image_new(width, height):
+    return _new_handle(_Image(_value(width), _value(height)))
+
+def TCOD_image_load(filename):
+    return _new_handle(_read_png(_text(filename)))
+
+def TCOD_image_from_console(console):
+    c = _console(console)
+    return _new_handle(_Image(c.w, c.h, list(c.back)))
+
+def TCOD_image_refresh_console(image, console):
+    img = _image(image)
+    img.pixels = list(_console(console).back)
+
+def TCOD_image_clear(image, col):
+    img = _image(image)
+    img.pixels = [_rgb(col)] * (img.w * img.h)
+
+def TCOD_image_get_size(image, w, h):
+    img = _image(image)
+    _deref(w).value = img.w
+    _deref(h).value = img.h
+
+def TCOD_image_get_pixel(image, x, y):
+    img = _image(image)
+    x = _value(x)
+    y = _value(y)
+    if 0 <= x < img.w and 0 <= y < img.h:
+        return _color(img.pixels[y * img.w + x])
+    return _color((0, 0, 0))
+
+def TCOD_image_put_pixel(image, x, y, col):
+    img = _image(image)
+    x = _value(x)
+    y = _value(y)
+    if 0 <= x < img.w and 0 <= y < img.h:
+        img.pixels[y * img.w + x] = _rgb(col)
+
+def TCOD_image_set_key_color(image, col):
+    _image(image).key_color = _rgb(col)
+
+def TCOD_image_is_pixel_transparent(image, x, y):
+    img = _image(image)
+    return img.key_color is not None and img.pixels[_value(y) * img.w + _value(x)] == img.key_color
+
+def TCOD_image_blit_rect(image, console, x, y, w, h, bkgnd_flag):
+    img = _image(image)
+    c = _console(console)
+    x = _value(x)
+    y = _value(y)
+    w = _value(w)
+    h = _value(h)
+    for cy in range(h):
+        for cx in range(w):
+            px = cx * img.w // w
+            py = cy * img.h // h
+            col = img.pixels[py * img.w + px]
+            if col != img.key_color:
+                c.set_back(x + cx, y + cy, col, _value(bkgnd_flag))
+
+def TCOD_image_blit_2x(image, console, dx, dy, sx, sy, w, h):
+    # every console cell covers 2x2 pixels. Without a font to draw subcell
+    # glyphs, the cell background takes the average of the four pixels.
+    img = _image(image)
+    c = _console(console)
+    dx = _value(dx)
+    dy = _value(dy)
+    sx = _value(sx)
+    sy = _value(sy)
+    w = _value(w)
+    h = _value(h)
+    if w == -1:
+        w = img.w
+    if h == -1:
+        h = img.h
+    for py in range(sy, min(img.h, sy + h), 2):
+        for px in range(sx, min(img.w, sx + w), 2):
+            quad = [img.pixels[qy * img.w + qx]
+                    for qy in (py, py + 1) for qx in (px, px + 1)
+                    if qx < img.w and qy < img.h]
+            col = tuple(sum(p[k] for p in quad) // len(quad) for k in range(3))
+            cx = dx + (px - sx) // 2
+            cy = dy + (py - sy) // 2
+            if c.inside(cx, cy):
+                c.back[cy * c.w + cx] = col
+                c.ch[cy * c.w + cx] = 32
+
+def TCOD_image_delete(image):
+    _free_handle(image)
+
+############################
+# random module
+############################
+_default_random = random.Random()
+
+def _rng(rnd):
+    rnd = _value(rnd)
+    if rnd == 0:
+        return _default_random
+    return _handles[rnd]
+
+def TCOD_random_get_instance():
+    return 0
+
+def TCOD_random_new(algo):
+    return _new_handle(random.Random())
+
+def TCOD_random_new_from_seed(algo, seed):
+    return _new_handle(random.Random(_value(seed)))
+
+def TCOD_random_set_distribution(rnd, dist):
+    # only the linear distribution is implemented.
+    pass
+
+def TCOD_random_get_int(rnd, mi, ma):
+    mi = _value(mi)
+    ma = _value(ma)
+    if mi > ma:
+        mi, ma = ma, mi
+    return _rng(rnd).randint(mi, ma)
+
+def TCOD_random_get_float(rnd, mi, ma):
+    return _rng(rnd).uniform(_value(mi), _value(ma))
+
+TCOD_random_get_double = TCOD_random_get_float
+
+def TCOD_random_get_int_mean(rnd, mi, ma, mean):
+    mi = _value(mi)
+    ma = _value(ma)
+    if mi > ma:
+        mi, ma = ma, mi
+    return int(round(_rng(rnd).triangular(mi, ma, _value(mean))))
+
+def TCOD_random_get_float_mean(rnd, mi, ma, mean):
+    mi = _value(mi)
+    ma = _value(ma)
+    if mi > ma:
+        mi, ma = ma, mi
+    return _rng(rnd).triangular(mi, ma, _value(mean))
+
+TCOD_random_get_double_mean = TCOD_random_get_float_mean
+
+def TCOD_random_save(rnd):
+    backup = random.Random()
+    backup.setstate(_rng(rnd).getstate())
+    return _new_handle(backup)
+
+def TCOD_random_restore(rnd, backup):
+    _rng(rnd).setstate(_rng(backup).getstate())
+
+def TCOD_random_delete(rnd):
+    if _value(rnd) != 0:
+        _free_handle(rnd)
+
+############################
+# fov module
+############################
+FOV_BASIC = 0
+FOV_SHADOW = 2
+
+class _Map(object):
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        n = w * h
+        self.transparent = bytearray(n)
+        self.walkable = bytearray(n)
+        self.fov = bytearray(n)
+
+def _map(m):
+    return _handles[_value(m)]
+
+def TCOD_map_new(w, h):
+    return _new_handle(_Map(_value(w), _value(h)))
+
+def TCOD_map_copy(source, dest):
+    s = _map(source)
+    d = _map(dest)
+    d.w = s.w
+    d.h = s.h
+    d.transparent = bytearray(s.transparent)
+    d.walkable = bytearray(s.walkable)
+    d.fov = bytearray(s.fov)
+
+def TCOD_map_set_properties(m, x, y, isTrans, isWalk):
+    m = _map(m)
+    i = _value(y) * m.w + _value(x)
+    m.transparent[i] = 1 if _value(isTrans) else 0
+    m.walkable[i] = 1 if _value(isWalk) else 0
+
+def TCOD_map_clear(m, transparent, walkable):
+    m = _map(m)
+    n = m.w * m.h
+    m.transparent = bytearray([1 if _value(transparent) else 0]) * n
+    m.walkable = bytearray([1 if _value(walkable) else 0]) * n
+    m.fov = bytearray(n)
+
+def TCOD_map_is_in_fov(m, x, y):
+    m = _map(m)
+    x = _value(x)
+    y = _value(y)
+    return 0 <= x < m.w and 0 <= y < m.h and m.fov[y * m.w + x] == 1
+
+def TCOD_map_is_transparent(m, x, y):
+    m = _map(m)
+    return m.transparent[_value(y) * m.w + _value(x)] == 1
+
+def TCOD_map_is_walkable(m, x, y):
+    m = _map(m)
+    return m.walkable[_value(y) * m.w + _value(x)] == 1
+
+def TCOD_map_delete(m):
+    _free_handle(m)
+
+def TCOD_map_get_width(m):
+    return _map(m).w
+
+def TCOD_map_get_height(m):
+    return _map(m).h
+
+def _cast_ray(m, xo, yo, xd, yd, r2, light_walls):
+    data = [0] * 9
+    TCOD_line_init_mt(xo, yo, xd, yd, data)
+    x = ctypes.c_int(xo)
+    y = ctypes.c_int(yo)
+    w = m.w
+    while not TCOD_line_step_mt(x, y, data):
+        cx = x.value
+        cy = y.value
+        if not (0 <= cx < w and 0 <= cy < m.h):
+            return
+        if r2 > 0 and (cx - xo) ** 2 + (cy - yo) ** 2 > r2:
+            return
+        i = cy * w + cx
+        if not m.transparent[i]:
+            if light_walls:
+                m.fov[i] = 1
+            return
+        m.fov[i] = 1
+
+def _postprocess(m, x0, y0, x1, y1, dx, dy):
+    # lights the walls bordering lit floor cells in one quadrant, the way
+    # libtcod's basic algorithm does, so room corners are not left dark.
+    w = m.w
+    for cx in range(x0, x1 + 1):
+        for cy in range(y0, y1 + 1):
+            i = cy * w + cx
+            if not (m.fov[i] and m.transparent[i]):
+                continue
+            for nx, ny in ((cx + dx, cy), (cx, cy + dy), (cx + dx, cy + dy)):
+                if 0 <= nx < w and 0 <= ny < m.h:
+                    j = ny * w + nx
+                    if not m.transparent[j]:
+                        m.fov[j] = 1
+
+def _fov_basic(m, xo, yo, radius, light_walls):
+    if radius > 0:
+        xmin = max(0, xo - radius)
+        ymin = max(0, yo - radius)
+        xmax = min(m.w, xo + radius + 1)
+        ymax = min(m.h, yo + radius + 1)
+    else:
+        xmin, ymin, xmax, ymax = 0, 0, m.w, m.h
+    r2 = radius * radius
+    for x in range(xmin, xmax):
+        _cast_ray(m, xo, yo, x, ymin, r2, light_walls)
+        _cast_ray(m, xo, yo, x, ymax - 1, r2, light_walls)
+    for y in range(ymin + 1, ymax - 1):
+        _cast_ray(m, xo, yo, xmin, y, r2, light_walls)
+        _cast_ray(m, xo, yo, xmax - 1, y, r2, light_walls)
+    if light_walls:
+        _postprocess(m, xmin, ymin, xo, yo, -1, -1)
+        _postprocess(m, xo, ymin, xmax - 1, yo, 1, -1)
+        _postprocess(m, xmin, yo, xo, ymax - 1, -1, 1)
+        _postprocess(m, xo, yo, xmax - 1, ymax - 1, 1, 1)
+
+_OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+            (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+def _fov_shadow(m, xo, yo, radius, light_walls):
+    # recursive shadowcasting, one octant at a time.
+    if radius <= 0:
+        radius = max(m.w, m.h)
+    r2 = radius * radius
+    w = m.w
+    h = m.h
+    for xx, xy, yx, yy in _OCTANTS:
+        stack = [(1, 1.0, 0.0)]
+        while stack:
+            row, start, end = stack.pop()
+            if start < end:
+                continue
+            while row <= radius:
+                blocked = False
+                new_start = start
+                dy = -row
+                for dx in range(-row, 1):
+                    lslope = (dx - 0.5) / (dy + 0.5)
+                    rslope = (dx + 0.5) / (dy - 0.5)
+                    if start < rslope:
+                        continue
+                    if end > lslope:
+                        break
+                    cx = xo + dx * xx + dy * xy
+                    cy = yo + dx * yx + dy * yy
+                    inside = 0 <= cx < w and 0 <= cy < h
+                    i = cy * w + cx
+                    opaque = not inside or not m.transparent[i]
+                    if inside and dx * dx + dy * dy <= r2 and (light_walls or not opaque):
+                        m.fov[i] = 1
+                    if blocked:
+                        if opaque:
+                            new_start = rslope
+                        else:
+                            blocked = False
+                            start = new_start
+                    elif opaque and row < radius:
+                        blocked = True
+                        stack.append((row + 1, start, lslope))
+                        new_start = rslope
+                if blocked:
+                    break
+                row += 1
+
+def TCOD_map_compute_fov(m, x, y, radius, light_walls, algo):
+    m = _map(m)
+    x = _value(x)
+    y = _value(y)
+    m.fov = bytearray(m.w * m.h)
+    if not (0 <= x < m.w and 0 <= y < m.h):
+        return
+    m.fov[y * m.w + x] = 1
+    if _value(algo) == FOV_BASIC:
+        _fov_basic(m, x, y, _value(radius), _value(light_walls))
+    else:
+        # the diamond, permissive and restrictive variants all fall back to
+        # shadowcasting, which gives comparable results.
+        _fov_shadow(m, x, y, _value(radius), _value(light_walls))
+
+############################
+# pathfinding module
+############################
+_NEIGHBORS = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1))
+
+class _Path(object):
+    def __init__(self, w, h, cost, dcost):
+        self.w = w
+        self.h = h
+        self.cost = cost
+        self.dcost = dcost
+        self.ox = self.oy = self.dx = self.dy = 0
+        self.steps = []
+
+def _map_cost(m):
+    def cost(xf, yf, xt, yt):
+        return 1.0 if m.walkable[yt * m.w + xt] else 0.0
+    return cost
+
+def _function_cost(func, userdata):
+    def cost(xf, yf, xt, yt):
+        return func(xf, yf, xt, yt, userdata)
+    return cost
+
+def _path(p):
+    return _handles[_value(p)]
+
+def TCOD_path_new_using_map(m, dcost):
+    m = _map(m)
+    return _new_handle(_Path(m.w, m.h, _map_cost(m), _value(dcost)))
+
+def TCOD_path_new_using_function(w, h, func, userdata, dcost):
+    return _new_handle(_Path(_value(w), _value(h),
+                             _function_cost(func, _value(userdata)), _value(dcost)))
+
+def _astar(p, ox, oy, dx, dy):
+    w = p.w
+    h = p.h
+    start = (ox, oy)
+    goal = (dx, dy)
+    dist = {start: 0.0}
+    came = {}
+    heap = [(0.0, start)]
+    while heap:
+        f, node = heapq.heappop(heap)
+        if node == goal:
+            path = []
+            while node != start:
+                path.append(node)
+                node = came[node]
+            path.reverse()
+            return path
+        x, y = node
+        g = dist[node]
+        for nx, ny in ((x + ddx, y + ddy) for ddx, ddy in _NEIGHBORS):
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            c = p.cost(x, y, nx, ny)
+            if c <= 0:
+                continue
+            if nx != x and ny != y:
+                c *= p.dcost
+            ng = g + c
+            if ng < dist.get((nx, ny), float('inf')):
+                dist[(nx, ny)] = ng
+                came[(nx, ny)] = node
+                adx = abs(nx - dx)
+                ady = abs(ny - dy)
+                heur = max(adx, ady) + (p.dcost - 1) * min(adx, ady)
+                heapq.heappush(heap, (ng + heur, (nx, ny)))
+    return None
+
+def TCOD_path_compute(p, ox, oy, dx, dy):
+    p = _path(p)
+    p.ox, p.oy, p.dx, p.dy = _value(ox), _value(oy), _value(dx), _value(dy)
+    p.steps = []
+    if (p.ox, p.oy) == (p.dx, p.dy):
+        return False
+    steps = _astar(p, p.ox, p.oy, p.dx, p.dy)
+    if steps is None:
+        return False
+    p.steps = steps
+    return True
+
+def TCOD_path_get_origin(p, x, y):
+    p = _path(p)
+    _deref(x).value = p.ox
+    _deref(y).value = p.oy
+
+def TCOD_path_get_destination(p, x, y):
+    p = _path(p)
+    _deref(x).value = p.dx
+    _deref(y).value = p.dy
+
+def TCOD_path_size(p):
+    return len(_path(p).steps)
+
+def TCOD_path_reverse(p):
+    p = _path(p)
+    if p.steps:
+        points = [(p.ox, p.oy)] + p.steps
+        points.reverse()
+        p.ox, p.oy = points[0]
+        p.dx, p.dy = points[-1]
+        p.steps = points[1:]
+
+def TCOD_path_get(p, idx, x, y):
+    step = _path(p).steps[_value(idx)]
+    _deref(x).value = step[0]
+    _deref(y).value = step[1]
+
+def TCOD_path_is_empty(p):
+    return not _path(p).steps
+
+def TCOD_path_walk(p, x, y, recompute):
+    p = _path(p)
+    if not p.steps:
+        return False
+    nx, ny = p.steps[0]
+    if p.cost(p.ox, p.oy, nx, ny) <= 0:
+        if not _value(recompute) or not TCOD_path_compute_internal(p):
+            return False
+        nx, ny = p.steps[0]
+    p.steps.pop(0)
+    p.ox, p.oy = nx, ny
+    _deref(x).value = nx
+    _deref(y).value = ny
+    return True
+
+def TCOD_path_compute_internal(p):
+    steps = _astar(p, p.ox, p.oy, p.dx, p.dy)
+    if not steps:
+        p.steps = []
+        return False
+    p.steps = steps
+    return True
+
+def TCOD_path_delete(p):
+    _free_handle(p)
+
+class _Dijkstra(_Path):
+    def __init__(self, w, h, cost, dcost):
+        _Path.__init__(self, w, h, cost, dcost)
+        self.distances = {}
+
+def TCOD_dijkstra_new(m, dcost):
+    m = _map(m)
+    return _new_handle(_Dijkstra(m.w, m.h, _map_cost(m), _value(dcost)))
+
+def TCOD_dijkstra_new_using_function(w, h, func, userdata, dcost):
+    return _new_handle(_Dijkstra(_value(w), _value(h),
+                                 _function_cost(func, _value(userdata)), _value(dcost)))
+
+# the wrapper calls the function-based constructor by this name
+TCOD_path_dijkstra_using_function = TCOD_dijkstra_new_using_function
+
+def TCOD_dijkstra_compute(p, ox, oy):
+    p = _path(p)
+    p.ox = _value(ox)
+    p.oy = _value(oy)
+    root = (p.ox, p.oy)
+    dist = {root: 0.0}
+    heap = [(0.0, root)]
+    w = p.w
+    h = p.h
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        x, y = node
+        for nx, ny in ((x + ddx, y + ddy) for ddx, ddy in _NEIGHBORS):
+            if not (0 <= nx < w and 0 <= ny < h):
+                continue
+            c = p.cost(x, y, nx, ny)
+            if c <= 0:
+                continue
+            if nx != x and ny != y:
+                c *= p.dcost
+            nd = d + c
+            if nd < dist.get((nx, ny), float('inf')):
+                dist[(nx, ny)] = nd
+                heapq.heappush(heap, (nd, (nx, ny)))
+    p.distances = dist
+    p.steps = []
+
+def TCOD_dijkstra_get_distance(p, x, y):
+    return _path(p).distances.get((_value(x), _value(y)), -1.0)
+
+def TCOD_dijkstra_path_set(p, x, y):
+    p = _path(p)
+    node = (_value(x), _value(y))
+    if node not in p.distances:
+        return False
+    steps = []
+    root = (p.ox, p.oy)
+    while node != root:
+        steps.append(node)
+        cx, cy = node
+        node = min(((cx + ddx, cy + ddy) for ddx, ddy in _NEIGHBORS),
+                   key=lambda n: p.distances.get(n, float('inf')))
+    steps.reverse()
+    p.steps = steps
+    p.dx, p.dy = steps[-1] if steps else root
+    return True
+
+def TCOD_dijkstra_size(p):
+    return len(_path(p).steps)
+
+def TCOD_dijkstra_reverse(p):
+    p = _path(p)
+    p.steps.reverse()
+
+def TCOD_dijkstra_get(p, idx, x, y):
+    TCOD_path_get(p, idx, x, y)
+
+def TCOD_dijkstra_is_empty(p):
+    return not _path(p).steps
+
+def TCOD_dijkstra_path_walk(p, x, y):
+    p = _path(p)
+    if not p.steps:
+        return False
+    nx, ny = p.steps.pop(0)
+    _deref(x).value = nx
+    _deref(y).value = ny
+    return True
+
+def TCOD_dijkstra_delete(p):
+    _free_handle(p)
+
+############################
+# library object
+############################
+# the libtcodpy entry points this backend does not provide. They resolve to
+# functions that raise UnsupportedError when called, so the wrapper can still
+# set restype on them at import time.
+_UNSUPPORTED = frozenset([
+    # bsp
+    'TCOD_bsp_contains', 'TCOD_bsp_delete', 'TCOD_bsp_father',
+    'TCOD_bsp_find_node', 'TCOD_bsp_is_leaf', 'TCOD_bsp_left',
+    'TCOD_bsp_new_with_size', 'TCOD_bsp_remove_sons', 'TCOD_bsp_resize',
+    'TCOD_bsp_right', 'TCOD_bsp_split_once', 'TCOD_bsp_split_recursive',
+    'TCOD_bsp_traverse_in_order', 'TCOD_bsp_traverse_inverted_level_order',
+    'TCOD_bsp_traverse_level_order', 'TCOD_bsp_traverse_post_order',
+    'TCOD_bsp_traverse_pre_order',
+    # console
+    'TCOD_console_load_apf', 'TCOD_console_save_apf',
+    # heightmap
+    'TCOD_heightmap_add', 'TCOD_heightmap_add_fbm', 'TCOD_heightmap_add_hill',
+    'TCOD_heightmap_add_hm', 'TCOD_heightmap_add_voronoi',
+    'TCOD_heightmap_clamp', 'TCOD_heightmap_clear', 'TCOD_heightmap_copy',
+    'TCOD_heightmap_count_cells', 'TCOD_heightmap_delete',
+    'TCOD_heightmap_dig_bezier', 'TCOD_heightmap_dig_hill',
+    'TCOD_heightmap_get_interpolated_value', 'TCOD_heightmap_get_minmax',
+    'TCOD_heightmap_get_normal', 'TCOD_heightmap_get_slope',
+    'TCOD_heightmap_get_value', 'TCOD_heightmap_has_land_on_border',
+    'TCOD_heightmap_kernel_transform', 'TCOD_heightmap_lerp_hm',
+    'TCOD_heightmap_multiply_hm', 'TCOD_heightmap_new',
+    'TCOD_heightmap_normalize', 'TCOD_heightmap_rain_erosion',
+    'TCOD_heightmap_scale', 'TCOD_heightmap_scale_fbm',
+    'TCOD_heightmap_set_value',
+    # image
+    'TCOD_image_blit', 'TCOD_image_get_alpha', 'TCOD_image_get_mipmap_pixel',
+    'TCOD_image_hflip', 'TCOD_image_invert', 'TCOD_image_rotate90',
+    'TCOD_image_save', 'TCOD_image_scale', 'TCOD_image_vflip',
+    # namegen
+    'TCOD_namegen_destroy', 'TCOD_namegen_generate',
+    'TCOD_namegen_generate_custom', 'TCOD_namegen_get_nb_sets_wrapper',
+    'TCOD_namegen_get_sets_wrapper', 'TCOD_namegen_parse',
+    # noise
+    'TCOD_noise_delete', 'TCOD_noise_get', 'TCOD_noise_get_ex',
+    'TCOD_noise_get_fbm', 'TCOD_noise_get_fbm_ex', 'TCOD_noise_get_turbulence',
+    'TCOD_noise_get_turbulence_ex', 'TCOD_noise_new', 'TCOD_noise_set_type',
+    # parser
+    'TCOD_list_get', 'TCOD_list_size', 'TCOD_parser_delete',
+    'TCOD_parser_get_bool_property', 'TCOD_parser_get_char_property',
+    'TCOD_parser_get_color_property', 'TCOD_parser_get_dice_property_py',
+    'TCOD_parser_get_float_property', 'TCOD_parser_get_int_property',
+    'TCOD_parser_get_list_property', 'TCOD_parser_get_string_property',
+    'TCOD_parser_new', 'TCOD_parser_new_struct', 'TCOD_parser_run',
+    'TCOD_struct_add_flag', 'TCOD_struct_add_list_property',
+    'TCOD_struct_add_property', 'TCOD_struct_add_structure',
+    'TCOD_struct_add_value_list', 'TCOD_struct_get_name',
+    'TCOD_struct_get_type', 'TCOD_struct_is_mandatory',
+])
+
+class HeadlessLibrary(object):
+    # stands in for the ctypes CDLL object. Attributes are the TCOD_* functions
+    # of this module and the known-unsupported names above; any other name
+    # raises AttributeError, as a missing symbol would on a CDLL.
+    def __getattr__(self, name):
+        if not name.startswith('TCOD_'):
+            raise AttributeError('%s is not a libtcod function' % name)
+        func = globals().get(name)
+        if func is None:
+            if name not in _UNSUPPORTED:
+                raise AttributeError('%s is not a libtcod function' % name)
+            func = _unsupported(name)
+        setattr(self, name, func)
+        return func
+
+library = HeadlessLibrary()
+
+# a name listed as unsupported must not also be implemented above, or the list
+# goes out of date without anyone noticing.
+_implemented = _UNSUPPORTED.intersection(globals())
+if _implemented:
+    raise ImportError('implemented but listed as unsupported: %s' % ', '.join(sorted(_implemented)))
+del _implemented
@@ -25,9 +25,12 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import os
 import sys
 import ctypes
 import struct
+import array
+import threading
 from ctypes import *
 
 if not hasattr(ctypes, "c_bool"):   # for Python < 2.6
@@ -43,22 +46,43 @@ LINUX=False
 MAC=False
 MINGW=False
 MSVC=False
-if sys.platform.find('linux') != -1:
-    _lib = ctypes.cdll['./libtcod.so']
-    LINUX=True
-elif sys.platform.find('darwin') != -1:
-    _lib = ctypes.cdll['./libtcod.dylib']
-    MAC = True
-elif sys.platform.find('haiku') != -1:
-    _lib = ctypes.cdll['./libtcod.so']
-    HAIKU = True
-else:
+HEADLESS=False
+_lib = None
+# setting LIBTCOD_HEADLESS in the environment skips the native library even
+# when it is available
+if not os.environ.get('LIBTCOD_HEADLESS'):
     try:
-        _lib = ctypes.cdll['./libtcod-mingw.dll']
-        MINGW=True
-    except WindowsError:
-        _lib = ctypes.cdll['./libtcod-VS.dll']
-        MSVC=True
+        if sys.platform.find('linux') != -1:
+            _lib = ctypes.cdll['./libtcod.so']
+            LINUX=True
+        elif sys.platform.find('darwin') != -1:
+            _lib = ctypes.cdll['./libtcod.dylib']
+            MAC = True
+        elif sys.platform.find('haiku') != -1:
+            _lib = ctypes.cdll['./libtcod.so']
+            HAIKU = True
+        else:
+            try:
+                _lib = ctypes.cdll['./libtcod-mingw.dll']
+                MINGW=True
+            except WindowsError:
+                _lib = ctypes.cdll['./libtcod-VS.dll']
+                MSVC=True
+    except OSError:
+        _lib = None
+
+# without a native library (or a display for it), fall back to the
+# pure-Python headless backend. Its event queue and inspection helpers are
+# reachable as libtcodpy.headless, which is None when the native library is
+# in use.
+if _lib is None:
+    import libtcod_headless as headless
+    _lib = headless.library
+    HEADLESS=True
+else:
+    headless = None
+
+if (MINGW or MSVC) and not HEADLESS:
     # On Windows, ctypes doesn't work well with function returning structs,
     # so we have to user the _wrapper functions instead
     _lib.TCOD_color_multiply = _lib.TCOD_color_multiply_wrapper
@@ -79,6 +103,59 @@ HEXVERSION = 0x010501
 STRVERSION = "1.5.1"
 TECHVERSION = 0x01050103
 
+############################
+# native handle lifetimes
+############################
+# every console, image, map, path, dijkstra, noise, bsp tree, heightmap,
+# random generator and parser made through this module is counted by type
+# until it is deleted, so that a long session can be checked for native
+# handles that are never freed. Levels can be built on other threads, so
+# the counts are guarded by a lock.
+_live_handles = {}
+_live_handles_lock = threading.Lock()
+
+def _track(kind, handle):
+    with _live_handles_lock:
+        _live_handles[kind] = _live_handles.get(kind, 0) + 1
+    return handle
+
+def _untrack(kind):
+    with _live_handles_lock:
+        _live_handles[kind] = _live_handles.get(kind, 0) - 1
+
+def live_handles():
+    # returns {type: number of handles of that type made and not yet deleted}
+    with _live_handles_lock:
+        return dict((kind, n) for kind, n in _live_handles.items() if n)
+
+class NativeHandle(object):
+    # owns a handle returned by one of the *_new functions, and deletes it
+    # with the matching *_delete function: when delete() is called, when a
+    # with block ends, or at the latest when the owner is garbage collected.
+    #     with NativeHandle(map_new(w, h), map_delete) as m:
+    #         map_compute_fov(m, x, y)
+    def __init__(self, handle, delete):
+        self.handle = handle
+        self._delete = delete
+
+    def delete(self):
+        if self.handle is not None:
+            handle, self.handle = self.handle, None
+            self._delete(handle)
+
+    def __enter__(self):
+        return self.handle
+
+    def __exit__(self, *exc_info):
+        self.delete()
+
+    def __del__(self):
+        # at interpreter exit, the library may already be gone.
+        try:
+            self.delete()
+        except Exception:
+            pass
+
 ############################
 # color module
 ############################
@@ -395,41 +472,59 @@ class Key(Structure):
               ('shift', c_bool),
               ]
 
+def _int_array(n, value):
+    # returns a contiguous array of n C ints, all set to value: a NumPy array
+    # if NumPy is available, and an array.array otherwise.
+    if numpy_available:
+        return numpy.full(n, value, dtype=numpy.intc)
+    return array.array('i', [value]) * n
+
+def _copy_int_array(arr):
+    # returns a copy of an array made by _int_array.
+    if numpy_available:
+        return arr.copy()
+    return array.array('i', arr)
+
+def _int_pointer(arr):
+    # returns a pointer to the data of an array made by _int_array, which
+    # can be handed to libtcod without copying the array.
+    if numpy_available:
+        return arr.ctypes.data_as(POINTER(c_int))
+    return cast(arr.buffer_info()[0], POINTER(c_int))
+
 class ConsoleBuffer:
     # simple console that allows direct (fast) access to cells. simplifies
-    # use of the "fill" functions.
+    # use of the "fill" functions. each channel is kept in a contiguous array
+    # of C ints (NumPy arrays when NumPy is available, array.array otherwise),
+    # which blit hands straight to libtcod, with no conversion.
+    channels = ('back_r', 'back_g', 'back_b', 'fore_r', 'fore_g', 'fore_b', 'char')
+
     def __init__(self, width, height, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # initialize with given width and height. values to fill the buffer
         # are optional, defaults to black with no characters.
         n = width * height
         self.width = width
         self.height = height
-        self.clear(back_r, back_g, back_b, fore_r, fore_g, fore_b, char)
+        self.back_r = _int_array(n, back_r)
+        self.back_g = _int_array(n, back_g)
+        self.back_b = _int_array(n, back_b)
+        self.fore_r = _int_array(n, fore_r)
+        self.fore_g = _int_array(n, fore_g)
+        self.fore_b = _int_array(n, fore_b)
+        self.char = _int_array(n, ord(char))
 
     def clear(self, back_r=0, back_g=0, back_b=0, fore_r=0, fore_g=0, fore_b=0, char=' '):
         # clears the console. values to fill it with are optional, defaults
         # to black with no characters.
-        n = self.width * self.height
-        self.back_r = [back_r] * n
-        self.back_g = [back_g] * n
-        self.back_b = [back_b] * n
-        self.fore_r = [fore_r] * n
-        self.fore_g = [fore_g] * n
-        self.fore_b = [fore_b] * n
-        self.char = [ord(char)] * n
+        self.fill(0, 0, self.width, self.height, back_r, back_g, back_b, fore_r, fore_g, fore_b, char)
     
     def copy(self):
         # returns a copy of this ConsoleBuffer.
         other = ConsoleBuffer(0, 0)
         other.width = self.width
         other.height = self.height
-        other.back_r = list(self.back_r)  # make explicit copies of all lists
-        other.back_g = list(self.back_g)
-        other.back_b = list(self.back_b)
-        other.fore_r = list(self.fore_r)
-        other.fore_g = list(self.fore_g)
-        other.fore_b = list(self.fore_b)
-        other.char = list(self.char)
+        for name in self.channels:  # make explicit copies of all arrays
+            setattr(other, name, _copy_int_array(getattr(self, name)))
         return other
     
     def set_fore(self, x, y, r, g, b, char):
@@ -457,6 +552,42 @@ class ConsoleBuffer:
         self.fore_g[i] = fore_g
         self.fore_b[i] = fore_b
         self.char[i] = ord(char)
+
+    def _fill_channel(self, arr, x, y, w, h, value):
+        # set one channel of a rectangle of cells, clipped to the buffer, to a
+        # value. NumPy fills the whole rectangle at once, and array.array is
+        # filled one row at a time.
+        x2 = min(x + w, self.width)
+        y2 = min(y + h, self.height)
+        x = max(x, 0)
+        y = max(y, 0)
+        if x >= x2 or y >= y2:
+            return
+        if numpy_available:
+            arr.reshape(self.height, self.width)[y:y2, x:x2] = value
+        else:
+            row = array.array('i', [value]) * (x2 - x)
+            for i in range(y * self.width + x, y2 * self.width, self.width):
+                arr[i:i + x2 - x] = row
+
+    def fill_back(self, x, y, w, h, r, g, b):
+        # set the background color of a rectangle of cells.
+        self._fill_channel(self.back_r, x, y, w, h, r)
+        self._fill_channel(self.back_g, x, y, w, h, g)
+        self._fill_channel(self.back_b, x, y, w, h, b)
+
+    def fill_fore(self, x, y, w, h, r, g, b, char):
+        # set the character and foreground color of a rectangle of cells.
+        self._fill_channel(self.fore_r, x, y, w, h, r)
+        self._fill_channel(self.fore_g, x, y, w, h, g)
+        self._fill_channel(self.fore_b, x, y, w, h, b)
+        self._fill_channel(self.char, x, y, w, h, ord(char))
+
+    def fill(self, x, y, w, h, back_r, back_g, back_b, fore_r, fore_g, fore_b, char):
+        # set the background color, foreground color and character of a
+        # rectangle of cells.
+        self.fill_back(x, y, w, h, back_r, back_g, back_b)
+        self.fill_fore(x, y, w, h, fore_r, fore_g, fore_b, char)
     
     def blit(self, dest, fill_fore=True, fill_back=True):
         # use libtcod's "fill" functions to write the buffer to a console.
@@ -464,14 +595,12 @@ class ConsoleBuffer:
             console_get_height(dest) != self.height):
             raise ValueError('ConsoleBuffer.blit: Destination console has an incorrect size.')
 
-        s = struct.Struct('%di' % len(self.back_r))
-
         if fill_back:
-            _lib.TCOD_console_fill_background(dest, (c_int * len(self.back_r))(*self.back_r), (c_int * len(self.back_g))(*self.back_g), (c_int * len(self.back_b))(*self.back_b))
+            _lib.TCOD_console_fill_background(dest, _int_pointer(self.back_r), _int_pointer(self.back_g), _int_pointer(self.back_b))
 
         if fill_fore:
-            _lib.TCOD_console_fill_foreground(dest, (c_int * len(self.fore_r))(*self.fore_r), (c_int * len(self.fore_g))(*self.fore_g), (c_int * len(self.fore_b))(*self.fore_b))
-            _lib.TCOD_console_fill_char(dest, (c_int * len(self.char))(*self.char))
+            _lib.TCOD_console_fill_foreground(dest, _int_pointer(self.fore_r), _int_pointer(self.fore_g), _int_pointer(self.fore_b))
+            _lib.TCOD_console_fill_char(dest, _int_pointer(self.char))
 
 _lib.TCOD_console_credits_render.restype = c_bool
 _lib.TCOD_console_is_fullscreen.restype = c_bool
@@ -888,9 +1017,9 @@ def console_disable_keyboard_repeat():
 
 # using offscreen consoles
 def console_new(w, h):
-    return _lib.TCOD_console_new(w, h)
+    return _track('console', _lib.TCOD_console_new(w, h))
 def console_from_file(filename):
-    return _lib.TCOD_console_from_file(filename)
+    return _track('console', _lib.TCOD_console_from_file(filename))
 def console_get_width(con):
     return _lib.TCOD_console_get_width(con)
 
@@ -904,6 +1033,9 @@ def console_set_key_color(con, col):
     _lib.TCOD_console_set_key_color(con, col)
 
 def console_delete(con):
+    # deleting console 0 closes the root console, which isn't counted.
+    if con:
+        _untrack('console')
     _lib.TCOD_console_delete(con)
 
 # fast color filling
@@ -914,9 +1046,9 @@ def console_fill_foreground(con,r,g,b) :
     if (numpy_available and isinstance(r, numpy.ndarray) and
         isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
+        r = numpy.ascontiguousarray(r, dtype=numpy.intc)
+        g = numpy.ascontiguousarray(g, dtype=numpy.intc)
+        b = numpy.ascontiguousarray(b, dtype=numpy.intc)
         cr = r.ctypes.data_as(POINTER(c_int))
         cg = g.ctypes.data_as(POINTER(c_int))
         cb = b.ctypes.data_as(POINTER(c_int))
@@ -935,9 +1067,9 @@ def console_fill_background(con,r,g,b) :
     if (numpy_available and isinstance(r, numpy.ndarray) and
         isinstance(g, numpy.ndarray) and isinstance(b, numpy.ndarray)):
         #numpy arrays, use numpy's ctypes functions
-        r = numpy.ascontiguousarray(r, dtype=numpy.int_)
-        g = numpy.ascontiguousarray(g, dtype=numpy.int_)
-        b = numpy.ascontiguousarray(b, dtype=numpy.int_)
+        r = numpy.ascontiguousarray(r, dtype=numpy.intc)
+        g = numpy.ascontiguousarray(g, dtype=numpy.intc)
+        b = numpy.ascontiguousarray(b, dtype=numpy.intc)
         cr = r.ctypes.data_as(POINTER(c_int))
         cg = g.ctypes.data_as(POINTER(c_int))
         cb = b.ctypes.data_as(POINTER(c_int))
@@ -952,7 +1084,7 @@ def console_fill_background(con,r,g,b) :
 def console_fill_char(con,arr) :
     if (numpy_available and isinstance(arr, numpy.ndarray) ):
         #numpy arrays, use numpy's ctypes functions
-        arr = numpy.ascontiguousarray(arr, dtype=numpy.int_)
+        arr = numpy.ascontiguousarray(arr, dtype=numpy.intc)
         carr = arr.ctypes.data_as(POINTER(c_int))
     else:
         #otherwise convert using the struct module
@@ -1087,7 +1219,7 @@ _lib.TCOD_image_get_pixel.restype = Color
 _lib.TCOD_image_get_mipmap_pixel.restype = Color
 
 def image_new(width, height):
-    return _lib.TCOD_image_new(width, height)
+    return _track('image', _lib.TCOD_image_new(width, height))
 
 def image_clear(image,col) :
     _lib.TCOD_image_clear(image,col)
@@ -1117,10 +1249,10 @@ def image_is_pixel_transparent(image,x,y) :
     return _lib.TCOD_image_is_pixel_transparent(image,c_int(x),c_int(y))
 
 def image_load(filename):
-    return _lib.TCOD_image_load(c_char_p(filename))
+    return _track('image', _lib.TCOD_image_load(c_char_p(filename)))
 
 def image_from_console(console):
-    return _lib.TCOD_image_from_console(console)
+    return _track('image', _lib.TCOD_image_from_console(console))
 
 def image_refresh_console(image, console):
     _lib.TCOD_image_refresh_console(image, console)
@@ -1155,6 +1287,7 @@ def image_save(image, filename):
     _lib.TCOD_image_save(image, c_char_p(filename))
 
 def image_delete(image):
+    _untrack('image')
     _lib.TCOD_image_delete(image)
 
 ############################
@@ -1290,7 +1423,7 @@ def _convert_TCODList(clist, typ):
     return res
 
 def parser_new():
-    return _lib.TCOD_parser_new()
+    return _track('parser', _lib.TCOD_parser_new())
 
 def parser_new_struct(parser, name):
     return _lib.TCOD_parser_new_struct(parser, name)
@@ -1359,6 +1492,7 @@ def parser_run(parser, filename, listener=0):
         _lib.TCOD_parser_run(parser, c_char_p(filename), 0)
 
 def parser_delete(parser):
+    _untrack('parser')
     _lib.TCOD_parser_delete(parser)
 
 def parser_get_bool_property(parser, name):
@@ -1407,10 +1541,10 @@ def random_get_instance():
     return _lib.TCOD_random_get_instance()
 
 def random_new(algo=RNG_CMWC):
-    return _lib.TCOD_random_new(algo)
+    return _track('random', _lib.TCOD_random_new(algo))
 
 def random_new_from_seed(seed, algo=RNG_CMWC):
-    return _lib.TCOD_random_new_from_seed(algo,c_uint(seed))
+    return _track('random', _lib.TCOD_random_new_from_seed(algo,c_uint(seed)))
 
 def random_set_distribution(rnd, dist) :
 	_lib.TCOD_random_set_distribution(rnd, dist)
@@ -1434,12 +1568,15 @@ def random_get_double_mean(rnd, mi, ma, mean):
     return _lib.TCOD_random_get_double_mean(rnd, c_double(mi), c_double(ma), c_double(mean))
 
 def random_save(rnd):
-    return _lib.TCOD_random_save(rnd)
+    return _track('random', _lib.TCOD_random_save(rnd))
 
 def random_restore(rnd, backup):
     _lib.TCOD_random_restore(rnd, backup)
 
 def random_delete(rnd):
+    # the default generator, 0, belongs to libtcod and isn't counted.
+    if rnd:
+        _untrack('random')
     _lib.TCOD_random_delete(rnd)
 
 ############################
@@ -1468,7 +1605,7 @@ _NOISE_PACKER_FUNC = (None,
                       )
 
 def noise_new(dim, h=NOISE_DEFAULT_HURST, l=NOISE_DEFAULT_LACUNARITY, random=0):
-    return _lib.TCOD_noise_new(dim, c_float(h), c_float(l), random)
+    return _track('noise', _lib.TCOD_noise_new(dim, c_float(h), c_float(l), random))
 
 def noise_set_type(n, typ) :
     _lib.TCOD_noise_set_type(n,typ)
@@ -1483,6 +1620,7 @@ def noise_get_turbulence(n, f, oc, typ=NOISE_DEFAULT):
     return _lib.TCOD_noise_get_turbulence_ex(n, _NOISE_PACKER_FUNC[len(f)](*f), c_float(oc), typ)
 
 def noise_delete(n):
+    _untrack('noise')
     _lib.TCOD_noise_delete(n)
 
 ############################
@@ -1511,7 +1649,7 @@ def FOV_PERMISSIVE(p) :
     return FOV_PERMISSIVE_0+p
 
 def map_new(w, h):
-    return _lib.TCOD_map_new(w, h)
+    return _track('map', _lib.TCOD_map_new(w, h))
 
 def map_copy(source, dest):
     return _lib.TCOD_map_copy(source, dest)
@@ -1535,6 +1673,7 @@ def map_is_walkable(m, x, y):
     return _lib.TCOD_map_is_walkable(m, x, y)
 
 def map_delete(m):
+    _untrack('map')
     return _lib.TCOD_map_delete(m)
 
 def map_get_width(map):
@@ -1553,12 +1692,12 @@ _lib.TCOD_path_walk.restype = c_bool
 PATH_CBK_FUNC = CFUNCTYPE(c_float, c_int, c_int, c_int, c_int, py_object)
 
 def path_new_using_map(m, dcost=1.41):
-    return (_lib.TCOD_path_new_using_map(c_void_p(m), c_float(dcost)), None)
+    return _track('path', (_lib.TCOD_path_new_using_map(c_void_p(m), c_float(dcost)), None))
 
 def path_new_using_function(w, h, func, userdata=0, dcost=1.41):
     cbk_func = PATH_CBK_FUNC(func)
-    return (_lib.TCOD_path_new_using_function(w, h, cbk_func,
-            py_object(userdata), c_float(dcost)), cbk_func)
+    return _track('path', (_lib.TCOD_path_new_using_function(w, h, cbk_func,
+            py_object(userdata), c_float(dcost)), cbk_func))
 
 def path_compute(p, ox, oy, dx, dy):
     return _lib.TCOD_path_compute(p[0], ox, oy, dx, dy)
@@ -1598,6 +1737,7 @@ def path_walk(p, recompute):
     return None,None
 
 def path_delete(p):
+    _untrack('path')
     _lib.TCOD_path_delete(p[0])
 
 _lib.TCOD_dijkstra_path_set.restype = c_bool
@@ -1606,12 +1746,12 @@ _lib.TCOD_dijkstra_path_walk.restype = c_bool
 _lib.TCOD_dijkstra_get_distance.restype = c_float
 
 def dijkstra_new(m, dcost=1.41):
-    return (_lib.TCOD_dijkstra_new(c_void_p(m), c_float(dcost)), None)
+    return _track('dijkstra', (_lib.TCOD_dijkstra_new(c_void_p(m), c_float(dcost)), None))
 
 def dijkstra_new_using_function(w, h, func, userdata=0, dcost=1.41):
     cbk_func = PATH_CBK_FUNC(func)
-    return (_lib.TCOD_path_dijkstra_using_function(w, h, cbk_func,
-            py_object(userdata), c_float(dcost)), cbk_func)
+    return _track('dijkstra', (_lib.TCOD_path_dijkstra_using_function(w, h, cbk_func,
+            py_object(userdata), c_float(dcost)), cbk_func))
 
 def dijkstra_compute(p, ox, oy):
     _lib.TCOD_dijkstra_compute(p[0], c_int(ox), c_int(oy))
@@ -1645,6 +1785,7 @@ def dijkstra_path_walk(p):
     return None,None
 
 def dijkstra_delete(p):
+    _untrack('dijkstra')
     _lib.TCOD_dijkstra_delete(p[0])
 
 ############################
@@ -1723,7 +1864,8 @@ class Bsp(object):
 
 
 def bsp_new_with_size(x, y, w, h):
-    return Bsp(_lib.TCOD_bsp_new_with_size(x, y, w, h))
+    # only the root is counted: bsp_delete frees the whole tree.
+    return _track('bsp', Bsp(_lib.TCOD_bsp_new_with_size(x, y, w, h)))
 
 def bsp_split_once(node, horizontal, position):
     _lib.TCOD_bsp_split_once(node.p, c_int(horizontal), position)
@@ -1783,6 +1925,7 @@ def bsp_remove_sons(node):
     _lib.TCOD_bsp_remove_sons(node.p)
 
 def bsp_delete(node):
+    _untrack('bsp')
     _lib.TCOD_bsp_delete(node.p)
 
 ############################
@@ -1817,7 +1960,7 @@ class HeightMap(object):
 
 def heightmap_new(w, h):
     phm = _lib.TCOD_heightmap_new(w, h)
-    return HeightMap(phm)
+    return _track('heightmap', HeightMap(phm))
 
 def heightmap_set_value(hm, x, y, value):
     _lib.TCOD_heightmap_set_value(hm.p, x, y, c_float(value))
@@ -1926,6 +2069,7 @@ def heightmap_get_minmax(hm):
     return mi.value, ma.value
 
 def heightmap_delete(hm):
+    _untrack('heightmap')
     _lib.TCOD_heightmap_delete(hm.p)
 
 
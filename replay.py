@@ -0,0 +1,31 @@
+########################################################################################################
+# replay.py
+# Plays back a recording of a game of Forcastia Tales: The Marked, as fast as it will go, with no window.
+#    python replay.py                      plays back the recording of the last new game
+#    python replay.py game.rec             plays back the given recording
+# The game plays out exactly as it did when it was recorded, so a recording sent with a bug report shows
+# the bug, and a recorded game makes a workload for timing the game. The time taken and the state of the
+# game at the end are printed.
+########################################################################################################
+
+import os
+import sys
+import timeit
+
+#The replay runs on libtcodpy's headless backend, which draws nothing and never opens a window. This must
+#be chosen before libtcodpy is imported.
+os.environ["LIBTCOD_HEADLESS"] = "1"
+
+import themarked as game
+
+if __name__ == "__main__":
+	path = sys.argv[1] if len(sys.argv) > 1 else game.RECORDING_FILE
+	
+	start = timeit.default_timer()
+	events = game.replayRecording(path)
+	elapsed = timeit.default_timer() - start
+	
+	print("%d input events played in %.3f s (%.3f ms each)" % (events, elapsed, elapsed * 1000.0 / max(events, 1)))
+	print("seed %d, dungeon level %d, player at %d,%d with %d/%d hit points, %d objects, %d items, %s" % (
+		game.gameSeed, game.dungeonLevel, game.player.x, game.player.y, game.player.fighter.cond,
+		game.player.fighter.hits, len(game.objects), len(game.inventory), game.gameState))
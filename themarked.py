@@ -12,6 +12,23 @@ import libtcodpy as libtcod
 import math
 import textwrap
 import shelve
+import tempfile
+import array
+import struct
+import os
+import heapq
+import collections
+import itertools
+import mmap
+import threading
+import time
+import zlib
+
+try:  #NumPy is optional, but the map arrays are faster to work with when it is available.
+	import numpy
+	numpyAvailable = True
+except ImportError:
+	numpyAvailable = False
 
 #Screen Size
 SCREEN_WIDTH = 80
@@ -25,9 +42,21 @@ MESSAGE_X = BAR_WIDTH + 2
 MESSAGE_WIDTH = SCREEN_WIDTH - BAR_WIDTH - 2
 MESSAGE_HEIGHT = PANEL_HEIGHT - 1
 
+#Message Log. Up to MESSAGE_HISTORY messages are kept for the message history screen, and up to
+#WRAP_CACHE_SIZE messages are kept wrapped into lines, ready to be shown again.
+MESSAGE_HISTORY = 2000
+WRAP_CACHE_SIZE = 256
+
 INVENTORY_WIDTH = 50
 ADVANCE_MENU_WIDTH = 40
 MIRROR_SCREEN_WIDTH = 30
+HISTORY_SCREEN_WIDTH = 60
+SAVE_SLOT_MENU_WIDTH = 64
+
+#Menus. Up to MENU_CACHE_SIZE menus are kept laid out, ready to be shown again, and up to CONSOLE_POOL_SIZE
+#unused consoles of each size are kept for the menus laid out next.
+MENU_CACHE_SIZE = 16
+CONSOLE_POOL_SIZE = 4
 
 HEAL_AMOUNT = 40
 LIGHTNING_DAMAGE = 40
@@ -50,6 +79,10 @@ MAP_HEIGHT = 43
 ROOM_MAX_SIZE = 10
 ROOM_MIN_SIZE = 6
 MAX_ROOMS = 30
+#How new rooms are checked for overlap with the rooms already placed: "grid" looks at the cells under the
+#new room in a RoomGrid, which costs the same however many rooms there are, while "rectangles" tests the
+#new room against every placed room in turn. Both place exactly the same rooms.
+ROOM_OVERLAP_TEST = "grid"
 #MAX_ROOM_MONSTERS = 3
 #MAX_ROOM_ITEMS = 2
 
@@ -57,10 +90,40 @@ MAX_ROOMS = 30
 FOV_ALGO = 0
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
+#The FOV engine. "libtcod" uses libtcod's FOV map with FOV_ALGO. "shadowcast" and "raytable" are computed in
+#Python straight from the tile arrays; the ray table needs NumPy, and falls back to shadowcasting without it.
+#The benchmarks compare them all.
+FOV_ENGINE = "libtcod"
+
+#Turn Timing. An action takes ACTION_COST units of time for an actor moving at NORMAL_SPEED, and
+#proportionally less for faster actors.
+ACTION_COST = 100
+NORMAL_SPEED = 100
+
+#Whether the next level of the dungeon is built in the background while the player explores.
+PREGENERATE_LEVELS = True
+
+#How many of the levels the player has left are kept in memory, ready to be entered again at once. Older
+#ones are kept in the level archive.
+LEVEL_CACHE_SIZE = 4
+
+#Input Recording. Every new game's input is recorded to RECORDING_FILE, which replay.py can play back.
+RECORD_INPUT = True
+RECORDING_FILE = "recording.rec"
 
 #FPS Limit
 FPS_LIMIT = 20
 
+#Whether the game waits for input between frames, only drawing the screen when something on it has changed,
+#instead of drawing it FPS_LIMIT times a second. While a save is being written in the background, the
+#event-driven loop checks for input every POLL_INTERVAL seconds instead, to hear of the save at once.
+EVENT_DRIVEN_LOOP = True
+POLL_INTERVAL = 0.05
+
+#The objects on the map are drawn by writing the cells that changed since the last frame one by one, or by
+#blitting the whole layer at once when more than ENTITY_CELL_LIMIT of them changed.
+ENTITY_CELL_LIMIT = 64
+
 #Common Glyphs
 gMarked = "@"
 gSpace = " "
@@ -77,13 +140,28 @@ cDarkGround = libtcod.darker_blue
 cLitWall = libtcod.Color(130, 110, 50)
 cLitGround = libtcod.Color(200, 180, 50)
 
+#Map background colors, indexed by a tile's "shade": 0 is dark ground, 1 is a dark wall, 2 and 3 are lit
+#ground and lit walls, and 4 is a tile that hasn't been explored yet, which stays black.
+SHADE_COLORS = [cDarkGround, cDarkWall, cLitGround, cLitWall, libtcod.black]
+SHADE_UNEXPLORED = 4
+
+#Every object gets an id of its own, so that it can be told apart from the others in save files.
+objectIds = itertools.count(1)
+
 #The Object class describes a generic game object, such as the player, a monster, an item, or a
 #dungeon feature. All objects have an ASCII character, or "glyph" which represents the object on
 #the game screen.	
 class Object:
+	#Objects saved before speeds existed move at normal speed.
+	speed = NORMAL_SPEED
+	
+	#Objects saved before ids existed are given one when they are loaded.
+	uid = None
+	
 	#INIT initializes and constructs the object with the given parameters.
 	def __init__(self, x, y, glyph, name, color, blocks = False, alwaysVisible = False, 
-		fighter = None, ai = None, item = None, equipment = None):
+		fighter = None, ai = None, item = None, equipment = None, speed = NORMAL_SPEED):
+		self.uid = next(objectIds)
 		self.name = name
 		self.blocks = blocks
 		self.x = x
@@ -91,6 +169,7 @@ class Object:
 		self.glyph = glyph
 		self.color = color
 		self.alwaysVisible = alwaysVisible
+		self.speed = speed
 		
 		self.fighter = fighter
 		if self.fighter:
@@ -110,15 +189,16 @@ class Object:
 			self.item = Item()
 			self.item.owner = self
 	
-	#MOVE moves the character by the given amount in directionX and directionY.
+	#MOVE moves the character by the given amount in directionX and directionY. The spatial index is
+	#updated along with the coordinates, so it always knows where everything stands.
 	def move(self, directionX, directionY):
 		if not isBlocked(self.x + directionX, self.y + directionY):
-			self.x += directionX
-			self.y += directionY
+			occupancy.move(self, self.x + directionX, self.y + directionY)
 	
 	#DRAW sets the color and draws the object's glyph at its position.
 	def draw(self):
-		if (libtcod.map_is_in_fov(fovMap, self.x, self.y) or (self.alwaysVisible and map[self.x][self.y].explored)):
+		if (isInFOV(self.x, self.y) or
+			(self.alwaysVisible and map.explored[map.index(self.x, self.y)])):
 			libtcod.console_set_default_foreground(con, self.color)
 			libtcod.console_put_char(con, self.x, self.y, self.glyph, libtcod.BKGND_NONE)
 		
@@ -229,10 +309,15 @@ class BasicMonster:
 	#move toward you.
 	def takeTurn(self):
 		monster = self.owner
-		if libtcod.map_is_in_fov(fovMap, monster.x, monster.y):
-			#If the monster is far away, it moves toward the player.
+		if isInFOV(monster.x, monster.y):
+			#If the monster is far away, it moves toward the player, following the shared flow field
+			#around walls. If every step closer is taken, it tries heading straight for the player.
 			if monster.distanceTo(player) >= 2:
-				monster.moveTowards(player.x, player.y)
+				step = flowField.nextStep(monster.x, monster.y)
+				if step:
+					monster.move(*step)
+				else:
+					monster.moveTowards(player.x, player.y)
 				
 			#if the monster is close enough, and the player is alive, the monster attacks.
 			elif player.fighter.cond > 0:
@@ -248,7 +333,8 @@ class ConfusedMonster:
 	#randomly and does not attack.
 	def takeTurn(self):
 		if self.numberOfTurns > 0:
-			self.owner.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
+			rng = randomStreams["monsters"]
+			self.owner.move(libtcod.random_get_int(rng, -1, 1), libtcod.random_get_int(rng, -1, 1))
 			self.numberOfTurns -= 1
 			
 		else:
@@ -265,11 +351,12 @@ class Item:
 	
 	#PICKUP removes the item from the map and adds the item to the player's inventory.
 	def pickup(self):
+		journal.changed = True
 		if len(inventory) >= 26:
 			message("Your inventory is full.", libtcod.red)
 		else:
 			inventory.append(self.owner)
-			objects.remove(self.owner)
+			removeObject(self.owner)
 			message("Picked up a " + self.owner.name + ".", libtcod.green)
 			
 			#If an item is a piece of equipment, and the slot is free, equip it
@@ -280,6 +367,7 @@ class Item:
 	#USE evokes the item's use function. If the item is a piece of Equipment, then its use is to
 	#toggle the equipment status.
 	def use(self):
+		journal.changed = True
 		if self.owner.equipment:
 			self.owner.equipment.toggleEquip()
 			return
@@ -293,10 +381,11 @@ class Item:
 	
 	#DROP removes the item from the player's inventory and adds it to the map objects.
 	def drop(self):
-		objects.append(self.owner)
+		journal.changed = True
 		inventory.remove(self.owner)
 		self.owner.x = player.x
 		self.owner.y = player.y
+		addObject(self.owner)
 		message("You dropped a " + self.owner.name + ".", libtcod.yellow)
 		
 		if self.owner.equipment:
@@ -334,7 +423,8 @@ class Equipment:
 		self.isWorn = False
 		message("You have unequipped the " + self.owner.name, libtcod.light_green)
 		
-#The Tile class describes a given tile on the map and its properties.
+#The Tile class describes a given tile on the map and its properties. Maps are now stored in a TileGrid,
+#but the class is kept so that games saved with the old list-of-tiles maps can still be loaded.
 class Tile:
 	#INIT initializes and constructs the tile with the given parameters.
 	def __init__(self, blocked, blockSight = None):
@@ -345,6 +435,327 @@ class Tile:
 		if blockSight is None: blockSight = blocked
 		self.blockSight = blockSight
 
+#This function creates a flat array of true/false flags, all set to the given value. NumPy arrays are
+#used when NumPy is available, and arrays of bytes from the standard library otherwise.
+def newFlagArray(size, value = False):
+	if numpyAvailable:
+		if value:
+			return numpy.ones(size, dtype = numpy.bool_)
+		return numpy.zeros(size, dtype = numpy.bool_)
+	return array.array("B", [1 if value else 0]) * size
+
+#This function converts any sequence of flags into the kind of array newFlagArray creates.
+def toFlagArray(values):
+	if numpyAvailable:
+		return numpy.array(values, dtype = numpy.bool_)
+	return array.array("B", [1 if value else 0 for value in values])
+
+#The TileGrid class stores the whole map as one flat array per tile property (blocked, blockSight and
+#explored) rather than one Tile object per cell. The cell at (x, y) lives at index y * width + x, which
+#is the same order libtcod's console fill functions use. Indexing the grid as grid[x][y] returns a
+#TileView, which behaves like the old Tile objects, so code written against the list of lists still works.
+class TileGrid(object):
+	#INIT creates a grid of the given size, with every tile blocked (a solid wall) by default.
+	def __init__(self, width, height, blocked = True):
+		self.width = width
+		self.height = height
+		self.blocked = newFlagArray(width * height, blocked)
+		self.blockSight = newFlagArray(width * height, blocked)
+		self.explored = newFlagArray(width * height, False)
+		
+		#The cells whose terrain has changed since the FOV map was last built or updated.
+		self.changed = set()
+	
+	#CARVE makes every tile in the rectangle from (x1, y1) to (x2, y2), inclusive, open floor. Each row of
+	#the rectangle is set with one slice assignment, instead of one tile at a time.
+	def carve(self, x1, y1, x2, y2):
+		if numpyAvailable:
+			self.blocked.reshape(self.height, self.width)[y1:y2 + 1, x1:x2 + 1] = False
+			self.blockSight.reshape(self.height, self.width)[y1:y2 + 1, x1:x2 + 1] = False
+		else:
+			floor = newFlagArray(x2 - x1 + 1)
+			for y in range(y1, y2 + 1):
+				start = self.index(x1, y)
+				self.blocked[start:start + len(floor)] = floor
+				self.blockSight[start:start + len(floor)] = floor
+	
+	#INDEX returns the position of the cell (x, y) in the flag arrays.
+	def index(self, x, y):
+		return y * self.width + x
+	
+	#GETITEM returns column x of the grid, so that grid[x][y] works like it did with lists.
+	def __getitem__(self, x):
+		if x < 0:
+			x += self.width
+		if x < 0 or x >= self.width:
+			raise IndexError("TileGrid column out of range.")
+		return TileColumn(self, x)
+	
+	def __len__(self):
+		return self.width
+	
+	def __iter__(self):
+		for x in range(self.width):
+			yield TileColumn(self, x)
+	
+	#SETSTATE restores a pickled grid. A grid saved with NumPy may be loaded without it, and vice versa,
+	#so the arrays are converted to the kind this session uses.
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.blocked = toFlagArray(self.blocked)
+		self.blockSight = toFlagArray(self.blockSight)
+		self.explored = toFlagArray(self.explored)
+		self.changed = set()
+	
+	#SET TERRAIN changes whether the cell (x, y) blocks movement and sight once the level has been built,
+	#and remembers the cell, so that updateFOVMap can pass the change on to the FOV map.
+	def setTerrain(self, x, y, blocked, blockSight = None):
+		if blockSight is None:
+			blockSight = blocked
+		i = self.index(x, y)
+		self.blocked[i] = blocked
+		self.blockSight[i] = blockSight
+		self.changed.add(i)
+	
+	#OPEN CELLS returns the positions, in the flag arrays, of every cell that can be walked on or seen through.
+	def openCells(self):
+		if numpyAvailable:
+			return numpy.flatnonzero(~(self.blocked & self.blockSight)).tolist()
+		blockSight = self.blockSight
+		return [i for (i, blocked) in enumerate(self.blocked) if not (blocked and blockSight[i])]
+	
+	#FROM TILES builds a grid out of an old-style list of lists of Tile objects.
+	@classmethod
+	def fromTiles(cls, tiles):
+		grid = cls(len(tiles), len(tiles[0]))
+		for x in range(grid.width):
+			for y in range(grid.height):
+				i = grid.index(x, y)
+				grid.blocked[i] = tiles[x][y].blocked
+				grid.blockSight[i] = tiles[x][y].blockSight
+				grid.explored[i] = tiles[x][y].explored
+		return grid
+
+#The TileColumn class is one column of a TileGrid, returned by grid[x].
+class TileColumn(object):
+	__slots__ = ("grid", "x")
+	
+	def __init__(self, grid, x):
+		self.grid = grid
+		self.x = x
+	
+	def __getitem__(self, y):
+		if y < 0:
+			y += self.grid.height
+		if y < 0 or y >= self.grid.height:
+			raise IndexError("TileGrid row out of range.")
+		return TileView(self.grid, self.grid.index(self.x, y))
+	
+	def __len__(self):
+		return self.grid.height
+
+#The TileView class is a lightweight stand-in for a Tile. Reading or writing its properties reads or
+#writes the grid's arrays directly.
+class TileView(object):
+	__slots__ = ("grid", "i")
+	
+	def __init__(self, grid, i):
+		self.grid = grid
+		self.i = i
+	
+	def getBlocked(self):
+		return bool(self.grid.blocked[self.i])
+	def setBlocked(self, value):
+		self.grid.blocked[self.i] = value
+		self.grid.changed.add(self.i)
+	blocked = property(getBlocked, setBlocked)
+	
+	def getBlockSight(self):
+		return bool(self.grid.blockSight[self.i])
+	def setBlockSight(self, value):
+		self.grid.blockSight[self.i] = value
+		self.grid.changed.add(self.i)
+	blockSight = property(getBlockSight, setBlockSight)
+	
+	def getExplored(self):
+		return bool(self.grid.explored[self.i])
+	def setExplored(self, value):
+		self.grid.explored[self.i] = value
+	explored = property(getExplored, setExplored)
+
+#The SpatialIndex class keeps track of which objects stand on each cell of the current level, so that
+#questions like "is there a monster here?" don't need to scan the whole list of objects. Objects must be
+#added when they enter the level, removed when they leave it, and moved with MOVE, never by changing
+#their coordinates directly while they are indexed.
+class SpatialIndex:
+	#INIT creates an index, optionally filled with the given objects.
+	def __init__(self, objects = ()):
+		self.cells = {}
+		for obj in objects:
+			self.add(obj)
+	
+	#ADD puts an object into the index at its current position.
+	def add(self, obj):
+		cell = (obj.x, obj.y)
+		occupants = self.cells.get(cell)
+		if occupants is None:
+			self.cells[cell] = [obj]
+		else:
+			occupants.append(obj)
+	
+	#REMOVE takes an object out of the index.
+	def remove(self, obj):
+		cell = (obj.x, obj.y)
+		occupants = self.cells[cell]
+		occupants.remove(obj)
+		if not occupants:
+			del self.cells[cell]
+	
+	#MOVE changes an object's position and updates the index to match.
+	def move(self, obj, x, y):
+		self.remove(obj)
+		obj.x = x
+		obj.y = y
+		self.add(obj)
+	
+	#AT returns a list of all the objects standing on the given cell.
+	def at(self, x, y):
+		return self.cells.get((x, y), [])
+	
+	#BLOCKER AT returns the object blocking the given cell, or None if there isn't one.
+	def blockerAt(self, x, y):
+		for obj in self.cells.get((x, y), ()):
+			if obj.blocks:
+				return obj
+		return None
+	
+	#FIGHTERS AT returns the objects on the given cell that can fight or be attacked.
+	def fightersAt(self, x, y):
+		return [obj for obj in self.cells.get((x, y), ()) if obj.fighter]
+	
+	#ITEMS AT returns the objects on the given cell that can be picked up.
+	def itemsAt(self, x, y):
+		return [obj for obj in self.cells.get((x, y), ()) if obj.item]
+
+#The TurnScheduler class decides which actors take a turn, and in what order. Each actor waits in a
+#priority queue, ordered by the time its next action is due, so a turn only visits the actors that are
+#due, instead of every object on the level. Actors that are due at the same time act in the order they
+#were scheduled.
+class TurnScheduler:
+	#INIT creates a schedule with its clock at zero, optionally filled with the given actors.
+	def __init__(self, actors = ()):
+		self.time = 0
+		self.queue = []
+		self.entries = {}
+		self.counter = itertools.count()
+		for actor in actors:
+			self.add(actor)
+	
+	#ADD schedules an actor to act once its next action is due, one action's time from now.
+	def add(self, actor):
+		self.remove(actor)
+		self.push(actor, self.time + actionDelay(actor))
+	
+	#PUSH puts an actor into the queue, due at the given time.
+	def push(self, actor, due):
+		entry = [due, next(self.counter), actor]
+		self.entries[actor] = entry
+		heapq.heappush(self.queue, entry)
+	
+	#REMOVE takes an actor out of the schedule. Its entry is left in the queue, emptied, and is thrown away
+	#when it reaches the front, which is cheaper than searching the queue for it.
+	def remove(self, actor):
+		entry = self.entries.pop(actor, None)
+		if entry is not None:
+			entry[2] = None
+	
+	#ADVANCE moves the clock forward by the given time, and lets every actor whose action falls due in
+	#that time take its turn, in order. Fast actors may act more than once.
+	def advance(self, delay):
+		self.time += delay
+		while self.queue and self.queue[0][0] <= self.time:
+			(due, order, actor) = heapq.heappop(self.queue)
+			if actor is None:
+				continue
+			del self.entries[actor]
+			if not actor.ai:
+				continue
+			
+			#The next action is scheduled before this one is taken, so that an actor that is removed during
+			#its own turn stays removed.
+			self.push(actor, due + actionDelay(actor))
+			actor.ai.takeTurn()
+
+#The eight directions a step can take, straight ones first.
+DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+#The FlowField class is a map of walking distances to the player, shared by every monster chasing them.
+#It is computed with libtcod's Dijkstra search over the walkable cells of the FOV map, the first time a
+#monster asks for it after the player has moved, so any number of hunting monsters cost one search per
+#player move. Each monster then only has to step downhill.
+class FlowField:
+	def __init__(self):
+		self.dijkstra = None
+		self.origin = None
+	
+	#INVALIDATE forgets the distances, so that they are recomputed when next needed. This must be done
+	#whenever the terrain of the FOV map changes.
+	def invalidate(self):
+		self.origin = None
+	
+	#UPDATE recomputes the distances if the player has moved since they were last computed. The Dijkstra map
+	#is made the first time, and owned by a NativeHandle, which deletes it with the flow field at the latest.
+	def update(self):
+		if self.dijkstra is None:
+			self.dijkstra = libtcod.NativeHandle(libtcod.dijkstra_new(fovMap), libtcod.dijkstra_delete)
+		if self.origin != (player.x, player.y):
+			libtcod.dijkstra_compute(self.dijkstra.handle, player.x, player.y)
+			self.origin = (player.x, player.y)
+	
+	#DELETE frees the Dijkstra map, once the level the flow field belongs to is done with.
+	def delete(self):
+		if self.dijkstra is not None:
+			self.dijkstra.delete()
+			self.dijkstra = None
+	
+	#NEXT STEP returns the direction of the free cell next to (x, y) that is the fewest steps from the
+	#player, or None if no free neighbouring cell is any closer than (x, y) itself.
+	def nextStep(self, x, y):
+		self.update()
+		dijkstra = self.dijkstra.handle
+		closest = libtcod.dijkstra_get_distance(dijkstra, x, y)
+		if closest < 0:
+			return None
+		
+		step = None
+		for (directionX, directionY) in DIRECTIONS:
+			(nextX, nextY) = (x + directionX, y + directionY)
+			if not (0 <= nextX < map.width and 0 <= nextY < map.height):
+				continue
+			distance = libtcod.dijkstra_get_distance(dijkstra, nextX, nextY)
+			if 0 <= distance < closest and not isBlocked(nextX, nextY):
+				closest = distance
+				step = (directionX, directionY)
+		return step
+
+#This function returns how long an action takes the given actor, according to its speed.
+def actionDelay(actor):
+	return max(1, ACTION_COST * NORMAL_SPEED / actor.speed)
+
+#This function adds an object to the current level, in both the list of objects and the spatial index.
+#Objects with an AI are also given a place in the turn schedule.
+def addObject(obj):
+	objects.append(obj)
+	occupancy.add(obj)
+	if obj.ai:
+		scheduler.add(obj)
+
+#This function removes an object from the current level.
+def removeObject(obj):
+	objects.remove(obj)
+	occupancy.remove(obj)
+	scheduler.remove(obj)
+
 #The Rectangle class defines a rectangle of tiles on the map, and is used to characterize a room.
 class Rectangle:
 	#INIT constructs a rectangle by taking the top-left coordinates in tiles and its size, to define
@@ -366,68 +777,80 @@ class Rectangle:
 		return (self.x1 <= other.x2 and self.x2 >= other.x1 and
 			self.y1 <= other.y2 and self.y2 >= other.y1)
 
-def carveRoom(room):
-	global map
-	
-	#Go through the tiles in the rectangle and make them passable. Incrementing x1 and y1 by 1
-	#ensures that there is always a one-tile wall around a room.
-	for x in range(room.x1 + 1, room.x2):
-		for y in range(room.y1 + 1, room.y2):
-			map[x][y].blocked = False
-			map[x][y].blockSight = False
+#The RoomGrid class marks the cells covered by the rooms placed on a map so far, walls included, so that
+#a new room can be checked for overlap by looking only at the cells under it.
+class RoomGrid:
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.cells = newFlagArray(width * height)
+	
+	#OVERLAPS returns true if the rectangle shares any cell with a room placed so far, which is the same test
+	#as Rectangle.intersect against every one of them.
+	def overlaps(self, room):
+		if numpyAvailable:
+			return bool(self.cells.reshape(self.height, self.width)[room.y1:room.y2 + 1, room.x1:room.x2 + 1].any())
+		for y in range(room.y1, room.y2 + 1):
+			start = y * self.width + room.x1
+			if any(self.cells[start:start + room.x2 - room.x1 + 1]):
+				return True
+		return False
+	
+	#ADD marks the cells of a newly placed room.
+	def add(self, room):
+		if numpyAvailable:
+			self.cells.reshape(self.height, self.width)[room.y1:room.y2 + 1, room.x1:room.x2 + 1] = True
+		else:
+			covered = newFlagArray(room.x2 - room.x1 + 1, True)
+			for y in range(room.y1, room.y2 + 1):
+				start = y * self.width + room.x1
+				self.cells[start:start + len(covered)] = covered
+
+def carveRoom(map, room):
+	#Make the tiles inside the rectangle passable. Leaving out the rectangle's edges ensures that there
+	#is always a one-tile wall around a room.
+	map.carve(room.x1 + 1, room.y1 + 1, room.x2 - 1, room.y2 - 1)
 
 #This function carves a horizontal tunnel of unblocked tiles.
-def carveHorizontalTunnel(x1, x2, y):
-	global map
-	
-	#MIN and MAX return the minimum and maximum of two given values, respectively. For loops only work
-	#from a lower value to a higher value. Min and max ensure that, no matter which is lower, x1 or x2,
-	#the for loop will work as intended.
-	for x in range(min(x1, x2), max(x1, x2) + 1):
-		map[x][y].blocked = False
-		map[x][y].blockSight = False
+def carveHorizontalTunnel(map, x1, x2, y):
+	#MIN and MAX return the minimum and maximum of two given values, respectively. The tunnel is carved
+	#from the lower to the higher, no matter which of x1 and x2 that is.
+	map.carve(min(x1, x2), y, max(x1, x2), y)
 			
 #This function carves a vertical tunnel of floor tiles.
-def carveVerticalTunnel(y1, y2, x):
-	global map
-	
-	for y in range(min(y1, y2), max(y1, y2) + 1):
-		map[x][y].blocked = False
-		map[x][y].blockSight = False
+def carveVerticalTunnel(map, y1, y2, x):
+	map.carve(x, min(y1, y2), x, max(y1, y2))
 
 #This function checks to see if a tile is blocked.
 def isBlocked(x, y):
 	#First, test the tile itself.
-	if map[x][y].blocked:
+	if map.blocked[map.index(x, y)]:
 		return True
 	
 	#Now, check for any blocking objects.
-	for object in objects:
-		if object.blocks and object.x == x and object.y == y:
-			return True
-	
-	return False
+	return occupancy.blockerAt(x, y) is not None
 
-#This function places objects into a room.
-def placeObjects(room):
+#This function places objects into a room of a level that is being built, drawing its random numbers
+#from the given random number stream.
+def placeObjects(level, room, rng):
 	#Maximum number of monsters per room.
-	maxMonsters = fromDungeonLevel([[2,1], [3, 4], [5,6]])
+	maxMonsters = fromDungeonLevel([[2,1], [3, 4], [5,6]], level.depth)
 	
 	monsterChances = {}
 	monsterChances["orc"] = 80
-	monsterChances["troll"] = fromDungeonLevel([[15, 3], [30, 5], [60, 7]])
+	monsterChances["troll"] = fromDungeonLevel([[15, 3], [30, 5], [60, 7]], level.depth)
 	
 	#Maximum number of items per room.
-	maxItems = fromDungeonLevel([[1,1], [2,4]])
+	maxItems = fromDungeonLevel([[1,1], [2,4]], level.depth)
 	
 	itemChances = {}
 	itemChances["heal"] = 35
-	itemChances["lightning"] = fromDungeonLevel([[25,4]])
-	itemChances["fireball"] = fromDungeonLevel([[25,6]])
-	itemChances["confuse"] = fromDungeonLevel([[10,2]])
+	itemChances["lightning"] = fromDungeonLevel([[25,4]], level.depth)
+	itemChances["fireball"] = fromDungeonLevel([[25,6]], level.depth)
+	itemChances["confuse"] = fromDungeonLevel([[10,2]], level.depth)
 	
 	#Choose a random number of monsters below the maximum
-	numberOfMonsters = libtcod.random_get_int(0, 0, maxMonsters)
+	numberOfMonsters = libtcod.random_get_int(rng, 0, maxMonsters)
 	#monsterChances = {"orc": 80, "troll": 20}
 	#itemChances = {"heal": 70, "lightning": 10, "fireball": 10, "confuse": 10}
 	#itemChances["sword"] = 25
@@ -436,12 +859,12 @@ def placeObjects(room):
 		#Choose a random spot for this monster. X and Y values are offset by one because the room's
 		#rectangle includes its walls as well, and if it picks a wall tile, it will not get created
 		#due to the tile being blocked.
-		x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-		y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+		x = libtcod.random_get_int(rng, room.x1 + 1, room.x2 - 1)
+		y = libtcod.random_get_int(rng, room.y1 + 1, room.y2 - 1)
 		
-		if not isBlocked(x,y):
+		if not level.isBlocked(x,y):
 			#Only place the object if the tile is not blocked.
-			choice = chooseFromDict(monsterChances)
+			choice = chooseFromDict(monsterChances, rng)
 			if choice == "orc":
 				fighterComponent = Fighter(20, 4, 0, 35, monsterDeath)
 				aiComponent = BasicMonster()
@@ -455,18 +878,18 @@ def placeObjects(room):
 				monster = Object(x, y, "T", "Troll", libtcod.darker_green,
 					blocks = True, fighter = fighterComponent, ai = aiComponent)
 					
-			objects.append(monster)
+			level.add(monster)
 	
-	numberOfItems = libtcod.random_get_int(0, 0, maxItems)
+	numberOfItems = libtcod.random_get_int(rng, 0, maxItems)
 	
 	for i in range(numberOfItems):
 		#Choose a random spot for this item.
-		x = libtcod.random_get_int(0, room.x1 + 1, room.x2 - 1)
-		y = libtcod.random_get_int(0, room.y1 + 1, room.y2 - 1)
+		x = libtcod.random_get_int(rng, room.x1 + 1, room.x2 - 1)
+		y = libtcod.random_get_int(rng, room.y1 + 1, room.y2 - 1)
 
-		if not isBlocked(x,y):
+		if not level.isBlocked(x,y):
 			#Only place this item if the tile is not blocked.
-			choice = chooseFromDict(itemChances)
+			choice = chooseFromDict(itemChances, rng)
 			if choice == "heal":
 				itemComponent = Item(useEffect = castHeal)
 				item = Object(x, y, gPotion, "Healing Potion", libtcod.violet, item = itemComponent)
@@ -484,51 +907,91 @@ def placeObjects(room):
 				item = Object(x, y, gScroll, "Scroll of Confuse", libtcod.light_yellow, item = itemComponent) 
 			
 			item.alwaysVisible = True
-			objects.append(item)
-			item.sendToBack() #Items appear below other objects.
+			level.add(item, toBack = True) #Items appear below other objects.
+
+#The Level class holds everything that makes up one level of the dungeon: its map, the objects on it
+#along with their spatial index and turn schedule, the stairs down, and the spot where the player
+#arrives. Levels are built by generateLevel, away from the game's globals, so that they can be built in
+#the background, and become the current level through enterLevel.
+class Level:
+	#INIT creates an empty level at the given depth: a map full of wall, with nothing on it yet.
+	def __init__(self, depth, seed, width = MAP_WIDTH, height = MAP_HEIGHT):
+		self.depth = depth
+		self.seed = seed
 		
-def makeMap():
-	global map, objects, stairsDown
-	
-	#First, instantiate the list of objects, with just the player at this point.
-	objects = [player]
-	
-	#Fill the map with "blocked" tiles. This uses a construct called a list comprehension. When
-	#making a list comprehension such as this, it is imperative to always call the constructor of
-	#the objects that are being created. For example, if we attempted to first create a variable,
-	#and then refer to that variable here, all elements in this list would point to that same variable.
-	#Calling the constructor ensures that all of these Tiles are distinct instances.
-	map = [[ Tile(True)
-		for y in range(MAP_HEIGHT) ]
-			for x in range(MAP_WIDTH) ]
+		#Fill the map with "blocked" tiles. The TileGrid keeps every tile property in one compact array,
+		#so even a large map costs a few bytes per cell instead of a whole Python object.
+		self.map = TileGrid(width, height)
+		self.objects = []
+		self.occupancy = SpatialIndex()
+		self.scheduler = TurnScheduler()
+		self.stairsDown = None
+		self.stairsUp = None
+		self.start = (0, 0)
+		
+		#The level's FOV map and flow field are built when the level is first entered, and kept while the
+		#level is in memory. The FOV map is owned by a NativeHandle, so that it is deleted even if the level is
+		#dropped without being freed. A level is dirty once it has changed, until it is stored in the archive.
+		#The journal tells when it changes, by the changes it writes.
+		self.fovMap = None
+		self.flowField = None
+		self.dirty = False
+	
+	#ADD puts an object on the level. Objects sent to the back are drawn below the others.
+	def add(self, obj, toBack = False):
+		if toBack:
+			self.objects.insert(0, obj)
+		else:
+			self.objects.append(obj)
+		self.occupancy.add(obj)
+		if obj.ai:
+			self.scheduler.add(obj)
+	
+	#IS BLOCKED checks whether a tile of the level is a wall or has a blocking object on it.
+	def isBlocked(self, x, y):
+		return bool(self.map.blocked[self.map.index(x, y)]) or self.occupancy.blockerAt(x, y) is not None
+
+#This function builds a new level of the dungeon at the given depth. Every random number it uses comes
+#from its own stream, started from the given seed, so the same depth and seed always give the same
+#level, and the level can be built on another thread without disturbing the game's random numbers. The
+#map's size and the number of rooms tried can be changed from the usual ones, for testing.
+def generateLevel(depth, seed, width = MAP_WIDTH, height = MAP_HEIGHT, maxRooms = MAX_ROOMS):
+	level = Level(depth, seed, width, height)
+	map = level.map
+	rng = libtcod.random_new_from_seed(seed)
 	
 	rooms = []
+	roomGrid = RoomGrid(width, height)
 	numberOfRooms = 0
 	
-	for r in range(MAX_ROOMS):
+	for r in range(maxRooms):
 		#Random width and height.
-		width = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-		height = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+		roomWidth = libtcod.random_get_int(rng, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+		roomHeight = libtcod.random_get_int(rng, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
 		
 		#Random position, without going out of the boundaries of the map
-		x = libtcod.random_get_int(0, 0, MAP_WIDTH - width - 1)
-		y = libtcod.random_get_int(0, 0, MAP_HEIGHT - height - 1)
+		x = libtcod.random_get_int(rng, 0, map.width - roomWidth - 1)
+		y = libtcod.random_get_int(rng, 0, map.height - roomHeight - 1)
 		
-		newRoom = Rectangle(x, y, width, height)
+		newRoom = Rectangle(x, y, roomWidth, roomHeight)
 		
-		#Run through the other rooms to see if they intersect with this one. If it intersects with any
-		#other rooms, reject the room and break from the loop.
-		failed = False
-		for otherRoom in rooms:
-			if newRoom.intersect(otherRoom):
-				failed = True
-				break
+		#Check whether the new room intersects with any of the other rooms, and reject it if it does.
+		#The room grid answers at once; otherwise, run through the other rooms, and break from the loop
+		#at the first intersection.
+		if ROOM_OVERLAP_TEST == "grid":
+			failed = roomGrid.overlaps(newRoom)
+		else:
+			failed = False
+			for otherRoom in rooms:
+				if newRoom.intersect(otherRoom):
+					failed = True
+					break
 		
 		if not failed:
 			#This point in the loop means that there are no intersections, so this room is valid. We
 			#now paint it to the map's tiles.
-			carveRoom(newRoom)
-			placeObjects(newRoom)
+			carveRoom(map, newRoom)
+			placeObjects(level, newRoom, rng)
 			
 			#Gather center coordinates of new room.
 			(newX, newY) = newRoom.center()
@@ -542,8 +1005,7 @@ def makeMap():
 			
 			if numberOfRooms == 0:
 				#This must be the first room, so the player will start here.
-				player.x = newX
-				player.y = newY
+				level.start = (newX, newY)
 			else:
 				#For all rooms after the first, we must connect it to the previous room using a tunnel.
 				#Not every room can be connected using a strictly horizontal or vertical tunnel. For
@@ -554,23 +1016,206 @@ def makeMap():
 				#Gather center coordinates of previous room.
 				(prevX, prevY) = rooms[numberOfRooms - 1].center()
 				
-				if libtcod.random_get_int(0, 0, 1) == 1:
+				if libtcod.random_get_int(rng, 0, 1) == 1:
 					#First move horizontally, then vertically.
-					carveHorizontalTunnel(prevX, newX, prevY)
-					carveVerticalTunnel(prevY, newY, newX)
+					carveHorizontalTunnel(map, prevX, newX, prevY)
+					carveVerticalTunnel(map, prevY, newY, newX)
 				else:
 					#First move vertically, then horizontally.
-					carveVerticalTunnel(prevY, newY, prevX)
-					carveHorizontalTunnel(prevX, newX, newY)
+					carveVerticalTunnel(map, prevY, newY, prevX)
+					carveHorizontalTunnel(map, prevX, newX, newY)
 			
-			#Finally, append the new room to the list.
+			#Finally, append the new room to the list, and mark it on the room grid.
 			rooms.append(newRoom)
+			roomGrid.add(newRoom)
 			numberOfRooms += 1
 		
-	#Create stairs down at the center of the last room.
-	stairsDown = Object(newX, newY, ">", "Stairs Down", libtcod.white, alwaysVisible = True)
-	objects.append(stairsDown)
-	stairsDown.sendToBack()
+	#Create stairs down at the center of the last room, and below the first level, stairs up where the
+	#player starts.
+	level.stairsDown = Object(newX, newY, ">", "Stairs Down", libtcod.white, alwaysVisible = True)
+	level.add(level.stairsDown, toBack = True)
+	if depth > 1:
+		(startX, startY) = level.start
+		level.stairsUp = Object(startX, startY, "<", "Stairs Up", libtcod.white, alwaysVisible = True)
+		level.add(level.stairsUp, toBack = True)
+	
+	libtcod.random_delete(rng)
+	return level
+
+#This function returns the seed for the level at the given depth, which follows from the game's seed.
+def levelSeed(depth):
+	return (gameSeed + depth * 1000003) & 0x7FFFFFFF
+
+#Apart from the levels, each part of the game that needs random numbers during play draws them from a
+#stream of its own, seeded from the game's seed, so that the same seed and the same input always play out
+#the same way, and a change in how one part uses random numbers doesn't change what happens in the others.
+RANDOM_STREAMS = ["monsters"]
+
+#This function creates the random streams of the current game, replacing those of the last one.
+def seedRandomStreams():
+	for rng in randomStreams.values():
+		libtcod.random_delete(rng)
+	randomStreams.clear()
+	for name in RANDOM_STREAMS:
+		randomStreams[name] = libtcod.random_new_from_seed((gameSeed + zlib.crc32(name)) & 0x7FFFFFFF)
+
+#The LevelPregenerator class builds the next level of the dungeon on a background thread while the player
+#explores the current one, so that taking the stairs doesn't have to wait for it.
+class LevelPregenerator:
+	def __init__(self):
+		self.level = None
+		self.building = None
+	
+	#START begins building the level at the given depth in the background, unless it is being built or has
+	#been built there already.
+	def start(self, depth, seed):
+		if self.building == (depth, seed):
+			return
+		self.building = (depth, seed)
+		self.level = None
+		thread = threading.Thread(target = self.run, args = (depth, seed))
+		thread.start()
+	
+	#RUN is the body of the background thread.
+	def run(self, depth, seed):
+		self.level = generateLevel(depth, seed)
+	
+	#TAKE returns the level at the given depth. If the background thread has finished it, it is handed over
+	#at once. Otherwise the level is built right away instead, which gives exactly the same level, since it
+	#comes from the same seed; whatever the thread finishes later is thrown away.
+	def take(self, depth, seed):
+		level = self.level
+		(self.level, self.building) = (None, None)
+		if level is None or level.depth != depth or level.seed != seed:
+			level = generateLevel(depth, seed)
+		return level
+
+#This function makes the given level the current one: the globals that describe the current level are
+#pointed at it, the player is put at the given spot, or else its starting spot, and its FOV map is built,
+#unless it was built on an earlier visit. Building of the next level down then begins in the background.
+def enterLevel(level, position = None):
+	global currentLevel, map, objects, stairsDown, stairsUp, occupancy, scheduler, dungeonLevel
+	
+	currentLevel = level
+	map = level.map
+	objects = level.objects
+	occupancy = level.occupancy
+	scheduler = level.scheduler
+	stairsDown = level.stairsDown
+	stairsUp = level.stairsUp
+	dungeonLevel = level.depth
+	
+	#The player's turns are driven by the keyboard, so the player goes into the spatial index, but not the
+	#turn schedule.
+	(player.x, player.y) = position or level.start
+	objects.append(player)
+	occupancy.add(player)
+	
+	initializeFOV()
+	pregenerateNextLevel()
+
+#This function takes the player off the current level, and puts the level in the level cache. The journal
+#is brought up to the moment the player leaves, and ended there. Without the journal to tell whether the
+#level has changed, it is taken to have changed.
+def leaveLevel():
+	if not journal.running:
+		currentLevel.dirty = True
+	journal.leaveLevel()
+	objects.remove(player)
+	occupancy.remove(player)
+	levelCache.put(currentLevel)
+
+#This function makes a Level of the current level's globals, for a game that has just been loaded. A
+#player coming down to it again arrives on its stairs up. The level is dirty, since the archive may hold an
+#older copy of it.
+def levelFromGlobals():
+	level = Level(dungeonLevel, levelSeed(dungeonLevel), map.width, map.height)
+	level.dirty = True
+	(level.map, level.objects, level.occupancy, level.scheduler) = (map, objects, occupancy, scheduler)
+	(level.stairsDown, level.stairsUp) = (stairsDown, stairsUp)
+	level.start = (stairsUp.x, stairsUp.y) if stairsUp else (player.x, player.y)
+	return level
+
+#This function frees the levels of a game that is over: the current one, and those in the level cache.
+def forgetLevels():
+	if currentLevel is not None:
+		freeLevel(currentLevel)
+	levelCache.clear()
+
+#This function frees the FOV map and flow field of a level that is done with.
+def freeLevel(level):
+	if level.flowField is not None:
+		level.flowField.delete()
+	if level.fovMap is not None:
+		level.fovMap.delete()
+	(level.fovMap, level.flowField) = (None, None)
+
+#The LevelCache class keeps the levels the player has left most recently in memory, whole, with their FOV
+#maps and flow fields, so that going back to one of them is only a matter of pointing the globals at it.
+#The least recently left level is spilled to the level archive once more than LEVEL_CACHE_SIZE are kept.
+class LevelCache:
+	def __init__(self):
+		self.levels = collections.OrderedDict()
+	
+	#HAS tells whether the level at the given depth is in the cache.
+	def has(self, depth):
+		return depth in self.levels
+	
+	#PUT adds a level to the cache, as the most recently used one.
+	def put(self, level):
+		self.levels[level.depth] = level
+		while len(self.levels) > LEVEL_CACHE_SIZE:
+			(depth, oldest) = self.levels.popitem(last = False)
+			self.spill(oldest)
+	
+	#TAKE removes the level at the given depth from the cache and returns it, or returns None if it isn't
+	#there.
+	def take(self, depth):
+		return self.levels.pop(depth, None)
+	
+	#SPILL stores a level leaving the cache in the archive, if it has changed since it was last stored or
+	#was never stored, and frees what it holds in libtcod.
+	def spill(self, level):
+		self.store(level)
+		freeLevel(level)
+	
+	#FLUSH stores every level in the cache that has changed in the archive, keeping them in the cache, so
+	#that the archive is up to date with a save of the game. Levels that haven't changed are not written
+	#again, so going back and forth between levels doesn't grow the archive.
+	def flush(self):
+		for level in self.levels.values():
+			self.store(level)
+	
+	#STORE stores a level in the archive, if it has changed since it was last stored or was never stored.
+	def store(self, level):
+		if level.dirty or not archive.has(level.depth):
+			archive.store(level)
+			level.dirty = False
+	
+	#CLEAR empties the cache, when the game it belongs to is over.
+	def clear(self):
+		for level in self.levels.values():
+			freeLevel(level)
+		self.levels.clear()
+
+#This function starts building the level below the current one, if levels are built in the background
+#and it hasn't been visited already.
+def pregenerateNextLevel():
+	depth = dungeonLevel + 1
+	if PREGENERATE_LEVELS and not levelCache.has(depth) and not archive.has(depth):
+		pregenerator.start(depth, levelSeed(depth))
+
+#This function returns the level at the given depth: from the level cache or the level archive if it has
+#been visited before, or else from the background thread if it has been built there.
+def takeLevel(depth):
+	level = levelCache.take(depth)
+	if level is not None:
+		return level
+	if archive.has(depth):
+		return archive.load(depth)
+	if PREGENERATE_LEVELS:
+		return pregenerator.take(depth, levelSeed(depth))
+	return generateLevel(depth, levelSeed(depth))
 
 #This function controls the player's movement and attack actions.
 def playerMoveOrAttack(directionX, directionY):
@@ -582,10 +1227,9 @@ def playerMoveOrAttack(directionX, directionY):
 	
 	#Try to find an attackable object there
 	target = None
-	for object in objects: 
-		if object.fighter and object.x == x and object.y == y:
-			target = object
-			break
+	fighters = occupancy.fightersAt(x, y)
+	if fighters:
+		target = fighters[0]
 	
 	#Attack if a target is found, move otherwise.
 	if target is not None:
@@ -631,10 +1275,9 @@ def handleKeys():
 			#Test for other keys.
 			if keyChar == "g":
 				#(G)et picks up an item.
-				for object in objects:
-					if object.x == player.x and object.y == player.y and object.item:
-						object.item.pickup()
-						break
+				items = occupancy.itemsAt(player.x, player.y)
+				if items:
+					items[0].item.pickup()
 			if keyChar == "i":
 				#(I)nventory brings up the player's inventory.
 				chosenItem = inventoryMenu("Press the key next to an item name to use it, or any other key to cancel.\n")
@@ -655,10 +1298,18 @@ def handleKeys():
 					+ "\nHealth:            " + str(player.fighter.hits)
 					+ "\nAttack:            " + str(player.fighter.atk)
 					+ "\nDefense:           " + str(player.fighter.dfn), MIRROR_SCREEN_WIDTH)
+			if keyChar == "m":
+				#(M)essages shows the latest messages in the history.
+				announce("\n".join(messageLog.recentHistory(HISTORY_SCREEN_WIDTH, SCREEN_HEIGHT - 2)),
+					HISTORY_SCREEN_WIDTH)
 			if keyChar == ">":
 				#Descend stairs, if the player is on them.
 				if stairsDown.x == player.x and stairsDown.y == player.y:
 					nextLevel()
+			if keyChar == "<":
+				#Climb stairs, if the player is on them.
+				if stairsUp and stairsUp.x == player.x and stairsUp.y == player.y:
+					previousLevel()
 			
 			return "no turn taken"
 
@@ -670,107 +1321,537 @@ def getNamesUnderMouse():
 	
 	#Create a list with the names of all the objects at the mouse's coordinates. These objects must
 	#be within the player's FOV, however, or else they would be able to detect things through walls.
-	#This uses the if variant of a list comprehension.
-	names = [obj.name for obj in objects
-		if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fovMap, obj.x, obj.y)]
+	names = []
+	if isInFOV(x, y):
+		names = [obj.name for obj in occupancy.at(x, y)]
 	
 	#Join the names, separated by commas, and return the list with the first letter capitalized.
 	names = ", ".join(names)
 	return names.capitalize()
 	
+#The MessageLog class keeps the messages told to the player. The lines shown in the panel, the latest
+#MESSAGE_HEIGHT lines of the wrapped messages, are kept in a deque that drops the oldest line by itself, and
+#the log can be iterated over as (line, color) pairs of them. Behind them, the history keeps every message,
+#up to MESSAGE_HISTORY of them, as its text, its color packed into an int, and a count. A message told again
+#straight after itself isn't added again: its count goes up, and its lines are shown again with the count,
+#as in "The orc misses you. (x4)". The version goes up with every change, so that the panel is only drawn
+#again when the log has changed. The history is saved with the game, along with the number of messages ever
+#added to it, which the journal uses to tell which messages are new.
+class MessageLog:
+	#Messages wrapped into lines, by their text, shared by every log.
+	wrapped = {}
+	
+	def __init__(self, lines = (), history = None, added = None):
+		self.lines = collections.deque(lines, MESSAGE_HEIGHT)
+		if history is None:
+			history = historyFromLines(self.lines)
+		self.history = collections.deque((list(entry) for entry in history), MESSAGE_HISTORY)
+		self.added = len(self.history) if added is None else added
+		self.version = 0
+	
+	def __iter__(self):
+		return iter(self.lines)
+	
+	def __len__(self):
+		return len(self.lines)
+	
+	#WRAP splits a message among as many lines as it needs in the panel, with Python's textwrap module.
+	def wrap(self, text):
+		lines = self.wrapped.get(text)
+		if lines is None:
+			if len(self.wrapped) >= WRAP_CACHE_SIZE:
+				self.wrapped.clear()
+			lines = self.wrapped[text] = textwrap.wrap(text, MESSAGE_WIDTH)
+		return lines
+	
+	#ADD adds a message in the given color, or counts it again if it is the same as the last one, in which
+	#case the lines it was last shown on are replaced.
+	def add(self, text, color):
+		packed = packColor(color)
+		last = self.history[-1] if self.history else None
+		if last is not None and last[0] == text and last[1] == packed:
+			for i in range(min(len(self.wrap(countedMessage(last[0], last[2]))), len(self.lines))):
+				self.lines.pop()
+			last[2] += 1
+			text = countedMessage(text, last[2])
+		else:
+			self.history.append([text, packed, 1])
+			self.added += 1
+		
+		self.lines.extend((line, color) for line in self.wrap(text))
+		self.version += 1
+	
+	#RECENT HISTORY returns the latest messages, wrapped to the given width, as no more than the given
+	#number of lines.
+	def recentHistory(self, width, height):
+		lines = []
+		for (text, packed, count) in reversed(self.history):
+			lines[:0] = textwrap.wrap(countedMessage(text, count), width)
+			if len(lines) >= height:
+				break
+		return lines[-height:]
+	
+	#MARK returns how many messages have been added to the history, and the count of the latest one, which
+	#change together with the history.
+	def mark(self):
+		return (self.added, self.history[-1][2] if self.history else 0)
+	
+	#HISTORY SINCE returns the messages added to the history since the given number of them had been added,
+	#along with the one before them, whose count may have gone up since.
+	def historySince(self, added):
+		count = min(self.added - added + 1, len(self.history))
+		return list(itertools.islice(self.history, len(self.history) - count, None))
+	
+	#UPDATE HISTORY brings the history up to date with the latest messages of another log's history, as
+	#returned by historySince, once the given number of messages had been added to that one.
+	def updateHistory(self, added, entries):
+		for i in range(min(self.added - (added - len(entries)), len(self.history))):
+			self.history.pop()
+		self.history.extend(list(entry) for entry in entries)
+		self.added = added
+		self.version += 1
+	
+	#SHOW LINES replaces the lines shown in the panel.
+	def showLines(self, lines):
+		self.lines = collections.deque(lines, MESSAGE_HEIGHT)
+		self.version += 1
+
+#This function returns a message as it is shown, with the number of times it was told, if more than once.
+def countedMessage(text, count):
+	if count > 1:
+		return text + " (x" + str(count) + ")"
+	return text
+
+#This function makes a history for a log saved without one, from the lines it showed, with each line taken
+#as a message, and the number of times it was told read back from the end of the line.
+def historyFromLines(lines):
+	history = []
+	for (line, color) in lines:
+		(text, count) = (line, 1)
+		(head, separator, tail) = line.rpartition(" (x")
+		if separator and tail.endswith(")") and tail[:-1].isdigit():
+			(text, count) = (head, int(tail[:-1]))
+		history.append([text, packColor(color), count])
+	return history
+
+#This function packs a color into an int, as 0xRRGGBB.
+def packColor(color):
+	return color.r << 16 | color.g << 8 | color.b
+
 #This function displays messages in the message log on the status bar.
 def message(newMessage, color = libtcod.white):
-	#Split the message if necessary, among multiple lines. This uses Python's textwrap module.
-	newMessageLines = textwrap.wrap(newMessage, MESSAGE_WIDTH)
-	
-	for line in newMessageLines:
-		#If the buffer is full, remove the first line to make room for the new one.
-		if len(messageLog) == MESSAGE_HEIGHT:
-			del messageLog[0]
-		
-		#Add the new line as a tuple, with the text and the color.
-		messageLog.append( (line, color) )
+	global screenNeedsToBeRedrawn
+	screenNeedsToBeRedrawn = True
+	journal.changed = True
+	messageLog.add(newMessage, color)
 
-#This function renders a generic status bar, used for a health bar, a mana bar, experience bar, etc.
-def renderStatusBar(x, y, totalWidth, name, value, maximum, barColor, backColor):
+#This function renders a generic status bar, used for a health bar, a mana bar, experience bar, etc., on the
+#given console.
+def renderStatusBar(console, x, y, totalWidth, name, value, maximum, barColor, backColor):
 	#First, calculate width of the bar.
 	barWidth = int(float(value) / maximum * totalWidth)
 	
 	#Render the background first.
-	libtcod.console_set_default_background(panel, backColor)
-	libtcod.console_rect(panel, x, y, totalWidth, 1, False, libtcod.BKGND_SCREEN)
+	libtcod.console_set_default_background(console, backColor)
+	libtcod.console_rect(console, x, y, totalWidth, 1, False, libtcod.BKGND_SCREEN)
 	
 	#Now render the bar on top.
-	libtcod.console_set_default_background(panel, barColor)
+	libtcod.console_set_default_background(console, barColor)
 	if barWidth > 0:
-		libtcod.console_rect(panel, x, y, barWidth, 1, False, libtcod.BKGND_SCREEN)
+		libtcod.console_rect(console, x, y, barWidth, 1, False, libtcod.BKGND_SCREEN)
 	
 	#Finally, some centered text with the values.
-	libtcod.console_set_default_foreground(panel, libtcod.white)
-	libtcod.console_print_ex(panel, x + totalWidth / 2, y, libtcod.BKGND_NONE, libtcod.CENTER, 
+	libtcod.console_set_default_foreground(console, libtcod.white)
+	libtcod.console_print_ex(console, x + totalWidth / 2, y, libtcod.BKGND_NONE, libtcod.CENTER, 
 		name + ": " + str(value) + "/" + str(maximum))
 		
+#The PanelWidget class is one part of the status panel, in a rectangle of it. Its inputs function returns
+#what it shows, and it is only drawn again, by its draw function, when that changes. The draw function is
+#given the console to draw on, the corner of the rectangle, and the inputs.
+class PanelWidget:
+	def __init__(self, x, y, width, height, inputs, draw):
+		self.x = x
+		self.y = y
+		self.width = width
+		self.height = height
+		self.inputs = inputs
+		self.draw = draw
+		self.state = None
+	
+	#UPDATE draws the widget again, over a blank rectangle, if its inputs have changed since it was last
+	#drawn, and tells whether it did.
+	def update(self, console):
+		state = self.inputs()
+		if state == self.state:
+			return False
+		libtcod.console_set_default_background(console, libtcod.black)
+		libtcod.console_rect(console, self.x, self.y, self.width, self.height, True, libtcod.BKGND_SET)
+		self.draw(console, self.x, self.y, state)
+		self.state = state
+		return True
+
+#The StatusPanel class keeps the status panel drawn on its console, and blits it to the screen only when one
+#of its widgets has changed, or when something else has been drawn over it, such as a menu.
+class StatusPanel:
+	def __init__(self, console, widgets):
+		self.console = console
+		self.widgets = widgets
+		self.onScreen = False
+	
+	#INVALIDATE tells the panel that the screen has been drawn over.
+	def invalidate(self):
+		self.onScreen = False
+	
+	#RENDER draws the widgets whose inputs have changed, and blits the panel to the screen if it needs to be.
+	def render(self):
+		changed = [widget for widget in self.widgets if widget.update(self.console)]
+		if changed or not self.onScreen:
+			libtcod.console_blit(self.console, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
+			self.onScreen = True
+
+#These functions return the inputs of the status panel's widgets, and draw them from those inputs.
+def healthInputs():
+	return (player.fighter.cond, player.fighter.hits)
+
+def renderHealth(console, x, y, state):
+	(cond, hits) = state
+	renderStatusBar(console, x, y, BAR_WIDTH, "Health", cond, hits, libtcod.red, libtcod.darkest_red)
+
+def dungeonLevelInputs():
+	return dungeonLevel
+
+def renderDungeonLevel(console, x, y, depth):
+	libtcod.console_set_default_foreground(console, libtcod.white)
+	libtcod.console_print_ex(console, x, y, libtcod.BKGND_NONE, libtcod.LEFT, "Dungeon Level: " + str(depth))
+
+def messageLogInputs():
+	return (messageLog, messageLog.version)
+
+def renderMessages(console, x, y, state):
+	(log, version) = state
+	for (line, color) in log:
+		libtcod.console_set_default_foreground(console, color)
+		libtcod.console_print_ex(console, x, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+		y += 1
+
+def renderNamesUnderMouse(console, x, y, names):
+	libtcod.console_set_default_foreground(console, libtcod.light_gray)
+	libtcod.console_print_ex(console, x, y, libtcod.BKGND_NONE, libtcod.LEFT, names)
+
+#These multipliers turn the (column, row) coordinates of the first octant into those of each of the eight.
+OCTANTS = [(1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+	(-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)]
+
+#This function computes the field of view from (x, y) by recursive shadowcasting, reading the grid's
+#blockSight array directly, and returns a flag array of the visible tiles. A radius of 0 means no limit:
+#every row of the octants is scanned to the edge of the map, and no cell is too far to be lit.
+def shadowcastFOV(grid, x, y, radius, lightWalls = True):
+	visible = newFlagArray(grid.width * grid.height)
+	if radius <= 0:
+		(reach, radiusSquared) = (max(grid.width, grid.height), 0)
+	else:
+		(reach, radiusSquared) = (radius, radius * radius)
+	visible[grid.index(x, y)] = True
+	for (xx, xy, yx, yy) in OCTANTS:
+		castLight(grid, visible, x, y, 1, 1.0, 0.0, reach, radiusSquared, xx, xy, yx, yy, lightWalls)
+	return visible
+
+#This function lights one octant for shadowcastFOV, one row at a time, between the slopes start and end,
+#out to the given reach. Only cells within the circle of the given squared radius are lit, unless it is 0.
+#Where a wall casts a shadow, the rest of the octant beyond it is lit by a recursive call with a narrower
+#pair of slopes.
+def castLight(grid, visible, originX, originY, row, start, end, reach, radiusSquared, xx, xy, yx, yy, lightWalls):
+	if start < end:
+		return
+	width = grid.width
+	height = grid.height
+	blockSight = grid.blockSight
+	newStart = start
+	for distance in range(row, reach + 1):
+		dy = -distance
+		blocked = False
+		for dx in range(-distance, 1):
+			leftSlope = (dx - 0.5) / (dy + 0.5)
+			rightSlope = (dx + 0.5) / (dy - 0.5)
+			if start < rightSlope:
+				continue
+			if end > leftSlope:
+				break
+			
+			#Cells off the map are treated as walls, but never lit.
+			x = originX + dx * xx + dy * xy
+			y = originY + dx * yx + dy * yy
+			if 0 <= x < width and 0 <= y < height:
+				i = y * width + x
+				wall = blockSight[i]
+				if (not radiusSquared or dx * dx + dy * dy <= radiusSquared) and (lightWalls or not wall):
+					visible[i] = True
+			else:
+				wall = True
+			
+			if blocked:
+				if wall:
+					newStart = rightSlope
+				else:
+					blocked = False
+					start = newStart
+			elif wall and distance < reach:
+				blocked = True
+				castLight(grid, visible, originX, originY, distance + 1, start, leftSlope, reach, radiusSquared,
+					xx, xy, yx, yy, lightWalls)
+				newStart = rightSlope
+		if blocked:
+			break
+
+#The ray tables used by rayTableFOV, by reach. Each one is built the first time it's needed.
+rayTables = {}
+
+#This function returns the ray table for the given reach: the offsets of the cells along libtcod's line
+#from the origin to each cell on the edge of the square of that reach, one ray per row of two NumPy arrays,
+#and a mask of the offsets that fall inside the circle of that radius. Every such line is exactly reach + 1
+#cells long, so the rays fit in rectangular arrays.
+def rayTable(reach):
+	table = rayTables.get(reach)
+	if table is None:
+		edge = ([(dx, -reach) for dx in range(-reach, reach + 1)] + [(dx, reach) for dx in range(-reach, reach + 1)] +
+			[(-reach, dy) for dy in range(-reach + 1, reach)] + [(reach, dy) for dy in range(-reach + 1, reach)])
+		rays = [list(libtcod.line_iter(0, 0, edgeX, edgeY)) for (edgeX, edgeY) in edge]
+		offsetsX = numpy.array([[x for (x, y) in ray] for ray in rays], dtype = numpy.intp)
+		offsetsY = numpy.array([[y for (x, y) in ray] for ray in rays], dtype = numpy.intp)
+		inCircle = offsetsX * offsetsX + offsetsY * offsetsY <= reach * reach
+		table = (offsetsX, offsetsY, inCircle)
+		rayTables[reach] = table
+	return table
+
+#This function computes the field of view from (x, y) by casting a precomputed table of rays, all at once
+#with NumPy, over the grid's blockSight array. A cell is visible if no wall comes before it on its ray,
+#which is what libtcod's basic raycasting does. The cost depends only on the radius, not on the map.
+def rayTableFOV(grid, x, y, radius, lightWalls = True):
+	if not numpyAvailable:
+		return shadowcastFOV(grid, x, y, radius, lightWalls)
+	
+	if radius > 0:
+		(offsetsX, offsetsY, inCircle) = rayTable(radius)
+	else:
+		(offsetsX, offsetsY, inCircle) = rayTable(max(grid.width, grid.height))
+	cellsX = offsetsX + x
+	cellsY = offsetsY + y
+	inside = (cellsX >= 0) & (cellsX < grid.width) & (cellsY >= 0) & (cellsY < grid.height)
+	cells = numpy.where(inside, cellsY * grid.width + cellsX, 0)
+	walls = grid.blockSight[cells] | ~inside
+	
+	#A cell is hidden when there is a wall anywhere before it on its ray.
+	hidden = numpy.zeros(walls.shape, dtype = bool)
+	hidden[:, 1:] = numpy.logical_or.accumulate(walls[:, :-1], axis = 1)
+	lit = inside & ~hidden
+	if radius > 0:
+		lit &= inCircle
+	if not lightWalls:
+		lit &= ~walls
+	
+	visible = newFlagArray(grid.width * grid.height)
+	visible[cells[lit]] = True
+	if lightWalls:
+		lightBorderingWalls(grid, visible, x, y, radius)
+	return visible
+
+#This function returns the pair of slices that line up the cells lo to hi (inclusive) of a row or column
+#with the same cells moved by shift, leaving out any that would fall off the edge of the map.
+def shiftedSlices(lo, hi, shift, size):
+	targetLo = max(lo + shift, 0)
+	targetHi = min(hi + shift, size - 1)
+	return (slice(targetLo - shift, targetHi - shift + 1), slice(targetLo, targetHi + 1))
+
+#This function finishes rayTableFOV the way libtcod finishes its basic raycasting: in each quarter of the
+#view, the walls that border lit floor on the side away from the viewer are lit too, so that room corners
+#and the walls behind pillars aren't left dark.
+def lightBorderingWalls(grid, visible, x, y, radius):
+	(width, height) = (grid.width, grid.height)
+	lit = visible.reshape(height, width)
+	walls = grid.blockSight.reshape(height, width)
+	floors = lit & ~walls
+	if radius > 0:
+		(xMin, yMin, xMax, yMax) = (max(0, x - radius), max(0, y - radius),
+			min(width - 1, x + radius), min(height - 1, y + radius))
+	else:
+		(xMin, yMin, xMax, yMax) = (0, 0, width - 1, height - 1)
+	
+	for (directionX, directionY) in ((-1, -1), (1, -1), (-1, 1), (1, 1)):
+		(x1, x2) = (xMin, x) if directionX < 0 else (x, xMax)
+		(y1, y2) = (yMin, y) if directionY < 0 else (y, yMax)
+		for (shiftX, shiftY) in ((directionX, 0), (0, directionY), (directionX, directionY)):
+			(sourceX, targetX) = shiftedSlices(x1, x2, shiftX, width)
+			(sourceY, targetY) = shiftedSlices(y1, y2, shiftY, height)
+			lit[targetY, targetX] |= floors[sourceY, sourceX] & walls[targetY, targetX]
+
+#The FOV engines that work straight from the tile arrays, by their FOV_ENGINE names.
+FOV_ENGINES = {"shadowcast": shadowcastFOV, "raytable": rayTableFOV}
+
+#This function recomputes the player's field of view with the engine chosen by FOV_ENGINE, and keeps the
+#result in visibility, the flag array that isInFOV reads.
+def computeFOV():
+	global visibility
+	engine = FOV_ENGINES.get(FOV_ENGINE)
+	if engine is None:
+		libtcod.map_compute_fov(fovMap, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+		visibility = visibleTiles()
+	else:
+		visibility = engine(map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS)
+
+#This function tells whether the tile (x, y) was in the player's field of view when it was last computed.
+def isInFOV(x, y):
+	if 0 <= x < map.width and 0 <= y < map.height:
+		return bool(visibility[map.index(x, y)])
+	return False
+
+#This function returns a flag array, laid out like the TileGrid's arrays, marking the tiles that are in
+#libtcod's field of view. Nothing further than TORCH_RADIUS from the player can be lit (plus one, for the walls
+#lit around the edge of the view), so only the square around the player is checked, which keeps the number
+#of calls into libtcod small.
+def visibleTiles():
+	visible = newFlagArray(map.width * map.height)
+	if TORCH_RADIUS > 0:
+		reach = TORCH_RADIUS + 1
+		x1 = max(0, player.x - reach)
+		y1 = max(0, player.y - reach)
+		x2 = min(map.width - 1, player.x + reach)
+		y2 = min(map.height - 1, player.y + reach)
+	else:
+		(x1, y1, x2, y2) = (0, 0, map.width - 1, map.height - 1)
+	
+	for y in range(y1, y2 + 1):
+		for x in range(x1, x2 + 1):
+			if libtcod.map_is_in_fov(fovMap, x, y):
+				visible[map.index(x, y)] = True
+	return visible
+
+#This function paints the background color of every map tile onto con in one batch. Tiles in view are
+#marked as explored, then each tile's shade is worked out in a single pass over the tile arrays, and the
+#colors are handed to libtcod with one console_fill_background call. Tiles out of view are only drawn
+#if the player has explored them.
+def renderMap(visible):
+	if numpyAvailable:
+		map.explored |= visible
+		shades = visible * 2 + map.blockSight
+		shades[~map.explored] = SHADE_UNEXPLORED
+		r = numpy.array([c.r for c in SHADE_COLORS], dtype = numpy.intc)[shades]
+		g = numpy.array([c.g for c in SHADE_COLORS], dtype = numpy.intc)[shades]
+		b = numpy.array([c.b for c in SHADE_COLORS], dtype = numpy.intc)[shades]
+	else:
+		explored = map.explored
+		blockSight = map.blockSight
+		shades = []
+		for i in range(len(visible)):
+			if visible[i]:
+				explored[i] = True
+				shades.append(2 + blockSight[i])
+			elif explored[i]:
+				shades.append(blockSight[i])
+			else:
+				shades.append(SHADE_UNEXPLORED)
+		r = [SHADE_COLORS[shade].r for shade in shades]
+		g = [SHADE_COLORS[shade].g for shade in shades]
+		b = [SHADE_COLORS[shade].b for shade in shades]
+	
+	libtcod.console_fill_background(con, r, g, b)
+
+#This function marks the visible tiles as explored, as renderMap does, without drawing anything.
+def exploreVisibleTiles(visible):
+	if numpyAvailable:
+		map.explored |= visible
+	else:
+		for i in range(len(visible)):
+			if visible[i]:
+				map.explored[i] = True
+
+
+#The EntityLayer class draws the objects on the map onto con all at once. It keeps the glyph and color of
+#every cell of the map in a ConsoleBuffer, and remembers what it drew in each cell, so that each frame only
+#the cells whose glyph or color changed are written to the buffer, and the buffer goes to con in one fill of
+#the foreground colors and one of the characters, however many objects there are. If nothing changed,
+#nothing is written at all.
+class EntityLayer:
+	def __init__(self, width, height):
+		self.width = width
+		self.buffer = libtcod.ConsoleBuffer(width, height, char = gSpace)
+		self.drawn = {}
+	
+	#RESET forgets what was drawn, once the console it was drawn on has been cleared.
+	def reset(self):
+		self.buffer.clear(char = gSpace)
+		self.drawn = {}
+	
+	#RENDER draws the objects that are in view, and those always visible on explored tiles, onto the
+	#console, with the player drawn over everything else.
+	def render(self, console):
+		width = self.width
+		explored = map.explored
+		cells = {}
+		colors = {}
+		for obj in [obj for obj in objects if obj is not player] + [player]:
+			i = obj.y * width + obj.x
+			if visibility[i] or (obj.alwaysVisible and explored[i]):
+				color = colors[i] = obj.color
+				cells[i] = (obj.glyph, color.r, color.g, color.b)
+		
+		buffer = self.buffer
+		changed = []
+		for i in self.drawn:
+			if i not in cells:
+				buffer.char[i] = ord(gSpace)
+				changed.append(i)
+		for (i, cell) in cells.iteritems():
+			if self.drawn.get(i) != cell:
+				(glyph, buffer.fore_r[i], buffer.fore_g[i], buffer.fore_b[i]) = cell
+				buffer.char[i] = ord(glyph)
+				changed.append(i)
+		self.drawn = cells
+		
+		#The background of each cell belongs to the map, so only the character and foreground are written, and
+		#a cell that has been emptied only needs its character.
+		if len(changed) > ENTITY_CELL_LIMIT:
+			buffer.blit(console, fill_back = False)
+		else:
+			for i in changed:
+				(y, x) = divmod(i, width)
+				cell = cells.get(i)
+				if cell is None:
+					libtcod.console_set_char(console, x, y, gSpace)
+				else:
+					libtcod.console_set_char_foreground(console, x, y, colors[i])
+					libtcod.console_set_char(console, x, y, cell[0])
+
 #This function draws the map and all objects.
 def renderAll():
 	global fovNeedsToBeRecomputed
-
+	
+	#Pass any changes to the terrain on to the FOV map first.
+	updateFOVMap()
+	
 	if fovNeedsToBeRecomputed:
 		#If this is true, then we must recalculate the field of view and render the map.
 		fovNeedsToBeRecomputed = False
-		libtcod.map_compute_fov(fovMap, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+		computeFOV()
 		
-		#Iterate through the list of map tiles and set their background colors.
-		for y in range(MAP_HEIGHT):
-			for x in range(MAP_WIDTH):
-				visible = libtcod.map_is_in_fov(fovMap, x, y)
-				wall = map[x][y].blockSight
-				if not visible:
-					#If a tile is out of the player's field of view...
-					if map[x][y].explored:
-						#...it will only be drawn if the player has explored it
-						if wall:
-							libtcod.console_set_char_background(con, x, y, cDarkWall, libtcod.BKGND_SET)
-						else:
-							libtcod.console_set_char_background(con, x, y, cDarkGround, libtcod.BKGND_SET)
-				else:
-					#If a tile is in the player's field of view...
-					if wall:
-						libtcod.console_set_char_background(con, x, y, cLitWall, libtcod.BKGND_SET)
-					else:
-						libtcod.console_set_char_background(con, x, y, cLitGround, libtcod.BKGND_SET)
-					map[x][y].explored = True
-	
-	#Draw all objects in the list, except the player, which needs to be drawn last.
-	for object in objects:
-		if object != player:
-			object.draw()
-	player.draw()
+		#Whatever comes into view is explored, which is journaled.
+		journal.changed = True
+		if renderingEnabled:
+			renderMap(visibility)
+		else:
+			exploreVisibleTiles(visibility)
+	
+	#When nothing is drawn, as in a replay, only the field of view and the explored tiles are kept up.
+	if not renderingEnabled:
+		return
+	
+	#Draw all objects in the list, with the player drawn last.
+	entityLayer.render(con)
 		
 	#Blit the contents of con to the root console.
 	libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 0)
 	
-	#Prepare to render the status panel.
-	libtcod.console_set_default_background(panel, libtcod.black)
-	libtcod.console_clear(panel)
-	
-	#Print the message log, one line at a time.
-	y = 1
-	for (line, color) in messageLog:
-		libtcod.console_set_default_foreground(panel, color)
-		libtcod.console_print_ex(panel, MESSAGE_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
-		y += 1
-	
-	#Show the player's stats
-	renderStatusBar(1, 1, BAR_WIDTH, "Health", player.fighter.cond, player.fighter.hits, libtcod.red, libtcod.darkest_red)
-	
-	libtcod.console_print_ex(panel, 1, 3, libtcod.BKGND_NONE, libtcod.LEFT, "Dungeon Level: " + str(dungeonLevel))
-	
-	#Display the names of objects under the mouse cursor.
-	libtcod.console_set_default_foreground(panel, libtcod.light_gray)
-	libtcod.console_print_ex(panel, 1, 0, libtcod.BKGND_NONE, libtcod.LEFT, getNamesUnderMouse())
-	
-	#Blit the contents of panel to the root console.
-	libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
+	#Draw the parts of the status panel that have changed, and show the panel if it needs to be.
+	statusPanel.render()
 		
 def playerDeath(player):
 	#Upon the player's death, the game ends.
@@ -790,51 +1871,117 @@ def monsterDeath(monster):
 	monster.blocks = False
 	monster.fighter = None
 	monster.ai = None
+	scheduler.remove(monster)
 	monster.name = "Remains of " + monster.name
 	monster.sendToBack()
 	
+#The ConsolePool class keeps the consoles that are no longer used, by their size, so that a console can be
+#taken from the pool instead of libtcod making a new one each time, and none are left behind unfreed.
+class ConsolePool:
+	def __init__(self):
+		self.free = {}
+	
+	#ACQUIRE returns a blank console of the given size, taken from the pool if it has one.
+	def acquire(self, width, height):
+		consoles = self.free.get((width, height))
+		if not consoles:
+			return libtcod.console_new(width, height)
+		console = consoles.pop()
+		libtcod.console_set_default_background(console, libtcod.black)
+		libtcod.console_set_default_foreground(console, libtcod.white)
+		libtcod.console_clear(console)
+		return console
+	
+	#RELEASE gives a console back to the pool, or deletes it if the pool already has enough of its size.
+	def release(self, console):
+		size = (libtcod.console_get_width(console), libtcod.console_get_height(console))
+		consoles = self.free.setdefault(size, [])
+		if len(consoles) < CONSOLE_POOL_SIZE:
+			consoles.append(console)
+		else:
+			libtcod.console_delete(console)
+
+#The MenuCache class keeps the windows of the menus shown most recently, laid out and ready to be blitted,
+#by their header, options and width. Past MENU_CACHE_SIZE menus, the console of the one shown longest ago
+#goes back to the console pool.
+class MenuCache:
+	def __init__(self, pool):
+		self.pool = pool
+		self.windows = collections.OrderedDict()
+	
+	#WINDOW returns the console of the menu with the given header, options and width, and its height, laying
+	#the menu out if it isn't in the cache.
+	def window(self, header, options, width):
+		key = (header, tuple(options), width)
+		window = self.windows.pop(key, None)
+		if window is None:
+			window = self.layOut(header, options, width)
+			while len(self.windows) >= MENU_CACHE_SIZE:
+				(oldKey, (console, height)) = self.windows.popitem(last = False)
+				self.pool.release(console)
+		self.windows[key] = window
+		return window
+	
+	#LAY OUT prints the header and options of a menu on a console from the pool, and returns the console and
+	#its height.
+	def layOut(self, header, options, width):
+		#Calculate total height for the header (after auto-wrap) and one line per option.
+		headerHeight = libtcod.console_get_height_rect(con, 0, 0, width, SCREEN_HEIGHT, header)
+		if header == "":
+			headerHeight = 0
+		height = len(options) + headerHeight
+		
+		#Take an off-screen console that represents the menu's window.
+		window = self.pool.acquire(width, height)
+		
+		#Print the header, with auto-wrap.
+		libtcod.console_set_default_foreground(window, libtcod.white)
+		libtcod.console_print_rect_ex(window, 0, 0, width, height, libtcod.BKGND_NONE, libtcod.LEFT, header)
+		
+		#Print all the options, one by one. ORD and CHR are built-in Python functions. chr(i) returns a string
+		#of one character whose ASCII code is in the integer i - for example, chr(97) returns "a". ord(c) is
+		#the opposite - given a string of length one, it returns an integer representing the Unicode code
+		#point of the character - for example, ord("a") returns 97.
+		y = headerHeight
+		letterIndex = ord("a")
+		for optionText in options:
+			text = "(" + chr(letterIndex) + ") " + optionText
+			libtcod.console_print_ex(window, 0, y, libtcod.BKGND_NONE, libtcod.LEFT, text)
+			y += 1
+			letterIndex += 1
+		return (window, height)
+
 #This function displays a window with a string (header) at the top, and a list of strings (options).
 #The height of the menu is implicit as it depends on the header height and number of options, but the
 #width is defined in the method. A letter will be shown next to each option (A, B, etc) so the user can
 #select it by pressing that key. The function returns the index of the selected option, starting with
-#zero, or None if the user pressed a different key.
-def menu(header, options, width):
+#zero, or None if the user pressed a different key. A menu shown over a background that is still being
+#loaded, such as the title screen, is drawn again over the whole background once it has arrived.
+def menu(header, options, width, background = None):
+	global screenNeedsToBeRedrawn
 	if len(options) > 26: raise ValueError("Cannot have a menu with more than twenty-six options.")
 	
-	#Calculate total height for the header (after auto-wrap) and one line per option.
-	headerHeight = libtcod.console_get_height_rect(con, 0, 0, width, SCREEN_HEIGHT, header)
-	if header == "":
-		headerHeight = 0
-	height = len(options) + headerHeight
-	
-	#Create an off-screen console that represents the menu's window.
-	window = libtcod.console_new(width, height)
-	
-	#Print the header, with auto-wrap.
-	libtcod.console_set_default_foreground(window, libtcod.white)
-	libtcod.console_print_rect_ex(window, 0, 0, width, height, libtcod.BKGND_NONE, libtcod.LEFT, header)
-	
-	#Print all the options, one by one. ORD and CHR are built-in Python functions. chr(i) returns a string
-	#of one character whose ASCII code is in the integer i - for example, chr(97) returns "a". ord(c) is
-	#the opposite - given a string of length one, it returns an integer representing the Unicode code
-	#point of the character - for example, ord("a") returns 97.
-	y = headerHeight
-	letterIndex = ord("a")
-	for optionText in options:
-		text = "(" + chr(letterIndex) + ") " + optionText
-		libtcod.console_print_ex(window, 0, y, libtcod.BKGND_NONE, libtcod.LEFT, text)
-		y += 1
-		letterIndex += 1
-		
-	#Blit the contents of window to the root console. The last two parameters passed to console_blit
-	#define the foreground and background transparency, respectively.
+	#The menu's window, laid out the first time the menu is shown.
+	(window, height) = menuCache.window(header, options, width)
 	x = SCREEN_WIDTH / 2 - width / 2
 	y = SCREEN_HEIGHT / 2 - height / 2
-	libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
 	
-	#Present the root console to the player and wait for a keypress.
-	libtcod.console_flush()
-	key = libtcod.console_wait_for_keypress(True)
+	key = None
+	while key is None:
+		#Blit the contents of window to the root console. The last two parameters passed to console_blit
+		#define the foreground and background transparency, respectively.
+		libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
+		
+		#Present the root console to the player and wait for a keypress.
+		if renderingEnabled:
+			libtcod.console_flush()
+		key = waitForKeypress(background and background.loading())
+		if key is None:
+			background.render()
+	
+	#The menu is left on the screen, so the screen must be drawn again.
+	screenNeedsToBeRedrawn = True
+	statusPanel.invalidate()
 	if key.vk == libtcod.KEY_ENTER and key.lalt:
 		#Alt-Enter toggles fullscreen.
 		libtcod.console_set_fullscreen(not libtcod.console_is_fullscreen())
@@ -881,7 +2028,7 @@ def closestMonster(maxRange):
 	closestDistance = maxRange + 1
 	
 	for object in objects:
-		if object.fighter and not object == player and libtcod.map_is_in_fov(fovMap, object.x, object.y):
+		if object.fighter and not object == player and isInFOV(object.x, object.y):
 			distance = player.distanceTo(object)
 			if distance < closestDistance:
 				closestEnemy = object
@@ -917,13 +2064,12 @@ def castConfuse():
 def targetTile(maxRange = None):
 	global key, mouse
 	while True:
-		libtcod.console_flush()
-		libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
-		renderAll()
+		refreshScreen()
+		nextEvent()
 		
 		(x, y) = (mouse.cx, mouse.cy)
 		
-		if (mouse.lbutton_pressed and libtcod.map_is_in_fov(fovMap, x, y) 
+		if (mouse.lbutton_pressed and isInFOV(x, y) 
 			and (maxRange is None or player.distance(x,y) <= maxRange)):
 			return (x, y)
 		
@@ -957,12 +2103,14 @@ def targetMonster(maxRange = None):
 			return None
 		
 		#Return the first-clicked monster, otherwise continue looping.
-		for obj in objects:
-			if obj.x == x and obj.y == y and obj.fighter and obj != player:
+		for obj in occupancy.fightersAt(x, y):
+			if obj != player:
 				return obj
 
-def startNewGame():
-	global player, inventory, messageLog, gameState, dungeonLevel
+#This function starts a new game, which is saved to the given slot. A game started with a given seed plays
+#out the same way every time.
+def startNewGame(seed = None, slot = 0):
+	global player, inventory, messageLog, gameState, gameSeed, saveGeneration, saveSlot, turnCount
 	
 	#Create an object representing the player.
 	fighterComponent = Fighter(hp = 100, atk = 4, dfn = 1, xp = 0, deathEffect = playerDeath)
@@ -970,139 +2118,1671 @@ def startNewGame():
 	
 	player.level = 1
 	
+	#Every level of the dungeon, and every random stream, is seeded from the game's seed.
+	if seed is None:
+		seed = libtcod.random_get_int(0, 0, 0x7FFFFFFF)
+	gameSeed = seed
+	seedRandomStreams()
+	
+	#The journals and the level archive of the game saved in the slot before don't belong to this one. A
+	#replay saves nothing, so it leaves them alone, and keeps the levels it leaves in a temporary archive.
+	saveSlot = slot
+	saveGeneration = 0
+	turnCount = 0
+	forgetLevels()
+	if inputReplay is None:
+		removeJournals(slot)
+		archive.open(levelArchivePath(slot), reset = True)
+	else:
+		(handle, path) = tempfile.mkstemp(".lvl")
+		os.close(handle)
+		archive.open(path, reset = True, temporary = True)
+	
 	#Generate dungeon and FOV maps, although at this point it is not drawn to the screen.
-	dungeonLevel = 1
-	makeMap()
-	initializeFOV()
+	enterLevel(generateLevel(1, levelSeed(1)))
 	
 	#Set up the game state and instantiate the player's inventory.
 	gameState = "playing"
 	inventory = []
 	
 	#Create the list of game messages and their colors, which begins empty.
-	messageLog = []
+	messageLog = MessageLog()
 	message("Welcome, adventurer.", libtcod.red)
 	
+#This function sets up the field of view for the current level. Its FOV map and flow field are made the
+#first time the level is entered, and are used again when it is entered again from the level cache.
 def initializeFOV():
-	global fovNeedsToBeRecomputed, fovMap
+	global fovNeedsToBeRecomputed, fovMap, flowField, visibility
 	fovNeedsToBeRecomputed = True
 	
+	#Nothing is visible until the field of view is first computed.
+	visibility = newFlagArray(map.width * map.height)
+	
 	#Unexplored areas start black, which is the default background color.
 	libtcod.console_clear(con)
+	entityLayer.reset()
+	
+	if currentLevel.fovMap is None:
+		currentLevel.fovMap = libtcod.NativeHandle(libtcod.map_new(map.width, map.height), libtcod.map_delete)
+		buildFOVMap(currentLevel.fovMap.handle, map)
+		currentLevel.flowField = FlowField()
+	fovMap = currentLevel.fovMap.handle
+	flowField = currentLevel.flowField
+
+#This function fills an FOV map from a TileGrid in bulk. A single call clears the whole FOV map to solid
+#wall, and then only the cells that can be walked on or seen through are set, which on a dungeon level is a
+#small part of the map. Any terrain changes the grid was holding for updateFOVMap are now included.
+def buildFOVMap(fovMap, grid):
+	libtcod.map_clear(fovMap, False, False)
+	for i in grid.openCells():
+		(y, x) = divmod(i, grid.width)
+		libtcod.map_set_properties(fovMap, x, y, not grid.blockSight[i], not grid.blocked[i])
+	grid.changed.clear()
+
+#This function passes the terrain changes made with setTerrain since the FOV map was built on to it, cell
+#by cell, and has the field of view recomputed if anything changed.
+def updateFOVMap():
+	global fovNeedsToBeRecomputed
+	if not map.changed:
+		return
+	
+	for i in map.changed:
+		(y, x) = divmod(i, map.width)
+		libtcod.map_set_properties(fovMap, x, y, not map.blockSight[i], not map.blocked[i])
+	map.changed.clear()
+	fovNeedsToBeRecomputed = True
+	flowField.invalidate()
+
+#########################################################################################################
+#Input recording and replay. The game reads its input only through checkForEvent and waitForKeypress, so
+#that a game's input can be recorded as it is played, and played back later, with the same seed, to play the
+#game out exactly the same way. Only key presses and mouse clicks are recorded, since moving the mouse
+#changes nothing but what is shown. A recording is a header with the game's seed, followed by one
+#INPUT_RECORD for each event: a key press is its key code, character and modifier keys, and a mouse click is
+#the cell clicked and the buttons.
+RECORDING_MAGIC = "TMRC"
+RECORDING_VERSION = 1
+INPUT_RECORD = struct.Struct("<BBBB")
+
+#The kinds of input event in a recording.
+INPUT_KEY = 1
+INPUT_MOUSE = 2
+
+#This function reads the next input event into the key and mouse globals, from libtcod, or from the
+#recording being replayed, and records it if the game is being recorded. It doesn't wait for one.
+def checkForEvent():
+	if inputReplay is not None:
+		inputReplay.nextEvent(key, mouse)
+		return
+	libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
+	recorder.recordEvent(key, mouse)
+
+#This function reads the next input event, as checkForEvent does. In the event-driven loop, it sleeps until
+#there is one. Any key press or click, or a move of the mouse to another cell, means the screen must be
+#drawn again.
+def nextEvent():
+	global screenNeedsToBeRedrawn
+	
+	if not EVENT_DRIVEN_LOOP or inputReplay is not None:
+		checkForEvent()
+	else:
+		mask = libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE
+		if saver.isBusy():
+			while not libtcod.sys_check_for_event(mask, key, mouse) and saver.isBusy():
+				saver.thread.join(POLL_INTERVAL)
+		else:
+			libtcod.sys_wait_for_event(mask, key, mouse, False)
+		recorder.recordEvent(key, mouse)
+	
+	if key.vk != libtcod.KEY_NONE or mouse.dcx or mouse.dcy or mouse.lbutton_pressed or mouse.rbutton_pressed:
+		screenNeedsToBeRedrawn = True
+
+#This function draws the screen and presents it, if anything on it has changed since it was last drawn, or
+#every time outside the event-driven loop. A replay draws nothing, but keeps its field of view up to date
+#every time.
+def refreshScreen():
+	global screenNeedsToBeRedrawn
+	
+	if (screenNeedsToBeRedrawn or fovNeedsToBeRecomputed or map.changed or not EVENT_DRIVEN_LOOP or
+		not renderingEnabled):
+		renderAll()
+		if renderingEnabled:
+			libtcod.console_flush()
+		screenNeedsToBeRedrawn = False
+
+#This function waits for a key press, and returns it. While the given thread is running, it checks for
+#a key press every POLL_INTERVAL seconds instead, and returns None if the thread finishes first.
+def waitForKeypress(pending = None):
+	if inputReplay is not None:
+		pressed = libtcod.Key()
+		inputReplay.nextKey(pressed)
+		return pressed
+	if pending is not None:
+		while pending.is_alive():
+			pressed = libtcod.console_check_for_keypress(libtcod.KEY_PRESSED)
+			if pressed.vk != libtcod.KEY_NONE:
+				recorder.recordEvent(pressed, None)
+				return pressed
+			pending.join(POLL_INTERVAL)
+		return None
+	pressed = libtcod.console_wait_for_keypress(True)
+	recorder.recordEvent(pressed, None)
+	return pressed
+
+#This function packs the modifier keys of a key press into one byte.
+def keyModifiers(pressed):
+	return pressed.lalt | pressed.lctrl << 1 | pressed.ralt << 2 | pressed.rctrl << 3 | pressed.shift << 4
+
+#The InputRecorder class writes the input of the game being played to a recording.
+class InputRecorder:
+	def __init__(self):
+		self.file = None
+	
+	#START begins a recording of a game started with the given seed.
+	def start(self, path, seed):
+		self.stop()
+		self.file = open(path, "wb")
+		self.file.write(struct.pack("<4sHI", RECORDING_MAGIC, RECORDING_VERSION, seed))
+	
+	#RECORD EVENT records a key press or a mouse click, if there is one. Each one is handed to the operating
+	#system at once, so that a recording survives a crash of the game.
+	def recordEvent(self, pressed, clicked):
+		if self.file is None:
+			return
+		if pressed.vk != libtcod.KEY_NONE:
+			self.file.write(INPUT_RECORD.pack(INPUT_KEY, pressed.vk, pressed.c, keyModifiers(pressed)))
+		elif clicked is not None and (clicked.lbutton_pressed or clicked.rbutton_pressed):
+			buttons = clicked.lbutton_pressed | clicked.rbutton_pressed << 1
+			self.file.write(INPUT_RECORD.pack(INPUT_MOUSE, clicked.cx, clicked.cy, buttons))
+		else:
+			return
+		self.file.flush()
 	
-	#Create the FOV map, according to the generated dungeon map.
-	fovMap = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-	for y in range(MAP_HEIGHT):
-		for x in range(MAP_WIDTH):
-			libtcod.map_set_properties(fovMap, x, y, not map[x][y].blockSight, not map[x][y].blocked)
+	#STOP ends the recording.
+	def stop(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+#The EndOfRecording exception is raised when the game asks for more input than the recording holds.
+class EndOfRecording(Exception):
+	pass
+
+#The InputReplay class plays back a recording, one event at a time.
+class InputReplay:
+	#INIT reads the whole recording.
+	def __init__(self, path):
+		file = open(path, "rb")
+		try:
+			data = file.read()
+		finally:
+			file.close()
+		reader = SaveReader(data)
+		(magic, version, self.seed) = reader.unpack("<4sHI")
+		if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+			raise ValueError("This is not a recording this version of the game can play.")
+		self.events = [INPUT_RECORD.unpack_from(data, offset)
+			for offset in range(reader.offset, len(data) - INPUT_RECORD.size + 1, INPUT_RECORD.size)]
+		self.position = 0
+	
+	#NEXT EVENT fills in the key and mouse with the next event of the recording.
+	def nextEvent(self, pressed, clicked):
+		if self.position >= len(self.events):
+			raise EndOfRecording()
+		(kind, a, b, c) = self.events[self.position]
+		self.position += 1
+		
+		(pressed.vk, pressed.c, pressed.pressed) = (libtcod.KEY_NONE, 0, False)
+		(pressed.lalt, pressed.lctrl, pressed.ralt, pressed.rctrl, pressed.shift) = (False,) * 5
+		(clicked.lbutton_pressed, clicked.rbutton_pressed) = (False, False)
+		if kind == INPUT_KEY:
+			(pressed.vk, pressed.c, pressed.pressed) = (a, b, True)
+			(pressed.lalt, pressed.lctrl, pressed.ralt, pressed.rctrl, pressed.shift) = [
+				bool(c & (1 << bit)) for bit in range(5)]
+		else:
+			(clicked.cx, clicked.cy) = (a, b)
+			(clicked.lbutton_pressed, clicked.rbutton_pressed) = (bool(c & 1), bool(c & 2))
+	
+	#NEXT KEY fills in the key with the next key press of the recording. Mouse clicks are passed over, as
+	#they are when the game waits for a key.
+	def nextKey(self, pressed):
+		clicked = libtcod.Mouse()
+		self.nextEvent(pressed, clicked)
+		while pressed.vk == libtcod.KEY_NONE:
+			self.nextEvent(pressed, clicked)
+
+#This function plays back a recording, without drawing anything, as fast as it will go, and returns the
+#number of input events it played. The game is left as it was at the end of the recording.
+def replayRecording(path):
+	global inputReplay, renderingEnabled
+	
+	inputReplay = InputReplay(path)
+	renderingEnabled = False
+	try:
+		startNewGame(inputReplay.seed)
+		playGame()
+	except EndOfRecording:
+		pass
+	finally:
+		(events, inputReplay, renderingEnabled) = (inputReplay.position, None, True)
+		archive.close()
+	return events
 
 def playGame():
-	global key, mouse
+	global key, mouse, turnCount
 	
 	playerAction = None
 	
 	mouse = libtcod.Mouse()
 	key = libtcod.Key()
+	
+	#Every turn is journaled, starting from a full save of the game as it is now. A replay isn't saved.
+	if inputReplay is None:
+		journal.start()
 	while not libtcod.console_is_window_closed():
-		#Render the screen.
-		libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS | libtcod.EVENT_MOUSE, key, mouse)
-		renderAll()
-		
-		libtcod.console_flush()
+		#Render the screen, if it has changed, and wait for the player.
+		refreshScreen()
+		nextEvent()
 		checkLevelup()
 		
-		#Erase all objects at their old locations, before they move.
-		for object in objects:
-			object.clear()
-			
+		#Tell about any save that has finished in the background.
+		saver.poll()
+		
 		#Handle keys and exit the game if needed.
 		playerAction = handleKeys()
 		if playerAction == "exit":
-			saveGame()
+			if inputReplay is None:
+				journal.stop()
+				saveGame()
 			break
 		
-		#Let monsters take their turn.
+		#Let the monsters whose actions fall due during the player's action take their turns.
 		if gameState == "playing" and playerAction != "no turn taken":
-			for object in objects:
-				if object.ai:
-					object.ai.takeTurn()
-					
-def mainMenu():
-	img = libtcod.image_load("menu_background1.png")
+			scheduler.advance(actionDelay(player))
+			turnCount += 1
+			journal.changed = True
+		
+		#Whatever changed is journaled, even without a turn taken, since picking up or using an item changes
+		#the game too. Input that changed nothing, such as the mouse moving, isn't journaled at all.
+		journal.endTurn(playerAction != "no turn taken")
+
+#The TitleScreen class draws the title screen, with the background picture, the game's title and the credits,
+#once on an off-screen console, which is then blitted to the screen whenever the title screen is shown. The
+#picture is loaded on a background thread, so that the title and the main menu can be shown at once, on
+#black, and the title screen is drawn again with the picture when it has arrived.
+class TitleScreen:
+	def __init__(self, path):
+		self.path = path
+		self.image = None
+		self.loader = None
+		self.console = None
+		self.hasImage = False
+	
+	#LOAD begins loading the picture in the background, unless it has been loaded or is being loaded.
+	def load(self):
+		if self.loader is None:
+			self.loader = threading.Thread(target = self.run)
+			self.loader.start()
+	
+	#RUN is the body of the background thread. The picture is owned by a NativeHandle, which deletes it when
+	#the title screen is done with.
+	def run(self):
+		self.image = libtcod.NativeHandle(libtcod.image_load(self.path), libtcod.image_delete)
+	
+	#LOADING returns the thread loading the picture while it is still running, or else None.
+	def loading(self):
+		if self.loader is not None and self.loader.is_alive():
+			return self.loader
+		return None
 	
-	while not libtcod.console_is_window_closed():
+	#RENDER blits the title screen to the root console, drawing it first if it hasn't been drawn yet, or was
+	#drawn before the picture arrived.
+	def render(self):
+		if self.console is None:
+			self.console = consolePool.acquire(SCREEN_WIDTH, SCREEN_HEIGHT)
+			self.draw()
+		elif self.image is not None and not self.hasImage:
+			self.draw()
+		libtcod.console_blit(self.console, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, 0, 0)
+	
+	#DRAW draws the title screen on its console, with the picture if it has been loaded.
+	def draw(self):
+		console = self.console
+		libtcod.console_set_default_foreground(console, libtcod.white)
+		libtcod.console_clear(console)
+		
 		#Show the background image, at twice the regular console resolution.
-		libtcod.image_blit_2x(img, 0, 0, 0)
+		image = self.image
+		if image is not None:
+			libtcod.image_blit_2x(image.handle, console, 0, 0)
+		self.hasImage = image is not None
 		
 		#Show the game's title.
-		libtcod.console_set_default_foreground(0, libtcod.light_yellow)
-		libtcod.console_print_ex(0, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 6, libtcod.BKGND_NONE,
+		libtcod.console_set_default_foreground(console, libtcod.light_yellow)
+		libtcod.console_print_ex(console, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 6, libtcod.BKGND_NONE,
 			libtcod.CENTER, "FORCASTIA TALES: THE MARKED")
-		libtcod.console_print_ex(0, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 4, libtcod.BKGND_NONE,
+		libtcod.console_print_ex(console, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 4, libtcod.BKGND_NONE,
 			libtcod.CENTER, "2014 Studio Draconis")
-		
-		#Show options and wait for the player's choice.
-		choice = menu('', ["Start a New Adventure", "Continue a Previous Adventure", "Quit"], 40)
+
+def mainMenu():
+	titleScreen.load()
+	
+	while not libtcod.console_is_window_closed():
+		#Show the title screen, and the options over it, and wait for the player's choice.
+		titleScreen.render()
+		choice = menu('', ["Start a New Adventure", "Continue a Previous Adventure", "Quit"], 40, titleScreen)
 		
 		if choice == 0: #NEW GAME
-			startNewGame()
+			slot = saveSlotMenu("Choose where to save the new adventure. Any adventure saved there is lost.\n")
+			if slot is None:
+				continue
+			startNewGame(slot = slot)
+			if RECORD_INPUT:
+				recorder.start(RECORDING_FILE, gameSeed)
 			playGame()
+			recorder.stop()
 		if choice == 1: #LOAD GAME
-			try:
-				loadGame()
-			except:
+			slots = listSaveSlots()
+			if not any(slots):
 				announce("\n No saved game to load. \n", 24)
 				continue
+			slot = saveSlotMenu("Choose the adventure to continue.\n", slots)
+			if slot is None:
+				continue
+			if slots[slot] is None:
+				announce("\n There is no adventure saved there. \n", 40)
+				continue
+			try:
+				loadGame(slot)
+			except Exception:
+				announce("\n This saved game could not be loaded. \n", 42)
+				continue
 			playGame()
 		elif choice == 2: #QUIT
 			break
 
-#This function saves the game by opening a new, empty Shelve - overwriting an old one if necessary -
-#and writing the game data to it.			
+#Save files are written in a compact binary format, made of a small header followed by sections for the
+#game's state, the map, the objects with their components, and the message log and its history. Map flags
+#are packed eight to a byte, and objects are packed into fixed records with struct, so saving and loading
+#take a few milliseconds and the files are a few kilobytes, plus the message history. SAVE_VERSION must be
+#raised whenever the format changes; version 1 stored the components in separate tables, and objects had
+#no ids, version 2 didn't count turns, version 3 had no stairs up, and version 4 had no message history.
+#Each of the SAVE_SLOTS save slots has a save file of its own.
+SAVE_SLOTS = 3
+SAVE_MAGIC = "TMSV"
+SAVE_VERSION = 5
+
+#Games saved before the binary format are shelves, stored under this name.
+LEGACY_SAVE_FILE = "savegame"
+
+#Functions and AI classes can't be stored in a save file, so they are stored by name, and only the ones
+#listed here can be named.
+SAVED_FUNCTIONS = dict((function.__name__, function) for function in
+	[playerDeath, monsterDeath, castHeal, castLightning, castFireball, castConfuse])
+SAVED_AI_CLASSES = dict((aiClass.__name__, aiClass) for aiClass in [BasicMonster, ConfusedMonster])
+
+#Bits of the flags byte in an object's record. The last four tell which components follow the record.
+OBJECT_BLOCKS = 1
+OBJECT_ALWAYS_VISIBLE = 2
+OBJECT_FIGHTER = 4
+OBJECT_AI = 8
+OBJECT_ITEM = 16
+OBJECT_EQUIPMENT = 32
+
+#The record of an object's fixed fields: id, position, color, flags and speed.
+OBJECT_RECORD = struct.Struct("<IhhBBBBH")
+#The record of a fighter component: hits, condition, attack, defense and experience.
+FIGHTER_RECORD = struct.Struct("<hhhhi")
+#The state of the game: dungeon level, game seed, save generation, the player's and the stairs' ids, the
+#player's level, the number of turns played, and the id of the stairs up, which is 0 on the first level.
+GAME_RECORD = struct.Struct("<HIIIIHII")
+
+#Version 1 records: the game without ids, an object without an id or component flags, and a fighter with
+#its object's number. Version 2 records: the game without the number of turns. Version 3 records: the game
+#without the stairs up.
+GAME_RECORD_V1 = struct.Struct("<HIIIH")
+OBJECT_RECORD_V1 = struct.Struct("<hhBBBBH")
+FIGHTER_RECORD_V1 = struct.Struct("<Ihhhhi")
+GAME_RECORD_V2 = struct.Struct("<HIIIIH")
+GAME_RECORD_V3 = struct.Struct("<HIIIIHI")
+
+#This function packs a sequence of flags into a string of bytes, eight to a byte, first flag in the
+#highest bit.
+def packFlags(flags):
+	if numpyAvailable:
+		return numpy.packbits(numpy.asarray(flags, dtype = numpy.bool_)).tostring()
+	packed = bytearray((len(flags) + 7) / 8)
+	for i in range(len(flags)):
+		if flags[i]:
+			packed[i >> 3] |= 0x80 >> (i & 7)
+	return str(packed)
+
+#This function unpacks count flags from a string of bytes made by packFlags, into a flag array.
+def unpackFlags(packed, count):
+	if numpyAvailable:
+		return numpy.unpackbits(numpy.frombuffer(packed, dtype = numpy.uint8))[:count].astype(numpy.bool_)
+	packed = bytearray(packed)
+	return array.array("B", [(packed[i >> 3] >> (7 - (i & 7))) & 1 for i in range(count)])
+
+#The SaveWriter class builds up the contents of a save file.
+class SaveWriter:
+	def __init__(self):
+		self.parts = []
+	
+	#PACK adds values packed in the given struct format, or with the given Struct.
+	def pack(self, format, *values):
+		if isinstance(format, struct.Struct):
+			self.parts.append(format.pack(*values))
+		else:
+			self.parts.append(struct.pack(format, *values))
+	
+	#STRING adds a string, preceded by its length.
+	def string(self, text):
+		if isinstance(text, unicode):
+			text = text.encode("utf-8")
+		self.pack("<H", len(text))
+		self.parts.append(text)
+	
+	#FLAGS adds a flag array, packed eight flags to a byte.
+	def flags(self, flags):
+		self.parts.append(packFlags(flags))
+	
+	#GET DATA returns everything written so far.
+	def getData(self):
+		return "".join(self.parts)
+
+#The SaveReader class reads back the contents of a save file, in the order SaveWriter wrote them.
+class SaveReader:
+	def __init__(self, data, offset = 0):
+		self.data = data
+		self.offset = offset
+	
+	#READ returns the next size bytes.
+	def read(self, size):
+		if self.offset + size > len(self.data):
+			raise ValueError("The save file is truncated.")
+		chunk = self.data[self.offset:self.offset + size]
+		self.offset += size
+		return chunk
+	
+	#UNPACK reads values packed in the given struct format, or with the given Struct.
+	def unpack(self, format):
+		if not isinstance(format, struct.Struct):
+			format = struct.Struct(format)
+		return format.unpack(self.read(format.size))
+	
+	#STRING reads a string written by SaveWriter.string.
+	def string(self):
+		(length,) = self.unpack("<H")
+		return self.read(length)
+	
+	#FLAGS reads a flag array of the given length.
+	def flags(self, count):
+		return unpackFlags(self.read((count + 7) / 8), count)
+	
+	#AT END tells whether everything has been read.
+	def atEnd(self):
+		return self.offset >= len(self.data)
+
+#This function writes an AI component, along with the AI a confused monster will return to.
+def writeAI(writer, ai):
+	if ai is None:
+		writer.string("")
+		return
+	writer.string(ai.__class__.__name__)
+	if isinstance(ai, ConfusedMonster):
+		writer.pack("<h", ai.numberOfTurns)
+		writeAI(writer, ai.oldAI)
+
+#This function reads an AI component written by writeAI.
+def readAI(reader):
+	name = reader.string()
+	if not name:
+		return None
+	aiClass = SAVED_AI_CLASSES[name]
+	if aiClass is ConfusedMonster:
+		(numberOfTurns,) = reader.unpack("<h")
+		ai = ConfusedMonster(None, numberOfTurns)
+		ai.oldAI = readAI(reader)
+		return ai
+	return aiClass()
+
+#This function returns the name a function is saved under.
+def functionName(function):
+	if function is None:
+		return ""
+	if SAVED_FUNCTIONS.get(function.__name__) is not function:
+		raise ValueError("The function " + function.__name__ + " can't be saved.")
+	return function.__name__
+
+#This function writes an object: its record, its glyph and name, and then each component it has.
+def writeObject(writer, obj):
+	flags = ((OBJECT_BLOCKS if obj.blocks else 0) | (OBJECT_ALWAYS_VISIBLE if obj.alwaysVisible else 0) |
+		(OBJECT_FIGHTER if obj.fighter else 0) | (OBJECT_AI if obj.ai else 0) |
+		(OBJECT_ITEM if obj.item and not obj.equipment else 0) | (OBJECT_EQUIPMENT if obj.equipment else 0))
+	writer.pack(OBJECT_RECORD, obj.uid, obj.x, obj.y, obj.color.r, obj.color.g, obj.color.b, flags, obj.speed)
+	writer.string(obj.glyph)
+	writer.string(obj.name)
+	
+	if obj.fighter:
+		fighter = obj.fighter
+		writer.pack(FIGHTER_RECORD, fighter.hits, fighter.cond, fighter.atk, fighter.dfn, fighter.xp)
+		writer.string(functionName(fighter.deathEffect))
+	if obj.ai:
+		writeAI(writer, obj.ai)
+	if obj.item and not obj.equipment:
+		writer.string(functionName(obj.item.useEffect))
+	if obj.equipment:
+		writer.pack("<B", obj.equipment.isWorn)
+		writer.string(obj.equipment.slot)
+
+#This function reads an object written by writeObject, and builds it.
+def readObject(reader):
+	(uid, x, y, r, g, b, flags, speed) = reader.unpack(OBJECT_RECORD)
+	glyph = reader.string()
+	name = reader.string()
+	
+	(fighter, ai, item, equipment) = (None, None, None, None)
+	if flags & OBJECT_FIGHTER:
+		(hits, cond, atk, dfn, xp) = reader.unpack(FIGHTER_RECORD)
+		fighter = Fighter(hits, atk, dfn, xp, SAVED_FUNCTIONS.get(reader.string()))
+		fighter.cond = cond
+	if flags & OBJECT_AI:
+		ai = readAI(reader)
+	if flags & OBJECT_ITEM:
+		item = Item(useEffect = SAVED_FUNCTIONS.get(reader.string()))
+	if flags & OBJECT_EQUIPMENT:
+		(isWorn,) = reader.unpack("<B")
+		equipment = Equipment(reader.string())
+		equipment.isWorn = bool(isWorn)
+	
+	obj = Object(x, y, glyph, name, libtcod.Color(r, g, b), blocks = bool(flags & OBJECT_BLOCKS),
+		alwaysVisible = bool(flags & OBJECT_ALWAYS_VISIBLE), fighter = fighter, ai = ai, item = item,
+		equipment = equipment, speed = speed)
+	obj.uid = uid
+	
+	#A confused monster's old AI goes back to the monster when the confusion wears off.
+	while isinstance(ai, ConfusedMonster) and ai.oldAI is not None:
+		ai.oldAI.owner = obj
+		ai = ai.oldAI
+	return obj
+
+#This function reads the objects of a version 1 save, which kept each kind of component in its own table.
+def readObjectTablesV1(reader, count):
+	records = []
+	for i in range(count):
+		record = reader.unpack(OBJECT_RECORD_V1)
+		records.append(record + (reader.string(), reader.string()))
+	
+	fighters = {}
+	for i in range(reader.unpack("<I")[0]):
+		(number, hits, cond, atk, dfn, xp) = reader.unpack(FIGHTER_RECORD_V1)
+		fighters[number] = Fighter(hits, atk, dfn, xp, SAVED_FUNCTIONS.get(reader.string()))
+		fighters[number].cond = cond
+	ais = {}
+	for i in range(reader.unpack("<I")[0]):
+		(number,) = reader.unpack("<I")
+		ais[number] = readAI(reader)
+	items = {}
+	for i in range(reader.unpack("<I")[0]):
+		(number,) = reader.unpack("<I")
+		items[number] = Item(useEffect = SAVED_FUNCTIONS.get(reader.string()))
+	equipment = {}
+	for i in range(reader.unpack("<I")[0]):
+		(number, isWorn) = reader.unpack("<IB")
+		equipment[number] = Equipment(reader.string())
+		equipment[number].isWorn = bool(isWorn)
+	
+	everything = []
+	for (number, (x, y, r, g, b, flags, speed, glyph, name)) in enumerate(records):
+		obj = Object(x, y, glyph, name, libtcod.Color(r, g, b), blocks = bool(flags & OBJECT_BLOCKS),
+			alwaysVisible = bool(flags & OBJECT_ALWAYS_VISIBLE), fighter = fighters.get(number),
+			ai = ais.get(number), item = items.get(number), equipment = equipment.get(number), speed = speed)
+		ai = obj.ai
+		while isinstance(ai, ConfusedMonster) and ai.oldAI is not None:
+			ai.oldAI.owner = obj
+			ai = ai.oldAI
+		everything.append(obj)
+	return everything
+
+#This function makes sure the ids given to new objects from now on aren't already taken by the given ones,
+#nor by any up to lastUid.
+def continueObjectIds(everything, lastUid = 0):
+	global objectIds
+	objectIds = itertools.count(max([obj.uid for obj in everything] + [next(objectIds), lastUid]) + 1)
+
+#This function writes the message log.
+def writeMessages(writer, log):
+	writer.pack("<I", len(log))
+	for (line, color) in log:
+		writer.pack("<BBB", color.r, color.g, color.b)
+		writer.string(line)
+
+#This function reads the lines of a message log written by writeMessages.
+def readMessages(reader):
+	lines = []
+	for i in range(reader.unpack("<I")[0]):
+		(r, g, b) = reader.unpack("<BBB")
+		lines.append((reader.string(), libtcod.Color(r, g, b)))
+	return lines
+
+#This function writes messages of a message log's history, after the number of messages ever added to it.
+#There can be thousands, so their lengths, colors and counts are each packed at once, and the texts follow.
+def writeHistory(writer, added, entries):
+	(texts, colors, counts) = zip(*entries) or ((), (), ())
+	data = "".join(texts)
+	if isinstance(data, unicode):
+		texts = [text.encode("utf-8") for text in texts]
+		data = "".join(texts)
+	writer.pack("<II", added, len(texts))
+	writer.pack("<%dH" % len(texts), *[len(text) for text in texts])
+	writer.pack("<%dI" % len(texts), *colors)
+	writer.pack("<%dI" % len(texts), *counts)
+	writer.parts.append(data)
+
+#This function reads messages written by writeHistory, and returns the number of messages ever added and the
+#messages.
+def readHistory(reader):
+	(added, count) = reader.unpack("<II")
+	lengths = reader.unpack("<%dH" % count)
+	colors = reader.unpack("<%dI" % count)
+	counts = reader.unpack("<%dI" % count)
+	texts = reader.read(sum(lengths))
+	entries = []
+	offset = 0
+	for (length, packed, n) in zip(lengths, colors, counts):
+		entries.append([texts[offset:offset + length], packed, n])
+		offset += length
+	return (added, entries)
+
+#This function encodes the whole game, as it stands, into the contents of a save file.
+def encodeGame():
+	writer = SaveWriter()
+	writer.pack("<4sH", SAVE_MAGIC, SAVE_VERSION)
+	
+	writer.pack(GAME_RECORD, dungeonLevel, gameSeed, saveGeneration, player.uid, stairsDown.uid, player.level,
+		turnCount, stairsUp.uid if stairsUp else 0)
+	writer.string(gameState)
+	
+	writer.pack("<HH", map.width, map.height)
+	writer.flags(map.blocked)
+	writer.flags(map.blockSight)
+	writer.flags(map.explored)
+	
+	#The objects on the level come first, and then the inventory.
+	writer.pack("<II", len(objects), len(inventory))
+	for obj in objects + inventory:
+		writeObject(writer, obj)
+	
+	writeMessages(writer, messageLog)
+	writeHistory(writer, messageLog.added, messageLog.history)
+	return writer.getData()
+
+#This function decodes the contents of a save file made by encodeGame, rebuilding the live objects, and
+#makes it the current game.
+def decodeGame(data):
+	global map, objects, player, inventory, messageLog, gameState, stairsDown, stairsUp, dungeonLevel, gameSeed
+	global saveGeneration, turnCount
+	
+	reader = SaveReader(data)
+	record = readGameRecord(reader)
+	(version, depth, seed, generation, playerId, stairsId, playerLevel, turns, stairsUpId) = record
+	state = reader.string()
+	
+	(width, height) = reader.unpack("<HH")
+	grid = TileGrid(width, height)
+	grid.blocked = reader.flags(width * height)
+	grid.blockSight = reader.flags(width * height)
+	grid.explored = reader.flags(width * height)
+	
+	(objectCount, inventoryCount) = reader.unpack("<II")
+	if version == 1:
+		everything = readObjectTablesV1(reader, objectCount + inventoryCount)
+		(playerId, stairsId) = (everything[playerId].uid, everything[stairsId].uid)
+	else:
+		everything = [readObject(reader) for i in range(objectCount + inventoryCount)]
+	lines = readMessages(reader)
+	if version >= 5:
+		(added, history) = readHistory(reader)
+		log = MessageLog(lines, history, added)
+	else:
+		log = MessageLog(lines)
+	
+	#Every part was read without trouble, so the game can now be replaced with the saved one.
+	byId = dict((obj.uid, obj) for obj in everything)
+	map = grid
+	objects = everything[:objectCount]
+	inventory = everything[objectCount:]
+	player = byId[playerId]
+	player.level = playerLevel
+	stairsDown = byId[stairsId]
+	stairsUp = byId.get(stairsUpId)
+	messageLog = log
+	gameState = state
+	dungeonLevel = depth
+	gameSeed = seed
+	saveGeneration = generation
+	turnCount = turns
+	continueObjectIds(everything)
+
+#This function reads the header of a save file and the record of the game's state that follows it, in
+#whichever version it was saved. It returns the version, the dungeon level, the game seed, the save
+#generation, the player's and the stairs' ids, the player's level, the number of turns and the id of the
+#stairs up, or 0. In version 1 saves, the ids are the player's and the stairs' numbers in the list of objects.
+def readGameRecord(reader):
+	(magic, version) = reader.unpack("<4sH")
+	if magic != SAVE_MAGIC:
+		raise ValueError("This is not a saved game.")
+	if version == 1:
+		(depth, seed, playerId, stairsId, playerLevel) = reader.unpack(GAME_RECORD_V1)
+		return (version, depth, seed, 0, playerId, stairsId, playerLevel, 0, 0)
+	if version == 2:
+		return (version,) + reader.unpack(GAME_RECORD_V2) + (0, 0)
+	if version == 3:
+		return (version,) + reader.unpack(GAME_RECORD_V3) + (0,)
+	if version in (4, SAVE_VERSION):
+		return (version,) + reader.unpack(GAME_RECORD)
+	raise ValueError("This game was saved in an unknown format, version " + str(version) + ".")
+
+#This function writes the contents of a save file to disk. They go to a temporary file first, which
+#then replaces the old save, so that a crash halfway through can't leave a broken save behind.
+def writeSaveFile(data, path):
+	temporaryPath = path + ".tmp"
+	file = open(temporaryPath, "wb")
+	try:
+		file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	finally:
+		file.close()
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(temporaryPath, path)
+
+#This function writes the contents of a save file to the given slot, and brings the slot's entry in the
+#save index up to date. Any journals of the turns before the save are no longer needed.
+def writeSlot(slot, data, info):
+	writeSaveFile(data, saveFilePath(slot))
+	info.size = len(data)
+	info.checksum = zlib.crc32(data) & 0xFFFFFFFF
+	infos = readSlotIndex()
+	infos[slot] = info
+	writeSlotIndex(infos)
+	removeJournals(slot, info.generation)
+
+#This function saves the whole game, and waits until it is on the disk.
 def saveGame():
-	file = shelve.open("savegame", "n")
-	file["map"] = map
-	file["objects"] = objects
-	file["playerIndex"] = objects.index(player)
-	file["inventory"] = inventory
-	file["messageLog"] = messageLog
-	file["gameState"] = gameState
-	file["stairsIndex"] = objects.index(stairsDown)
-	file["dungeonLevel"] = dungeonLevel
-	file.close()
+	global saveGeneration
+	saver.wait()
+	saveGeneration += 1
+	levelCache.flush()
+	writeSlot(saveSlot, encodeGame(), SlotInfo())
+
+#The SaveWorker class writes saves to disk on a background thread, one at a time, so that the game doesn't
+#stop while the disk catches up. The callbacks given with a save are called on the game's own thread, from
+#poll or wait, once the save is finished: onComplete with no arguments, or onError with the exception.
+class SaveWorker:
+	def __init__(self):
+		self.thread = None
+		self.callbacks = None
+		self.error = None
+	
+	#IS BUSY tells whether a save is still being written.
+	def isBusy(self):
+		return self.thread is not None and self.thread.isAlive()
+	
+	#SAVE starts writing the contents of a save file, with its SlotInfo, to a slot in the background, and
+	#returns True. If another save is still being written, nothing is done and False is returned.
+	def save(self, slot, data, info, onComplete = None, onError = None):
+		if self.isBusy():
+			return False
+		self.poll()
+		self.callbacks = (onComplete, onError)
+		self.error = None
+		self.thread = threading.Thread(target = self.run, args = (slot, data, info))
+		self.thread.start()
+		return True
 	
-#This function loads a game file by opening a saved shelve.
-def loadGame():
-	global map, objects, player, inventory, messageLog, gameState, stairsDown, dungeonLevel
+	#RUN is the body of the background thread. Any error at all is kept for onError, since an error left to
+	#end the thread would leave the save reported as finished.
+	def run(self, slot, data, info):
+		try:
+			writeSlot(slot, data, info)
+		except Exception, error:
+			self.error = error
+	
+	#POLL calls the callbacks of the last save, if it has finished since the last poll.
+	def poll(self):
+		if self.thread is None or self.thread.isAlive():
+			return
+		self.thread = None
+		(onComplete, onError) = self.callbacks
+		if self.error is not None:
+			if onError:
+				onError(self.error)
+		elif onComplete:
+			onComplete()
+	
+	#WAIT waits for the save being written, if any, to finish, and calls its callbacks.
+	def wait(self):
+		if self.thread is not None:
+			self.thread.join()
+		self.poll()
+
+#This function saves the whole game in the background, returning at once. The game is encoded right away,
+#which takes well under a millisecond and so gives a consistent snapshot of it, and the snapshot is written
+#to disk by the save worker. Only one save is written at a time: if one is already being written, nothing is
+#saved and False is returned. Otherwise, once the save is finished, onComplete or onError is called from the
+#game loop. If the journal is running, the save becomes the start of a new generation of it.
+def saveGameAsync(onComplete = None, onError = None):
+	global saveGeneration
+	if saver.isBusy():
+		return False
+	
+	#The journal is brought up to the moment of the save, so that it still leads up to the new generation
+	#if the save is never finished.
+	journal.writeChanges()
+	saveGeneration += 1
+	levelCache.flush()
+	saver.save(saveSlot, encodeGame(), SlotInfo(), onComplete, onError)
+	journal.newGeneration()
+	return True
+
+#This function tells the player that a save failed.
+def saveFailed(error):
+	message("The game could not be saved: " + str(error), libtcod.red)
+	
+#This function loads the game saved in the given slot, which becomes the slot the game is saved to. Games
+#saved in the binary format are preferred, and a game saved before it, in a shelve, is loaded into the
+#first slot if there is no binary save there. The turns journaled since the game was last saved in full
+#are then replayed on top of it.
+def loadGame(slot = 0):
+	global map, occupancy, scheduler, saveSlot, currentLevel
+	
+	if os.path.exists(saveFilePath(slot)):
+		file = open(saveFilePath(slot), "rb")
+		try:
+			data = file.read()
+		finally:
+			file.close()
+		
+		#A save that doesn't match the checksum in the save index was damaged after it was written. The
+		#index may also be behind the save, if the game stopped between writing the two, and then there is
+		#nothing to check against.
+		info = readSlotIndex()[slot]
+		if (info is not None and info.generation == readGameRecord(SaveReader(data))[3] and
+			info.checksum != zlib.crc32(data) & 0xFFFFFFFF):
+			raise ValueError("The saved game is damaged.")
+		
+		saveSlot = slot
+		decodeGame(data)
+		replayJournals()
+	elif slot == 0 and legacySaveExists():
+		saveSlot = slot
+		loadLegacyGame()
+	else:
+		raise IOError("There is no saved game in slot " + str(slot + 1) + ".")
 	
-	file = shelve.open("savegame", "r")
+	#Games saved before the map became a TileGrid store a list of lists of Tiles.
+	if isinstance(map, list):
+		map = TileGrid.fromTiles(map)
+	
+	#The spatial index and the turn schedule aren't saved, since they can be rebuilt from the objects.
+	occupancy = SpatialIndex(objects)
+	scheduler = TurnScheduler([obj for obj in objects if obj.ai])
+	
+	#The random streams aren't saved either, so they start over from the game's seed.
+	seedRandomStreams()
+	
+	#The levels the player has left are in the slot's level archive.
+	forgetLevels()
+	archive.open(levelArchivePath(saveSlot))
+	continueObjectIds([], archive.maxUid)
+	
+	currentLevel = levelFromGlobals()
+	initializeFOV()
+	pregenerateNextLevel()
+
+#This function loads a game saved in a shelve, before the binary save format.
+def loadLegacyGame():
+	global map, objects, player, inventory, messageLog, gameState, stairsDown, stairsUp, dungeonLevel, gameSeed
+	global saveGeneration, turnCount
+	
+	file = shelve.open(LEGACY_SAVE_FILE, "r")
 	map = file["map"]
 	objects = file["objects"]
 	player = objects[file["playerIndex"]]
 	inventory = file["inventory"]
-	messageLog = file["messageLog"]
+	messageLog = MessageLog(file["messageLog"])
 	gameState = file["gameState"]
 	stairsDown = objects[file["stairsIndex"]]
+	stairsUp = None
 	dungeonLevel = file["dungeonLevel"]
+	
+	#Games saved before levels were seeded get a new seed for the levels still to come.
+	if "gameSeed" in file:
+		gameSeed = file["gameSeed"]
+	else:
+		gameSeed = libtcod.random_get_int(0, 0, 0x7FFFFFFF)
 	file.close()
 	
-	initializeFOV()
+	#Objects saved before objects had ids are given new ones.
+	for obj in objects + inventory:
+		if obj.uid is None:
+			obj.uid = next(objectIds)
+	saveGeneration = 0
+	turnCount = 0
+
+#This function tells whether there is a game saved in a shelve, before the binary save format. Depending on
+#the database module shelve used, it is stored as a file of that name, or with one of these extensions.
+def legacySaveExists():
+	return any(os.path.exists(LEGACY_SAVE_FILE + extension) for extension in ["", ".db", ".dat"])
+
+#########################################################################################################
+#Save slots. The save index is a small file that describes the game saved in each slot: the player's
+#level, the dungeon level, the number of turns played, when it was saved, and the generation, size and
+#checksum of its save file. The main menu lists the slots from the index alone, without loading any of
+#the games, and the index's checksum is used to check a save file when it is loaded. The index is
+#rewritten, the same way as a save file, every time a game is saved.
+SLOT_INDEX_FILE = "savegame.idx"
+SLOT_INDEX_MAGIC = "TMSI"
+SLOT_INDEX_VERSION = 1
+
+#The record of a slot in the index: whether the slot is used, the player's level, the dungeon level, the
+#number of turns, the time of the save, and the save's generation, size and checksum.
+SLOT_RECORD = struct.Struct("<BHHIdIII")
+
+#This function returns the name of the save file of a slot. The first slot's has no number, so that games
+#saved before there were slots are found in it.
+def saveFilePath(slot):
+	if slot == 0:
+		return "savegame.sav"
+	return "savegame%d.sav" % (slot + 1)
+
+#The SlotInfo class describes the game saved in a slot. Made with no arguments, it describes the current
+#game; the size and checksum of its save are filled in once the save is written.
+class SlotInfo:
+	def __init__(self, playerLevel = None, depth = None, turns = None, savedAt = None, generation = None,
+		size = None, checksum = None):
+		if playerLevel is None:
+			(playerLevel, depth, turns, savedAt, generation) = (player.level, dungeonLevel, turnCount,
+				time.time(), saveGeneration)
+		self.playerLevel = playerLevel
+		self.depth = depth
+		self.turns = turns
+		self.savedAt = savedAt
+		self.generation = generation
+		self.size = size
+		self.checksum = checksum
+	
+	#DESCRIBE returns a line about the saved game, for the menu.
+	def describe(self):
+		return "Courage %d, dungeon level %d, %d turns, %s" % (self.playerLevel, self.depth, self.turns,
+			time.strftime("%d %b %Y %H:%M", time.localtime(self.savedAt)))
+
+#This function reads the save index, returning a SlotInfo, or None, for each slot. A missing or damaged
+#index reads as if every slot were empty.
+def readSlotIndex():
+	infos = [None] * SAVE_SLOTS
+	try:
+		file = open(SLOT_INDEX_FILE, "rb")
+		try:
+			reader = SaveReader(file.read())
+		finally:
+			file.close()
+		(magic, version, count) = reader.unpack("<4sHH")
+		if magic != SLOT_INDEX_MAGIC or version != SLOT_INDEX_VERSION:
+			return infos
+		for slot in range(count):
+			record = reader.unpack(SLOT_RECORD)
+			if record[0] and slot < SAVE_SLOTS:
+				infos[slot] = SlotInfo(*record[1:])
+	except (IOError, ValueError):
+		pass
+	return infos
+
+#This function writes the save index, from a SlotInfo, or None, for each slot.
+def writeSlotIndex(infos):
+	writer = SaveWriter()
+	writer.pack("<4sHH", SLOT_INDEX_MAGIC, SLOT_INDEX_VERSION, len(infos))
+	for info in infos:
+		if info is None:
+			writer.pack(SLOT_RECORD, 0, 0, 0, 0, 0, 0, 0, 0)
+		else:
+			writer.pack(SLOT_RECORD, 1, info.playerLevel, info.depth, info.turns, info.savedAt, info.generation,
+				info.size, info.checksum)
+	writeSaveFile(writer.getData(), SLOT_INDEX_FILE)
+
+#This function describes the game saved in a slot from the start of its save file, for a save the index
+#doesn't know about. The checksum isn't known, since that would take reading the whole file.
+def readSlotHeader(slot):
+	file = open(saveFilePath(slot), "rb")
+	try:
+		record = readGameRecord(SaveReader(file.read(6 + GAME_RECORD.size)))
+	finally:
+		file.close()
+	(version, depth, seed, generation, playerId, stairsId, playerLevel, turns, stairsUpId) = record
+	return SlotInfo(playerLevel, depth, turns, os.path.getmtime(saveFilePath(slot)), generation,
+		os.path.getsize(saveFilePath(slot)))
+
+#This function lists the saved games, describing each slot in a line for the menu. It takes no more than
+#reading the index and the first few bytes of each save file, to make sure the index is up to date with
+#it. A slot is None if it is empty.
+def listSaveSlots():
+	infos = readSlotIndex()
+	lines = []
+	for slot in range(SAVE_SLOTS):
+		if not os.path.exists(saveFilePath(slot)):
+			if slot == 0 and legacySaveExists():
+				lines.append("An adventure saved by an older version")
+			else:
+				lines.append(None)
+			continue
+		
+		try:
+			info = infos[slot]
+			header = readSlotHeader(slot)
+			if info is None or (info.generation, info.size) != (header.generation, header.size):
+				info = header
+			lines.append(info.describe())
+		except (IOError, ValueError):
+			lines.append("A damaged save")
+	return lines
+
+#########################################################################################################
+#The level archive. The levels the player has left are kept in one archive file per save slot, so that
+#they can be visited again without keeping every one of them in memory. Each level is stored as one record,
+#appended to the end of the file: a LEVEL_RECORD, the map's three tile layers, one byte per cell, and then
+#its objects, written as in a save file. After the records comes the archive's index, which gives the
+#offset and length of the latest record of each depth, and then a footer that gives the index's offset.
+#Storing a level again appends a new record and a new index, so a crash halfway through a store leaves the
+#archive as it was, and the file is compacted once most of it is old records. The file is read through
+#mmap, so the tile layers of a stored level can be looked at where they lie, without copying them, and a
+#level is only decoded when the player enters it.
+ARCHIVE_MAGIC = "TMLA"
+ARCHIVE_VERSION = 2
+ARCHIVE_HEADER = struct.Struct("<4sH")
+#The fixed fields of a level's record: depth, seed, map size, the stairs' id, where the player starts, and
+#the id of the stairs up, which is 0 on the first level.
+LEVEL_RECORD = struct.Struct("<HIHHIhhI")
+#Version 1 records had no stairs up. Version 1 archives are rewritten in the current version when opened.
+LEVEL_RECORD_V1 = struct.Struct("<HIHHIhh")
+#An entry in the index: the depth, and the offset and length of its record.
+ARCHIVE_ENTRY = struct.Struct("<HII")
+#The footer: the index's offset, the highest object id in the archive, and a mark that ends the file.
+ARCHIVE_FOOTER = struct.Struct("<II4s")
+ARCHIVE_FOOTER_MARK = "TMLX"
+
+#The archive is compacted when a store leaves more than this many bytes of old records behind, and they
+#take up more than half the file.
+ARCHIVE_COMPACT_SIZE = 1 << 20
+
+#The tile layers of a level's record, in the order they are stored.
+ARCHIVE_LAYERS = ["blocked", "blockSight", "explored"]
+
+#This function returns the name of the level archive of a save slot.
+def levelArchivePath(slot):
+	return os.path.splitext(saveFilePath(slot))[0] + ".lvl"
+
+#The LevelArchive class stores the levels of a game that the player isn't on.
+class LevelArchive:
+	def __init__(self):
+		self.path = None
+		self.temporary = False
+		self.file = None
+		self.view = None
+		self.index = {}
+		self.maxUid = 0
+		self.end = 0
+		self.version = ARCHIVE_VERSION
+	
+	#OPEN opens the archive at the given path. If reset is set, the archive there is deleted, and the game
+	#starts with an empty one. The file is only made when the first level is stored, and a temporary
+	#archive's file is deleted when it is closed. An archive that can't be read is started over.
+	def open(self, path, reset = False, temporary = False):
+		self.close()
+		(self.path, self.temporary) = (path, temporary)
+		if reset and os.path.exists(path):
+			os.remove(path)
+		if os.path.exists(path):
+			self.file = open(path, "r+b")
+			try:
+				self.readIndex()
+			except (ValueError, struct.error):
+				self.close()
+				self.path = path
+			else:
+				if self.version != ARCHIVE_VERSION:
+					self.compact()
+	
+	#MAKE FILE starts the archive's file, empty, if there isn't one yet.
+	def makeFile(self):
+		if self.file is None:
+			self.file = open(self.path, "w+b")
+			self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+			(self.index, self.maxUid, self.version) = ({}, 0, ARCHIVE_VERSION)
+			self.writeIndex()
+	
+	#READ INDEX reads the index from the end of the file.
+	def readIndex(self):
+		self.file.seek(0, os.SEEK_END)
+		self.end = self.file.tell()
+		if self.end < ARCHIVE_HEADER.size + ARCHIVE_FOOTER.size:
+			raise ValueError("The level archive is truncated.")
+		data = self.getView()
+		(magic, version) = ARCHIVE_HEADER.unpack_from(data, 0)
+		(indexOffset, self.maxUid, mark) = ARCHIVE_FOOTER.unpack_from(data, self.end - ARCHIVE_FOOTER.size)
+		if magic != ARCHIVE_MAGIC or version not in (1, ARCHIVE_VERSION) or mark != ARCHIVE_FOOTER_MARK:
+			raise ValueError("This is not a level archive.")
+		self.version = version
+		
+		reader = SaveReader(data, indexOffset)
+		(count,) = reader.unpack("<I")
+		self.index = {}
+		for i in range(count):
+			(depth, offset, length) = reader.unpack(ARCHIVE_ENTRY)
+			self.index[depth] = (offset, length)
+	
+	#WRITE INDEX appends the index and the footer to the end of the file, which makes the records written
+	#before them part of the archive.
+	def writeIndex(self):
+		self.file.seek(0, os.SEEK_END)
+		indexOffset = self.file.tell()
+		writer = SaveWriter()
+		writer.pack("<I", len(self.index))
+		for depth in sorted(self.index):
+			writer.pack(ARCHIVE_ENTRY, depth, *self.index[depth])
+		writer.pack(ARCHIVE_FOOTER, indexOffset, self.maxUid, ARCHIVE_FOOTER_MARK)
+		self.file.write(writer.getData())
+		self.file.flush()
+		self.end = self.file.tell()
+		self.closeView()
+	
+	#GET VIEW returns the whole file, mapped into memory. The mapping is made again after the file grows,
+	#and the one before it is closed, so nothing read from it without copying may be kept past a store.
+	def getView(self):
+		if self.view is None:
+			self.view = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+		return self.view
+	
+	#CLOSE VIEW closes the mapping of the file, if there is one. Windows can't delete or replace a file
+	#that is still mapped.
+	def closeView(self):
+		if self.view is not None:
+			self.view.close()
+			self.view = None
+	
+	#HAS tells whether the level at the given depth is in the archive.
+	def has(self, depth):
+		return depth in self.index
+	
+	#STORE adds a level to the archive, replacing the level at its depth if there was one.
+	def store(self, level):
+		self.makeFile()
+		writer = SaveWriter()
+		map = level.map
+		writer.pack(LEVEL_RECORD, level.depth, level.seed, map.width, map.height, level.stairsDown.uid,
+			level.start[0], level.start[1], level.stairsUp.uid if level.stairsUp else 0)
+		for name in ARCHIVE_LAYERS:
+			writer.parts.append(toFlagArray(getattr(map, name)).tostring())
+		writer.pack("<I", len(level.objects))
+		for obj in level.objects:
+			writeObject(writer, obj)
+		data = writer.getData()
+		
+		self.file.seek(0, os.SEEK_END)
+		offset = self.file.tell()
+		self.file.write(data)
+		self.index[level.depth] = (offset, len(data))
+		self.maxUid = max([self.maxUid] + [obj.uid for obj in level.objects])
+		self.writeIndex()
+		
+		#Every store leaves the old record of its depth, if any, and the old index behind.
+		wasted = self.end - ARCHIVE_HEADER.size - sum(length for (offset, length) in self.index.values())
+		if wasted > ARCHIVE_COMPACT_SIZE and wasted * 2 > self.end:
+			self.compact()
+	
+	#LAYER returns one of the tile layers of a stored level, without copying it out of the file: a NumPy
+	#array of flags if NumPy is available, and a buffer of bytes that are 0 or 1 otherwise. Either one can
+	#only be read, and only until the next store.
+	def layer(self, depth, name):
+		(offset, length) = self.index[depth]
+		data = self.getView()
+		(depth, seed, width, height) = LEVEL_RECORD.unpack_from(data, offset)[:4]
+		start = offset + LEVEL_RECORD.size + ARCHIVE_LAYERS.index(name) * width * height
+		if numpyAvailable:
+			return numpy.frombuffer(data, dtype = numpy.bool_, count = width * height, offset = start)
+		return buffer(data, start, width * height)
+	
+	#LOAD decodes the level at the given depth into a Level, ready to be entered.
+	def load(self, depth):
+		(offset, length) = self.index[depth]
+		data = self.getView()
+		reader = SaveReader(data, offset)
+		(depth, seed, width, height, stairsId, startX, startY, stairsUpId) = reader.unpack(LEVEL_RECORD)
+		
+		level = Level(depth, seed, width, height)
+		for name in ARCHIVE_LAYERS:
+			if numpyAvailable:
+				layer = numpy.frombuffer(data, dtype = numpy.bool_, count = width * height, offset = reader.offset)
+				setattr(level.map, name, layer.copy())
+				reader.offset += width * height
+			else:
+				setattr(level.map, name, array.array("B", reader.read(width * height)))
+		(count,) = reader.unpack("<I")
+		for i in range(count):
+			level.add(readObject(reader))
+		byId = dict((obj.uid, obj) for obj in level.objects)
+		(level.stairsDown, level.stairsUp) = (byId[stairsId], byId.get(stairsUpId))
+		level.start = (startX, startY)
+		return level
+	
+	#COMPACT rewrites the archive with only the latest record of each depth, in the current version.
+	def compact(self):
+		data = self.getView()
+		temporaryPath = self.path + ".tmp"
+		file = open(temporaryPath, "wb")
+		try:
+			file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+			index = {}
+			for depth in sorted(self.index):
+				(offset, length) = self.index[depth]
+				index[depth] = (file.tell(), length)
+				if self.version == 1:
+					fields = LEVEL_RECORD_V1.unpack_from(data, offset)
+					file.write(LEVEL_RECORD.pack(*(fields + (0,))))
+					(offset, length) = (offset + LEVEL_RECORD_V1.size, length - LEVEL_RECORD_V1.size)
+					index[depth] = (index[depth][0], length + LEVEL_RECORD.size)
+				file.write(data[offset:offset + length])
+		finally:
+			file.close()
+		
+		self.closeView()
+		self.file.close()
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		os.rename(temporaryPath, self.path)
+		self.file = open(self.path, "r+b")
+		(self.index, self.version) = (index, ARCHIVE_VERSION)
+		self.writeIndex()
+	
+	#CLOSE closes the archive.
+	def close(self):
+		self.closeView()
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+		if self.temporary and os.path.exists(self.path):
+			os.remove(self.path)
+		(self.path, self.temporary, self.index, self.maxUid) = (None, False, {}, 0)
+
+#########################################################################################################
+#The autosave journal. Between full saves, the changes made in each turn are appended to a journal: moves,
+#changes in condition, objects that change in any other way (such as dying), objects that come, go or
+#change places (such as items picked up), newly explored cells, and the message log. The journal belongs
+#to one generation of the save file, and a journal's turns start where the full save of its generation, or
+#the journal before it, left off, so loading replays every journal from the save's generation on. Every
+#JOURNAL_COMPACT_TURNS turns, and on every new level, the journal is compacted: the whole game is saved
+#again, in the background, as the next generation, and the journals before it are deleted. A journal ends
+#with a level change entry when the player leaves the level, since the journal after it describes another
+#level, and can only be replayed on top of its own generation's save. Version 2 added that entry, and
+#version 3 the message history entry, which holds the messages added to the history; journals of versions 1
+#and 2 are still replayed, without the history they didn't keep.
+JOURNAL_MAGIC = "TMJL"
+JOURNAL_VERSION = 3
+JOURNAL_COMPACT_TURNS = 100
+
+#The kinds of entry a journal frame is made of.
+JOURNAL_OBJECT = 1
+JOURNAL_MOVE = 2
+JOURNAL_CONDITION = 3
+JOURNAL_ORDER = 4
+JOURNAL_EXPLORED = 5
+JOURNAL_TERRAIN = 6
+JOURNAL_MESSAGES = 7
+JOURNAL_STATE = 8
+JOURNAL_TURNS = 9
+JOURNAL_LEVEL_CHANGE = 10
+JOURNAL_HISTORY = 11
+
+#Each frame of the journal starts with its length and a checksum, so that a frame cut short by a crash is
+#recognized, and replaying stops there.
+JOURNAL_FRAME = struct.Struct("<II")
+
+#This function returns the name of the journal for the given generation of the save in the current slot.
+def journalPath(generation):
+	return "%s.%d.jnl" % (os.path.splitext(saveFilePath(saveSlot))[0], generation)
+
+#This function deletes the journals of a slot of every generation before the given one, or all of them.
+def removeJournals(slot, generation = None):
+	prefix = os.path.splitext(saveFilePath(slot))[0] + "."
+	for name in os.listdir("."):
+		middle = name[len(prefix):-len(".jnl")]
+		if (name.startswith(prefix) and name.endswith(".jnl") and middle.isdigit() and
+			(generation is None or int(middle) < generation)):
+			os.remove(name)
+
+#This function returns the cells where two flag arrays differ.
+def changedCells(current, previous):
+	if numpyAvailable:
+		return numpy.flatnonzero(current != previous).tolist()
+	return [i for i in range(len(current)) if current[i] != previous[i]]
+
+#This function returns everything about an object that the journal tracks, apart from its position and
+#condition, which change most often and are journaled on their own.
+def objectTraits(obj):
+	fighter = obj.fighter
+	ai = []
+	component = obj.ai
+	while component is not None:
+		ai.append((component.__class__.__name__, getattr(component, "numberOfTurns", None)))
+		component = getattr(component, "oldAI", None)
+	return (obj.glyph, obj.name, tuple(obj.color), obj.blocks, obj.alwaysVisible, obj.speed,
+		fighter and (fighter.hits, fighter.atk, fighter.dfn, fighter.xp, fighter.deathEffect),
+		tuple(ai), obj.item and obj.item.useEffect, obj.equipment and (obj.equipment.slot, obj.equipment.isWorn))
+
+#The Journal class writes the autosave journal as the game is played.
+class Journal:
+	def __init__(self):
+		self.file = None
+		self.running = False
+		self.turns = 0
+		
+		#Whether the game may have changed since the last frame was written. It is set wherever the game
+		#changes: when a turn is taken, an item is picked up, used or dropped, a message is told, or more of
+		#the map is explored.
+		self.changed = False
+	
+	#START begins journaling the current game, with a full save to start from.
+	def start(self):
+		saver.wait()
+		self.running = True
+		saveGameAsync(onError = saveFailed)
+	
+	#TAKE SNAPSHOT remembers the game as it is now, as the starting point for the next turn's changes.
+	def takeSnapshot(self):
+		self.objectStates = dict((obj.uid, (obj.x, obj.y, obj.fighter and obj.fighter.cond, objectTraits(obj)))
+			for obj in objects + inventory)
+		self.order = ([obj.uid for obj in objects], [obj.uid for obj in inventory])
+		self.explored = toFlagArray(map.explored)
+		self.blocked = toFlagArray(map.blocked)
+		self.blockSight = toFlagArray(map.blockSight)
+		self.messages = [(line, tuple(color)) for (line, color) in messageLog]
+		self.history = messageLog.mark()
+		self.state = (dungeonLevel, player.level, gameState)
+		self.turnCount = turnCount
+		self.changed = False
+	
+	#END TURN appends the changes made in the turn to the journal, and compacts the journal when enough
+	#turns have been taken. Nothing is done if nothing has changed.
+	def endTurn(self, turnTaken = True):
+		if self.file is None or not self.changed:
+			return
+		self.writeChanges()
+		if turnTaken:
+			self.turns += 1
+		if self.turns >= JOURNAL_COMPACT_TURNS:
+			self.compact()
+	
+	#WRITE CHANGES appends the changes made since the last snapshot to the journal, as one frame.
+	def writeChanges(self):
+		if self.file is None:
+			return
+		self.changed = False
+		writer = SaveWriter()
+		
+		#Changes to anything but the player, the inventory and the game's state change the level, which then
+		#has to be stored in the level archive again.
+		levelChanged = False
+		everything = objects + inventory
+		states = {}
+		for (i, obj) in enumerate(everything):
+			state = (obj.x, obj.y, obj.fighter and obj.fighter.cond, objectTraits(obj))
+			states[obj.uid] = state
+			old = self.objectStates.get(obj.uid)
+			if old != state and i < len(objects) and obj is not player:
+				levelChanged = True
+			if old is None or old[3] != state[3]:
+				writer.pack("<B", JOURNAL_OBJECT)
+				writeObject(writer, obj)
+				continue
+			if old[:2] != state[:2]:
+				writer.pack("<BIhh", JOURNAL_MOVE, obj.uid, obj.x, obj.y)
+			if old[2] != state[2]:
+				writer.pack("<BIh", JOURNAL_CONDITION, obj.uid, obj.fighter.cond)
+		self.objectStates = states
+		
+		order = ([obj.uid for obj in objects], [obj.uid for obj in inventory])
+		if order != self.order:
+			levelChanged = levelChanged or order[0] != self.order[0]
+			writer.pack("<BII", JOURNAL_ORDER, len(order[0]), len(order[1]))
+			writer.pack("<%dI" % len(everything), *(order[0] + order[1]))
+			self.order = order
+		
+		explored = changedCells(map.explored, self.explored)
+		if explored:
+			levelChanged = True
+			writer.pack("<BI", JOURNAL_EXPLORED, len(explored))
+			writer.pack("<%dI" % len(explored), *explored)
+			self.explored = toFlagArray(map.explored)
+		
+		terrain = sorted(set(changedCells(map.blocked, self.blocked) + changedCells(map.blockSight, self.blockSight)))
+		if terrain:
+			levelChanged = True
+			writer.pack("<BI", JOURNAL_TERRAIN, len(terrain))
+			for i in terrain:
+				writer.pack("<IBB", i, map.blocked[i], map.blockSight[i])
+			self.blocked = toFlagArray(map.blocked)
+			self.blockSight = toFlagArray(map.blockSight)
+		
+		messages = [(line, tuple(color)) for (line, color) in messageLog]
+		if messages != self.messages:
+			writer.pack("<B", JOURNAL_MESSAGES)
+			writeMessages(writer, messageLog)
+			self.messages = messages
+		
+		history = messageLog.mark()
+		if history != self.history:
+			writer.pack("<B", JOURNAL_HISTORY)
+			writeHistory(writer, messageLog.added, messageLog.historySince(self.history[0]))
+			self.history = history
+		
+		state = (dungeonLevel, player.level, gameState)
+		if state != self.state:
+			writer.pack("<BHH", JOURNAL_STATE, dungeonLevel, player.level)
+			writer.string(gameState)
+			self.state = state
+		
+		if turnCount != self.turnCount:
+			writer.pack("<BI", JOURNAL_TURNS, turnCount)
+			self.turnCount = turnCount
+		
+		if levelChanged:
+			currentLevel.dirty = True
+		
+		#The frame is handed to the operating system at the end of every turn, but the disk is only made to
+		#catch up when the journal is compacted.
+		payload = writer.getData()
+		if payload:
+			self.file.write(JOURNAL_FRAME.pack(len(payload), zlib.crc32(payload) & 0xFFFFFFFF))
+			self.file.write(payload)
+			self.file.flush()
+	
+	#LEAVE LEVEL appends the last changes made on the level the player is leaving, and ends the journal with
+	#a level change entry. Nothing more is journaled until the next generation is saved with the new level.
+	def leaveLevel(self):
+		if self.file is None:
+			return
+		self.writeChanges()
+		payload = struct.pack("<B", JOURNAL_LEVEL_CHANGE)
+		self.file.write(JOURNAL_FRAME.pack(len(payload), zlib.crc32(payload) & 0xFFFFFFFF))
+		self.file.write(payload)
+		self.closeFile()
+	
+	#COMPACT saves the whole game as the next generation, and starts that generation's journal. If the
+	#previous save is still being written, compacting waits for a later turn and the current journal carries
+	#on, unless wait is set, as it is on a new level, in which case it waits for the save to finish.
+	def compact(self, wait = False):
+		if not self.running:
+			return
+		if wait:
+			saver.wait()
+		saveGameAsync(onError = saveFailed)
 	
+	#NEW GENERATION starts the journal of the save generation that was just saved, if journaling is on.
+	def newGeneration(self):
+		if not self.running:
+			return
+		self.closeFile()
+		self.file = open(journalPath(saveGeneration), "wb")
+		self.file.write(struct.pack("<4sHI", JOURNAL_MAGIC, JOURNAL_VERSION, saveGeneration))
+		self.file.flush()
+		self.takeSnapshot()
+		self.turns = 0
+	
+	#CLOSE FILE closes the current journal, after making sure all of it is on the disk.
+	def closeFile(self):
+		if self.file is not None:
+			self.file.flush()
+			os.fsync(self.file.fileno())
+			self.file.close()
+			self.file = None
+	
+	#STOP stops journaling, once any save being written in the background is finished.
+	def stop(self):
+		saver.wait()
+		self.running = False
+		self.closeFile()
+
+#This function replays the journals of the generations since the loaded save, turn by turn, bringing the
+#game up to the last turn that was journaled.
+def replayJournals():
+	global objects, inventory, gameState, dungeonLevel, saveGeneration, turnCount
+	
+	everything = dict((obj.uid, obj) for obj in objects + inventory)
+	generation = saveGeneration
+	while os.path.exists(journalPath(generation)):
+		file = open(journalPath(generation), "rb")
+		try:
+			data = file.read()
+		finally:
+			file.close()
+		
+		reader = SaveReader(data)
+		(magic, version, journalGeneration) = reader.unpack("<4sHI")
+		if magic != JOURNAL_MAGIC or not 1 <= version <= JOURNAL_VERSION or journalGeneration != generation:
+			break
+		
+		levelChanged = False
+		while not reader.atEnd() and not levelChanged:
+			#A frame that was cut short, or doesn't match its checksum, ends the journal.
+			try:
+				(length, checksum) = reader.unpack(JOURNAL_FRAME)
+				payload = reader.read(length)
+			except ValueError:
+				break
+			if zlib.crc32(payload) & 0xFFFFFFFF != checksum:
+				break
+			frame = SaveReader(payload)
+			while not frame.atEnd():
+				(kind,) = frame.unpack("<B")
+				if kind == JOURNAL_OBJECT:
+					replaceObject(everything, readObject(frame))
+				elif kind == JOURNAL_MOVE:
+					(uid, x, y) = frame.unpack("<Ihh")
+					(everything[uid].x, everything[uid].y) = (x, y)
+				elif kind == JOURNAL_CONDITION:
+					(uid, cond) = frame.unpack("<Ih")
+					everything[uid].fighter.cond = cond
+				elif kind == JOURNAL_ORDER:
+					(objectCount, inventoryCount) = frame.unpack("<II")
+					uids = frame.unpack("<%dI" % (objectCount + inventoryCount))
+					objects[:] = [everything[uid] for uid in uids[:objectCount]]
+					inventory[:] = [everything[uid] for uid in uids[objectCount:]]
+				elif kind == JOURNAL_EXPLORED:
+					(count,) = frame.unpack("<I")
+					for i in frame.unpack("<%dI" % count):
+						map.explored[i] = True
+				elif kind == JOURNAL_TERRAIN:
+					(count,) = frame.unpack("<I")
+					for n in range(count):
+						(i, blocked, blockSight) = frame.unpack("<IBB")
+						map.blocked[i] = blocked
+						map.blockSight[i] = blockSight
+				elif kind == JOURNAL_MESSAGES:
+					messageLog.showLines(readMessages(frame))
+				elif kind == JOURNAL_HISTORY:
+					messageLog.updateHistory(*readHistory(frame))
+				elif kind == JOURNAL_STATE:
+					(dungeonLevel, player.level) = frame.unpack("<HH")
+					gameState = frame.string()
+				elif kind == JOURNAL_TURNS:
+					(turnCount,) = frame.unpack("<I")
+				elif kind == JOURNAL_LEVEL_CHANGE:
+					levelChanged = True
+				else:
+					raise ValueError("The journal holds an unknown kind of entry.")
+		
+		saveGeneration = generation
+		generation += 1
+		
+		#The journals after a level change belong to a save of the new level, which must not have been
+		#finished, or it would have been loaded instead. The game is replayed up to leaving the level.
+		if levelChanged:
+			break
+	continueObjectIds(everything.values())
+
+#This function brings an object up to date with a newer copy of it read from the journal. The object
+#itself is kept, since other parts of the game, such as the player and stairsDown globals, refer to it.
+def replaceObject(everything, newer):
+	obj = everything.get(newer.uid)
+	if obj is None:
+		everything[newer.uid] = newer
+		return
+	
+	level = getattr(obj, "level", None)
+	obj.__dict__.clear()
+	obj.__dict__.update(newer.__dict__)
+	if level is not None:
+		obj.level = level
+	for component in (obj.fighter, obj.ai, obj.item, obj.equipment):
+		if component is not None:
+			component.owner = obj
+	ai = obj.ai
+	while isinstance(ai, ConfusedMonster) and ai.oldAI is not None:
+		ai.oldAI.owner = obj
+		ai = ai.oldAI
+
+#This function shows a menu of the save slots, each with the game saved in it, as listed by listSaveSlots,
+#and returns the slot chosen.
+def saveSlotMenu(header, slots = None):
+	if slots is None:
+		slots = listSaveSlots()
+	options = [line or "Empty" for line in slots]
+	return menu(header, options, SAVE_SLOT_MENU_WIDTH)
+
 #This function announces something using the menu function as an impromptu message box.
 def announce(text, width = 50):
 	menu(text, [], width)
 	
-#This function advances to the next level in the dungeon.
+#This function advances to the next level in the dungeon. The level is usually built already, in the
+#background, so there is no wait.
 def nextLevel():
-	global dungeonLevel
-	
 	message("You take a moment to rest and recover your strength.", libtcod.light_violet)
 	player.fighter.heal(player.fighter.hits / 2)
 	
 	message("After a rare moment of peace, you descend deeper into the heart of the dungeon...", libtcod.red)
-	dungeonLevel += 1
-	makeMap()
-	initializeFOV()
+	leaveLevel()
+	enterLevel(takeLevel(dungeonLevel + 1))
+	journal.compact(wait = True)
+
+#This function goes back up to the level above, where the player arrives on its stairs down.
+def previousLevel():
+	message("You climb back up towards the light.", libtcod.light_violet)
+	leaveLevel()
+	level = takeLevel(dungeonLevel - 1)
+	enterLevel(level, (level.stairsDown.x, level.stairsDown.y))
+	journal.compact(wait = True)
 	
 #This function watches the player's experience points and controls level ups.
 def checkLevelup():
@@ -1130,8 +3810,8 @@ def checkLevelup():
 				
 #This function chooses one option from a list of chances, returning its index. The dice will land 
 #on some number between one and the sum of the chances.
-def randomChoiceIndex(chances):
-	dice = libtcod.random_get_int(0, 1, sum(chances))
+def randomChoiceIndex(chances, rng = 0):
+	dice = libtcod.random_get_int(rng, 1, sum(chances))
 	
 	#Go through all chances, keeping the sum so far.
 	runningSum = 0
@@ -1145,11 +3825,11 @@ def randomChoiceIndex(chances):
 		choice += 1
 
 #This function chooses one option randomly from a dictionary of choices, returning its key.
-def chooseFromDict(possibilityDictionary):
+def chooseFromDict(possibilityDictionary, rng = 0):
 	chances = possibilityDictionary.values()
 	possibilities = possibilityDictionary.keys()
 	
-	return possibilities[randomChoiceIndex(chances)]
+	return possibilities[randomChoiceIndex(chances, rng)]
 	
 #This function returns the equipment in a given slot, or None if it is empty.
 def getEquippedInSlot(slot):
@@ -1158,10 +3838,12 @@ def getEquippedInSlot(slot):
 			return obj.equipment
 	return None
 
-#This function returns a value that depends on level. The table's pairs are in the format [value, level]. The table specifies what value occurs after each level, default is zero. This function uses the REVERSED function from the Python standard library. Attempting to loop in the regular order will always return the value on the first element. This function assumes that the table sorted by level in ascending order, but it is possible to enforce this strictly with the sort function.
-def fromDungeonLevel(table):
+#This function returns a value that depends on level. The table's pairs are in the format [value, level]. The table specifies what value occurs after each level, default is zero. This function uses the REVERSED function from the Python standard library. Attempting to loop in the regular order will always return the value on the first element. This function assumes that the table sorted by level in ascending order, but it is possible to enforce this strictly with the sort function. The level checked is the current dungeon level, unless another depth is given.
+def fromDungeonLevel(table, depth = None):
+	if depth is None:
+		depth = dungeonLevel
 	for(value, level) in reversed(table):
-		if dungeonLevel >= level:
+		if depth >= level:
 			return value
 	return 0
 
@@ -1174,7 +3856,58 @@ libtcod.sys_set_fps(FPS_LIMIT)
 con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
 panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
 
-mainMenu()
+#The objects on the map, as drawn on con.
+entityLayer = EntityLayer(MAP_WIDTH, MAP_HEIGHT)
+
+#The status panel, drawn on panel: the names of the objects under the mouse, the player's health, the
+#dungeon level, and the message log.
+statusPanel = StatusPanel(panel, [
+	PanelWidget(1, 0, SCREEN_WIDTH - 1, 1, getNamesUnderMouse, renderNamesUnderMouse),
+	PanelWidget(1, 1, BAR_WIDTH, 1, healthInputs, renderHealth),
+	PanelWidget(1, 3, BAR_WIDTH, 1, dungeonLevelInputs, renderDungeonLevel),
+	PanelWidget(MESSAGE_X, 1, MESSAGE_WIDTH, MESSAGE_HEIGHT, messageLogInputs, renderMessages)])
+
+#The consoles no longer in use, and the windows of the menus shown most recently.
+consolePool = ConsolePool()
+menuCache = MenuCache(consolePool)
+
+#The title screen, whose picture is loaded when the main menu is first shown.
+titleScreen = TitleScreen("menu_background1.png")
+
+#The current level, and its FOV map and the monsters' shared flow field, which initializeFOV takes from it.
+currentLevel = None
+fovMap = None
+flowField = None
+
+#The levels the player has left most recently.
+levelCache = LevelCache()
+
+#The background builder of the next level.
+pregenerator = LevelPregenerator()
+
+#The save slot the current game is saved to, and the archive of the levels the player has left.
+saveSlot = 0
+archive = LevelArchive()
+
+#The background writer of saves, and the autosave journal, which is started when play begins.
+saver = SaveWorker()
+journal = Journal()
+
+#The random streams of the current game, by subsystem, which are created when the game begins.
+randomStreams = {}
+
+#The recorder of the game's input, and the recording being played back, if any. Nothing is drawn while a
+#recording is played back.
+recorder = InputRecorder()
+inputReplay = None
+renderingEnabled = True
+
+#Whether anything on the screen has changed since it was last drawn.
+screenNeedsToBeRedrawn = True
+
+#The game only starts when this file is run, so that other scripts, such as the benchmarks, can import it.
+if __name__ == "__main__":
+	mainMenu()
 		
 #random_get_int returns a random number between two numbers, the second and third parameters. The first
 #parameter identifies the "stream" to get that number from. Random number streams are used for recreating